@@ -0,0 +1,76 @@
+"""
+Recall@k vs latency of NumpyVectorStore's IVF backend against exact (flat) search.
+Uses clustered synthetic embeddings by default, or real ones from a persisted index cache entry
+(storage/index/<key>/default__vector_store.npy), with queries drawn from held-out rows.
+
+    python -m benchmarks.bench_ann --rows 100000 --dim 384 --k 10
+    python -m benchmarks.bench_ann --vectors storage/index/<key>/default__vector_store.npy
+"""
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from llamaindex_utils.vector_stores import NumpyVectorStore
+import argparse, statistics, time
+import numpy as np
+
+def clustered_vectors(rows: int, dim: int, clusters: int, noise: float, latent_dim: int = 32, seed: int = 0) -> np.ndarray:
+    """
+    Unit vectors scattered around topic centres in a low-dimensional latent space, projected up to dim.
+    Like real chunk embeddings, they have far fewer degrees of freedom than dimensions (unlike uniform noise).
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, latent_dim)).astype(np.float32)
+    latent = centres[rng.integers(0, clusters, size=rows)] + noise * rng.standard_normal((rows, latent_dim)).astype(np.float32)
+    vectors = latent @ rng.standard_normal((latent_dim, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def build_store(vectors: np.ndarray, **config) -> NumpyVectorStore:
+    store = NumpyVectorStore(**config)
+    for start in range(0, len(vectors), 4096):
+        store.add([TextNode(id_=str(start + i), text="", embedding=vector) for i, vector in enumerate(vectors[start:start + 4096].tolist())])
+    return store
+
+def search(store: NumpyVectorStore, queries: np.ndarray, k: int):
+    results, latencies = [], []
+    for query in queries.tolist():
+        start = time.perf_counter()
+        results.append(store.query(VectorStoreQuery(query_embedding=query, similarity_top_k=k)).ids)
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF vs exact search benchmark")
+    parser.add_argument("--vectors", help=".npy file of embeddings to use instead of synthetic ones")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0, help="0: 4 * sqrt(rows)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        vectors = clustered_vectors(args.rows + args.queries, args.dim, args.clusters, args.noise)
+    vectors, queries = vectors[:-args.queries], vectors[-args.queries:]
+    print(f"--{len(vectors)} rows x {vectors.shape[1]} dims, {len(queries)} queries, k={args.k}--")
+
+    flat = build_store(vectors)
+    exact, flat_latencies = search(flat, queries, args.k)
+    print(f"{'flat (exact)':<16} recall@{args.k} 1.000  mean {statistics.mean(flat_latencies) * 1000:7.2f}ms  "
+          f"p50 {statistics.median(flat_latencies) * 1000:7.2f}ms")
+
+    start = time.perf_counter()
+    ivf = build_store(vectors, ann="ivf", ivf_nlist=args.nlist, ann_min_rows=1)
+    ivf._maybe_train_ivf()
+    print(f"--IVF with {ivf._ivf.nlist} lists built in {round(time.perf_counter() - start, 2)}s (incl. adding rows)--")
+    for nprobe in args.nprobe:
+        if nprobe > ivf._ivf.nlist:
+            break
+        ivf.ivf_nprobe = nprobe
+        approximate, latencies = search(ivf, queries, args.k)
+        recall = statistics.mean(len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact))
+        print(f"{f'ivf nprobe={nprobe}':<16} recall@{args.k} {recall:.3f}  mean {statistics.mean(latencies) * 1000:7.2f}ms  "
+              f"p50 {statistics.median(latencies) * 1000:7.2f}ms")
@@ -0,0 +1,98 @@
+"""
+Measures what connection pooling saves per DockerLLM call, against the mock Docker Model Runner.
+Compares the previous behaviour (a fresh connection per request: bare requests.post / a new aiohttp session per call)
+with DockerLLM's pooled keep-alive sessions, for sequential calls and for concurrent async streams.
+
+    python -m benchmarks.bench_llm_pool --calls 200 --concurrency 8
+"""
+from llama_index.core.llms import ChatMessage, MessageRole
+from llamaindex_utils.integrations import DockerLLM
+from benchmarks.mock_model_runner import MockModelRunner
+from typing import Callable, List
+import argparse, asyncio, json, statistics, time, aiohttp, requests
+
+def summarize(name: str, latencies: List[float], connections: int) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{name:<42} mean {statistics.mean(latencies) * 1000:7.2f}ms  p50 {statistics.median(latencies) * 1000:7.2f}ms  "
+          f"p95 {p95 * 1000:7.2f}ms  connections {connections}")
+
+def time_calls(call: Callable[[], None], calls: int) -> List[float]:
+    call()  # warm-up
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def run_sync(server: MockModelRunner, llm: DockerLLM, calls: int) -> None:
+    payload = {"model": llm.model, "prompt": "ping", "max_tokens": 8, "stream": False}
+
+    def unpooled_complete() -> None:
+        response = requests.post(url=llm._get_completions_endpoint(), json=payload, timeout=llm.timeout)
+        response.raise_for_status()
+        response.json()
+
+    def unpooled_stream() -> None:
+        response = requests.post(url=llm._get_completions_endpoint(), json={**payload, "stream": True}, timeout=llm.timeout, stream=True)
+        for _ in response.iter_lines():
+            pass
+
+    def pooled_stream() -> None:
+        for _ in llm.stream_complete("ping"):
+            pass
+
+    for name, call in [
+        ("complete, new connection per call", unpooled_complete),
+        ("complete, pooled keep-alive", lambda: llm.complete("ping")),
+        ("stream_complete, new connection per call", unpooled_stream),
+        ("stream_complete, pooled keep-alive", pooled_stream),
+    ]:
+        server.reset_stats()
+        summarize(name, time_calls(call, calls), server.connections)
+
+async def run_async(server: MockModelRunner, llm: DockerLLM, calls: int, concurrency: int) -> None:
+    messages = [ChatMessage(role=MessageRole.USER, content="ping")]
+    payload = {"model": llm.model, "messages": [{"role": "user", "content": "ping"}], "stream": True}
+
+    async def unpooled_stream() -> None:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=llm.timeout)) as session:
+            async with session.post(url=llm._get_chat_endpoint(), json=payload) as response:
+                async for _ in response.content:
+                    pass
+
+    async def pooled_stream() -> None:
+        async for _ in await llm.astream_chat(messages):
+            pass
+
+    async def timed(call: Callable, latencies: List[float], semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    for name, call in [
+        (f"astream_chat x{concurrency}, new session per call", unpooled_stream),
+        (f"astream_chat x{concurrency}, pooled keep-alive", pooled_stream),
+    ]:
+        await call()  # warm-up
+        server.reset_stats()
+        latencies: List[float] = []
+        semaphore = asyncio.Semaphore(concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(*(timed(call, latencies, semaphore) for _ in range(calls)))
+        summarize(name, latencies, server.connections)
+        print(f"{'':<42} throughput {calls / (time.perf_counter() - start):7.1f} calls/s")
+    await llm.aclose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DockerLLM connection pooling benchmark")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with MockModelRunner() as server:
+        llm = DockerLLM(model="ai/mock", base_url=server.url, pool_size=args.concurrency)
+        run_sync(server, llm, args.calls)
+        asyncio.run(run_async(server, llm, args.calls, args.concurrency))
@@ -0,0 +1,84 @@
+"""
+Time to the first token of the agent's answer with the RAG tool in synthesize vs extractive mode (RAG_MODE).
+Runs the real PDFAgent (embedding model, index and ReAct agent from .env) against the mock Docker Model Runner on the
+port the agent talks to (12434, stop Docker Model Runner first), scripted like a ReAct model: the first generation
+calls the RAG tool, the RAG tool's synthesis (synthesize mode only) gets a canned answer, and the generation after
+the tool result answers. ttft and token_delay emulate the speed of the chat model.
+
+    python -m benchmarks.bench_rag_mode path/to/file.pdf --questions 5 --ttft 0.5 --token-delay 0.03
+"""
+import os
+os.environ["QUERY_CACHE_SIZE"] = "0"  # every question has to reach the RAG tool
+
+from benchmarks.mock_model_runner import MockModelRunner
+from typing import List, Tuple
+import argparse, asyncio, json, statistics, time
+
+QUESTIONS = [
+    "What is the document about?",
+    "Which safety warnings are given?",
+    "How is the device installed?",
+    "What maintenance does it need?",
+    "Which error messages are described?",
+    "What are the technical specifications?",
+    "Who should I contact for support?",
+    "What does the warranty cover?",
+]
+ANSWER = " ".join(["The document explains this in detail on the pages listed above."] * 3)
+
+def react_reply(payload: dict) -> str:
+    """Plays the chat model's part: a tool call, the RAG synthesis, or the final answer after the tool result."""
+    from src.backend.agent import RAG_TOOL_NAME
+    messages = payload.get("messages") or [{"content": payload.get("prompt", "")}]
+    last = str(messages[-1]["content"])
+    if "Context information" in last:  # the query engine's synthesis prompt
+        return ANSWER
+    if last.startswith("Observation:"):  # the tool result, the system prompt also mentions observations
+        return f"Thought: I can answer without using any more tools.\nAnswer: {ANSWER}"
+    return f"Thought: I need to search the document.\nAction: {RAG_TOOL_NAME}\nAction Input: {json.dumps({'query': last[-200:]})}"
+
+async def ask(agent, question: str) -> Tuple[float, float]:
+    """Returns the seconds until the first token of the answer (after the tool result) and until the end."""
+    start = time.perf_counter()
+    handler = agent.ask_agent(question)
+    first_token, tool_done = None, False
+    async for event in handler.stream_events():
+        name = type(event).__name__
+        if name == "ToolCallResult":
+            tool_done = True
+        elif name == "AgentStream" and tool_done and event.delta and first_token is None:
+            first_token = time.perf_counter() - start
+    await handler
+    return first_token or float("nan"), time.perf_counter() - start
+
+async def run(agent, server: MockModelRunner, questions: List[str]) -> None:
+    for mode in ("synthesize", "extractive"):
+        agent.set_rag_mode(mode)
+        await ask(agent, "Warm-up question?")
+        server.reset_stats()
+        results = [await ask(agent, question) for question in questions]
+        ttft = [first for first, _ in results]
+        total = [end for _, end in results]
+        print(f"{mode:<11} first answer token mean {statistics.mean(ttft):6.2f}s  p50 {statistics.median(ttft):6.2f}s  "
+              f"total mean {statistics.mean(total):6.2f}s  generations/question {server.requests / len(questions):.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAG tool synthesize vs extractive benchmark")
+    parser.add_argument("pdf")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.5, help="Seconds before the mock model's first token")
+    parser.add_argument("--token-delay", type=float, default=0.03, help="Seconds between the mock model's tokens")
+    args = parser.parse_args()
+
+    with MockModelRunner(port=12434, ttft=args.ttft, token_delay=args.token_delay, reply_fn=react_reply) as server:
+        from src.backend.agent import PDFAgent
+        from src.backend.service import PDFService
+        agent = PDFAgent(ui_callbacks={"goto_page": lambda page_number: f"Successfully navigated to page {page_number}"})
+        service = PDFService(agent=agent)
+        service.load_pdf(args.pdf)
+        for document in agent.documents():  # search the whole file, not just the first pages
+            if document.shared.indexing_thread is not None:
+                document.shared.indexing_thread.join()
+        print(f"--Mock model: ttft {args.ttft}s, {args.token_delay}s per token--")
+        asyncio.run(run(agent, server, (QUESTIONS * args.questions)[:args.questions]))
+        service.close()
@@ -0,0 +1,87 @@
+"""
+Recall@k and latency of NumpyVectorStore's retrieval modes: vector (dense), keyword (BM25) and hybrid (RRF of both).
+The corpus is a synthetic service manual whose chunks mention part numbers and error codes, and every query asks for
+one of them, phrased as a question, so exactly one chunk is relevant.
+
+Embeddings come from the embedding model at --embed-model (a GGUF file, like EMBED_MODEL_PATH). Without one, a hashed
+character trigram embedder stands in: like subword embedding models, it sees E0412 and E0413 as near duplicates.
+
+    python -m benchmarks.bench_retrieval --chunks 5000 --queries 300 --k 2
+    python -m benchmarks.bench_retrieval --embed-model local_models/embed/<model>.gguf
+"""
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode
+from llamaindex_utils.vector_stores import NumpyVectorStore
+from typing import Callable, List
+import argparse, hashlib, random, statistics, time
+import numpy as np
+
+TOPICS = ["hydraulic pump", "drive belt", "control board", "cooling fan", "pressure valve", "door sensor", "heating element",
+          "water inlet", "motor brush", "display panel", "drain filter", "spin bearing"]
+FAULTS = ["does not start", "stops mid cycle", "makes a grinding noise", "overheats", "shows no display", "leaks water"]
+QUESTIONS = ["What does error code {code} mean?", "How do I fix error {code}?", "Which part is {part}?", "Where is part number {part} used?"]
+
+def manual_chunks(count: int, seed: int = 0):
+    """Chunks of similar prose, each naming one part number and one error code. Returns (texts, codes, parts)."""
+    rng = random.Random(seed)
+    texts, codes, parts = [], [], []
+    for i in range(count):
+        topic, fault = rng.choice(TOPICS), rng.choice(FAULTS)
+        code, part = f"E{4000 + i:04d}", f"PN-{10000 + 7 * i}"
+        texts.append(f"If the appliance {fault}, check the {topic}. Error code {code} is reported when the {topic} "
+                     f"{fault}. Replace the {topic} with part number {part} and run the self test again.")
+        codes.append(code)
+        parts.append(part)
+    return texts, codes, parts
+
+def trigram_embedder(dim: int = 384) -> Callable[[List[str]], np.ndarray]:
+    """Hashed character trigram counts of every word, an offline stand-in for a subword embedding model."""
+    def embed(texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                word = f"#{word.strip('?.,')}#"
+                for i in range(len(word) - 2):
+                    vectors[row, int.from_bytes(hashlib.blake2b(word[i:i + 3].encode(), digest_size=4).digest(), "little") % dim] += 1
+        return vectors
+    return embed
+
+def model_embedder(model_path: str) -> Callable[[List[str]], np.ndarray]:
+    from llamaindex_utils.integrations import LlamaCppEmbedding
+    model = LlamaCppEmbedding(model_path=model_path, verbose=False)
+    return lambda texts: np.asarray(model.get_text_embedding_batch(texts), dtype=np.float32)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vector vs keyword vs hybrid retrieval benchmark")
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=2, help="Chunks retrieved per query (the RAG tool uses 2)")
+    parser.add_argument("--embed-model", help="GGUF embedding model; a trigram hashing embedder is used without one")
+    args = parser.parse_args()
+
+    embed = model_embedder(args.embed_model) if args.embed_model else trigram_embedder()
+    texts, codes, parts = manual_chunks(args.chunks)
+    start = time.perf_counter()
+    vectors = embed(texts)
+    store = NumpyVectorStore()
+    store.add([TextNode(id_=str(i), text=text, embedding=vector) for i, (text, vector) in enumerate(zip(texts, vectors.tolist()))])
+    print(f"--{args.chunks} chunks embedded and indexed in {round(time.perf_counter() - start, 2)}s "
+          f"({'model ' + args.embed_model if args.embed_model else 'trigram hashing embedder'})--")
+
+    rng = random.Random(1)
+    targets = [rng.randrange(args.chunks) for _ in range(args.queries)]
+    questions = [rng.choice(QUESTIONS).format(code=codes[t], part=parts[t]) for t in targets]
+    query_vectors = embed(questions)
+
+    for name, mode in [("vector", VectorStoreQueryMode.DEFAULT), ("keyword (BM25)", VectorStoreQueryMode.TEXT_SEARCH),
+                       ("hybrid (RRF)", VectorStoreQueryMode.HYBRID)]:
+        hits, latencies = 0, []
+        for target, question, vector in zip(targets, questions, query_vectors.tolist()):
+            query = VectorStoreQuery(query_embedding=vector, query_str=question, similarity_top_k=args.k, mode=mode)
+            start = time.perf_counter()
+            ids = store.query(query).ids
+            latencies.append(time.perf_counter() - start)
+            hits += str(target) in ids
+        latencies.sort()
+        print(f"{name:<16} recall@{args.k} {hits / args.queries:.3f}  mean {statistics.mean(latencies) * 1000:6.2f}ms  "
+              f"p50 {statistics.median(latencies) * 1000:6.2f}ms  p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f}ms")
@@ -0,0 +1,145 @@
+"""
+Minimal stand-in for the Docker Model Runner's llama.cpp OpenAI-compatible API, for benchmarks and offline tests.
+Speaks HTTP/1.1 with keep-alive and streams Server-Sent Events with chunked transfer encoding like the real server,
+and counts the TCP connections it accepts so connection reuse can be measured.
+
+Run standalone:
+    python -m benchmarks.mock_model_runner --port 12434 --ttft 0.05 --token-delay 0.01
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+import argparse, json, threading, time
+
+DEFAULT_REPLY = "This is a canned answer from the mock model runner."
+
+class MockModelRunner:
+    """
+    Mock Docker Model Runner listening on localhost. Replies with the same text to every request, word by word when
+    streaming, or with the text reply_fn returns for the request payload, to script multi-step exchanges such as an
+    agent's tool calls. ttft delays the first token and token_delay every following one, to emulate generation speed.
+    Like llama.cpp, it reports token usage in the last streamed chunk, counting whitespace-separated words as tokens.
+    """
+    def __init__(self, port: int = 0, reply: str = DEFAULT_REPLY, ttft: float = 0.0, token_delay: float = 0.0,
+                 reply_fn: Optional[Callable[[dict], str]] = None):
+        self.reply = reply
+        self.reply_fn = reply_fn
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.connections = 0
+        self.requests = 0
+        self.prompts = []  # last message / prompt of every generation request
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "MockModelRunner":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+            self.prompts = []
+
+    def __enter__(self) -> "MockModelRunner":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _make_handler(self):
+        runner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive by default
+            disable_nagle_algorithm = True  # headers and body are separate writes, don't let them wait on delayed ACKs
+
+            def setup(self):
+                super().setup()
+                with runner._lock:
+                    runner.connections += 1  # one handler instance per TCP connection
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, body: dict, status: int = 200) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/v1/models"):
+                    self._send_json({"object": "list", "data": [{"id": "ai/mock", "object": "model"}]})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                is_chat = self.path.endswith("/chat/completions")
+                if not is_chat and not self.path.endswith("/completions"):
+                    self._send_json({"error": "not found"}, status=404)
+                    return
+                with runner._lock:
+                    runner.requests += 1
+                    runner.prompts.append(payload["messages"][-1]["content"] if is_chat else payload.get("prompt", ""))
+
+                reply = runner.reply_fn(payload) if runner.reply_fn is not None else runner.reply
+                words = reply.split(" ")
+                prompt = " ".join(str(message["content"]) for message in payload["messages"]) if is_chat else payload.get("prompt", "")
+                usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(words), "total_tokens": len(prompt.split()) + len(words)}
+                time.sleep(runner.ttft)
+                if not payload.get("stream"):
+                    time.sleep(runner.token_delay * (len(words) - 1))
+                    choice = {"index": 0, "finish_reason": "stop"}
+                    if is_chat:
+                        choice["message"] = {"role": "assistant", "content": reply}
+                    else:
+                        choice["text"] = reply
+                    self._send_json({"object": "chat.completion" if is_chat else "text_completion", "choices": [choice], "usage": usage})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(runner.token_delay)
+                    delta = word if i == 0 else f" {word}"
+                    choice = {"index": 0, "delta": {"content": delta}} if is_chat else {"index": 0, "text": delta}
+                    self._send_chunk(f"data: {json.dumps({'choices': [choice]})}\n\n".encode("utf-8"))
+                self._send_chunk(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+                self._send_chunk(b"data: [DONE]\n\n")
+                self._send_chunk(b"")  # end of the chunked body
+
+        return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Docker Model Runner")
+    parser.add_argument("--port", type=int, default=12434)
+    parser.add_argument("--ttft", type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between tokens")
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    args = parser.parse_args()
+    runner = MockModelRunner(port=args.port, reply=args.reply, ttft=args.ttft, token_delay=args.token_delay)
+    print(f"--Mock model runner listening on {runner.url}--")
+    runner._server.serve_forever()
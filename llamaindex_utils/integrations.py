@@ -1,6 +1,7 @@
 from llama_index.core.base.llms.types import ( 
     LLMMetadata,
     CompletionResponseGen,
+    CompletionResponseAsyncGen,
     CompletionResponse,
     ChatMessage,
     ChatResponse,
@@ -10,12 +11,71 @@ from llama_index.core.base.llms.types import (
 from llama_index.core.llms.callbacks import llm_completion_callback, llm_chat_callback
 from llama_index.core.agent.workflow.workflow_events import ToolSelection
 from llama_index.core.bridge.pydantic import PrivateAttr, Field
-from llama_index.core.embeddings import MultiModalEmbedding
+from llama_index.core.embeddings import BaseEmbedding, MultiModalEmbedding
 from llama_index.core.llms.function_calling import FunctionCallingLLM
 from llama_index.core.tools.types import BaseTool
-from typing import Optional, List, Any, Dict, AsyncGenerator
+from typing import Optional, List, Any, Callable, ClassVar, Dict, AsyncGenerator
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
 from llama_cpp import Llama
-import requests, json, aiohttp, re
+import requests, json, aiohttp, re, os, asyncio, itertools, multiprocessing, queue, threading, hashlib, sqlite3
+import numpy as np
+
+def _pack_by_tokens(token_counts: List[int], n_batch: int, max_seqs: int) -> List[List[int]]:
+    """
+    Greedily packs consecutive inputs into batches of at most n_batch tokens and max_seqs sequences.
+
+    Args:
+        token_counts: Number of tokens of each input
+        n_batch: Token budget of one batch (one llama.cpp decode)
+        max_seqs: Maximum number of sequences in one batch
+
+    Returns:
+        List of batches, each a list of input indices in their original order
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for i, n_tokens in enumerate(token_counts):
+        if batch and (batch_tokens + n_tokens > n_batch or len(batch) >= max_seqs):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += n_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _embed_batched(model: Llama, texts: List[str], n_ctx: int, n_batch: int, max_seqs: int) -> List[List[float]]:
+    """
+    Embeds many texts with as few llama.cpp decodes as possible: texts are truncated to n_ctx tokens each,
+    packed up to the n_batch token budget and embedded one batch per call. Results are in input order.
+    Llama.embed tokenizes every text again, so a text is only tokenized here if it can be longer than n_ctx tokens:
+    every token but BOS covers at least one byte, so a text of n bytes has at most n + 1 tokens, and that bound
+    is what it is packed by.
+    """
+    prepared, token_counts = [], []
+    for text in texts:
+        max_tokens = len(text.encode("utf-8")) + 1
+        if max_tokens > n_ctx:
+            tokens = model.tokenize(text.encode("utf-8"))
+            if len(tokens) > n_ctx:
+                # keep the same per-chunk limit as embedding one chunk at a time with an n_ctx context
+                text = model.detokenize(tokens[:n_ctx]).decode("utf-8", errors="ignore")
+            max_tokens = min(len(tokens), n_ctx)
+        prepared.append(text)
+        token_counts.append(max_tokens)
+
+    embeddings = []
+    for batch in _pack_by_tokens(token_counts, n_batch, max_seqs):
+        embeddings.extend(model.embed([prepared[i] for i in batch]))
+    return embeddings
+
+def embedding_model_key(model_path: str, n_ctx: int) -> str:
+    """
+    Identifies the vectors a llama.cpp embedding model computes, for caches: the model file (which also sets the
+    pooling) and n_ctx, past which texts are truncated.
+    """
+    return f"{os.path.abspath(model_path)}|n_ctx={n_ctx}"
 
 class LlamaCppEmbedding(MultiModalEmbedding):
     """"
@@ -23,7 +83,23 @@ class LlamaCppEmbedding(MultiModalEmbedding):
     Uses llama.cpp to run custom embedding models that llama_index doesn't support (GGUF).
     """
 
+    n_ctx: int = Field(
+        default=512,
+        description="Maximum number of tokens embedded per chunk. Longer chunks are truncated."
+    )
+    n_batch: int = Field(
+        default=2048,
+        description="Token budget of one batched decode. Chunks are packed up to this many tokens per llama.cpp call."
+    )
+    max_batch_seqs: int = Field(
+        default=64,
+        description="Maximum number of chunks packed into one batched decode.",
+        ge=1,
+        le=64  # llama.cpp limit on parallel sequences in a batch
+    )
+
     # private attributes that won't be serialized
+    _model_path: str = PrivateAttr()
     _text_model: Llama = PrivateAttr()
     _image_model: Optional[Llama] = PrivateAttr(default=None)
 
@@ -31,32 +107,51 @@ class LlamaCppEmbedding(MultiModalEmbedding):
         self,
         model_path: str,
         n_ctx: int = 512,
+        n_batch: int = 2048,
+        max_batch_seqs: int = 64,
         n_threads: int = 8,
         verbose: bool = False,
+        embed_batch_size: int = 64,
         **kwargs
     ):
         
-        super().__init__(**kwargs)
+        super().__init__(
+            n_ctx=n_ctx,
+            n_batch=n_batch,
+            max_batch_seqs=max_batch_seqs,
+            embed_batch_size=embed_batch_size,
+            **kwargs
+        )
 
         """
         Initialize the LlamaCPP embedding model.
     
         Args:
             model_path: Path to the GGUF model file
-            n_ctx: Context window size (can be small for embeddings)
+            n_ctx: Maximum number of tokens per chunk (can be small for embeddings)
+            n_batch: Token budget of one batched decode
+            max_batch_seqs: Maximum number of chunks per batched decode
             n_threads: Number of CPU threads to use
             verbose: Whether to print verbose output
+            embed_batch_size: Number of chunks LlamaIndex hands over per _get_text_embeddings call
         """
 
+        self._model_path = model_path
         # Initialize the llama.cpp model for embeddings
+        # The context has to fit a whole batch, and embedding models need the full batch in one micro-batch
         self._text_model = Llama(
             model_path = model_path,
             embedding = True,
-            n_ctx = n_ctx,
+            n_ctx = max(n_ctx, n_batch),
+            n_batch = n_batch,
+            n_ubatch = n_batch,
             n_threads = n_threads,
             verbose = verbose
         )
 
+    @property
+    def model_key(self) -> str:
+        return embedding_model_key(self._model_path, self.n_ctx)
 
     def _get_text_embedding(self, text: str) -> List[float]:
         """
@@ -68,8 +163,8 @@ class LlamaCppEmbedding(MultiModalEmbedding):
         Returns:
             List of floats representing the text embedding vector
         """
-        # Call the embed method of our llama.cpp model
-        return self._text_model.embed(text)
+        # Truncated to n_ctx tokens like batched chunks, so a text gets the same vector either way
+        return self._get_text_embeddings([text])[0]
     
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
         """
@@ -81,8 +176,8 @@ class LlamaCppEmbedding(MultiModalEmbedding):
         Returns:
             List of embedding vectors, one for each input chunk
         """
-        # Process each chunk separately and return a list of embeddings
-        return [self._text_model.embed(text) for text in texts]
+        # Pack chunks into batches so each llama.cpp decode embeds many chunks at once
+        return _embed_batched(self._text_model, texts, self.n_ctx, self.n_batch, self.max_batch_seqs)
         
     # Image embed methods: TBD
 
@@ -133,7 +228,506 @@ class LlamaCppEmbedding(MultiModalEmbedding):
             List of floats representing the query embedding vector
         """
         # For text queries, we can use the same embedding approach as normal text
-        return self._text_model.embed(query)
+        return self._get_text_embedding(query)
+
+def _embedding_worker(
+    model_path: str,
+    n_ctx: int,
+    n_batch: int,
+    max_batch_seqs: int,
+    n_threads: int,
+    tasks: "multiprocessing.Queue",
+    results: "multiprocessing.Queue"
+) -> None:
+    """
+    Embedding worker process: loads the GGUF model once, then embeds batches of chunks from the task queue
+    until it receives None. Results are sent back tagged with their task id.
+    """
+    try:
+        model = Llama(
+            model_path = model_path,
+            embedding = True,
+            n_ctx = max(n_ctx, n_batch),
+            n_batch = n_batch,
+            n_ubatch = n_batch,
+            n_threads = n_threads,
+            verbose = False
+        )
+    except Exception as e:
+        results.put(("ready", f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, texts = task
+        try:
+            results.put((task_id, _embed_batched(model, texts, n_ctx, n_batch, max_batch_seqs)))
+        except Exception as e:
+            results.put((task_id, RuntimeError(f"Embedding worker failed: {type(e).__name__}: {e}")))
+
+class LlamaCppEmbeddingPool(MultiModalEmbedding):
+    """
+    Text embedding class that spreads llama.cpp embedding work over a pool of worker processes.
+    Each worker loads the GGUF model once and runs with its own share of the CPU threads, which scales much better
+    on many-core machines than a single Llama instance. Drop-in replacement for LlamaCppEmbedding for text.
+    If a worker dies (a llama.cpp crash, an OOM kill), the task it was embedding is lost with it, so every pending
+    task fails with a RuntimeError instead of waiting forever; the remaining workers keep serving new tasks.
+    """
+
+    # entry point of the worker processes, see _embedding_worker
+    worker_target: ClassVar[Callable[..., None]] = staticmethod(_embedding_worker)
+
+    n_ctx: int = Field(
+        default=512,
+        description="Maximum number of tokens embedded per chunk. Longer chunks are truncated."
+    )
+    n_batch: int = Field(
+        default=2048,
+        description="Token budget of one batched decode inside a worker."
+    )
+    max_batch_seqs: int = Field(
+        default=64,
+        description="Maximum number of chunks packed into one batched decode, and per task sent to a worker.",
+        ge=1,
+        le=64  # llama.cpp limit on parallel sequences in a batch
+    )
+    n_workers: int = Field(
+        default=2,
+        description="Number of embedding worker processes.",
+        ge=1
+    )
+
+    # private attributes that won't be serialized
+    _model_path: str = PrivateAttr()
+    _tasks: Any = PrivateAttr()
+    _results: Any = PrivateAttr()
+    _processes: List[Any] = PrivateAttr(default_factory=list)
+    _pending: Dict[int, Future] = PrivateAttr(default_factory=dict)
+    _task_ids: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _closed: bool = PrivateAttr(default=False)
+
+    def __init__(
+        self,
+        model_path: str,
+        n_workers: int = 2,
+        n_threads_per_worker: Optional[int] = None,
+        n_ctx: int = 512,
+        n_batch: int = 2048,
+        max_batch_seqs: int = 64,
+        embed_batch_size: Optional[int] = None,
+        **kwargs
+    ):
+        """
+        Start the worker processes and wait until every one of them has loaded the model.
+
+        Args:
+            model_path: Path to the GGUF model file
+            n_workers: Number of worker processes
+            n_threads_per_worker: CPU threads per worker (defaults to an even split of the CPU cores)
+            n_ctx: Maximum number of tokens per chunk
+            n_batch: Token budget of one batched decode
+            max_batch_seqs: Maximum number of chunks per batched decode
+            embed_batch_size: Number of chunks LlamaIndex hands over per call (defaults to enough to keep every worker busy)
+        """
+        super().__init__(
+            n_ctx=n_ctx,
+            n_batch=n_batch,
+            max_batch_seqs=max_batch_seqs,
+            n_workers=n_workers,
+            embed_batch_size=embed_batch_size or min(2048, n_workers * max_batch_seqs),
+            **kwargs
+        )
+        self._model_path = model_path
+        n_threads = n_threads_per_worker or max(1, (os.cpu_count() or 1) // n_workers)
+
+        # spawn: workers must not inherit the parent's threads or llama.cpp state
+        mp_context = multiprocessing.get_context("spawn")
+        self._tasks = mp_context.Queue()
+        self._results = mp_context.Queue()
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        for _ in range(n_workers):
+            process = mp_context.Process(
+                target=self.worker_target,
+                args=(model_path, n_ctx, n_batch, max_batch_seqs, n_threads, self._tasks, self._results),
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+        ready = 0
+        while ready < n_workers:
+            try:
+                _, error = self._results.get(timeout=1)
+            except queue.Empty:
+                dead = [process for process in self._processes if not process.is_alive()]
+                if not dead:
+                    continue
+                error = f"exited with code {dead[0].exitcode}"
+            if error is not None:
+                self.close()
+                raise RuntimeError(f"Embedding worker failed to load {model_path}: {error}")
+            ready += 1
+
+        # a single collector thread routes results to the callers that are waiting for them
+        threading.Thread(target=self._collect_results, daemon=True).start()
+        print(f"--Embedding pool ready: {n_workers} workers x {n_threads} threads--")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "llama_cpp_embedding_pool"
+
+    @property
+    def model_key(self) -> str:
+        return embedding_model_key(self._model_path, self.n_ctx)
+
+    def _collect_results(self) -> None:
+        """
+        Collector thread: hands every finished task to its future, and checks that the workers are alive in between.
+        Exits once the pool is closed.
+        """
+        while not self._closed:
+            try:
+                task_id, result = self._results.get(timeout=0.5)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError, ValueError):
+                return
+            with self._lock:
+                future = self._pending.pop(task_id, None)
+            if future is not None:
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self._check_workers()
+
+    def _check_workers(self) -> None:
+        """Drops dead workers and fails every pending task if there are any, since their lost task can't be told apart."""
+        with self._lock:
+            dead = [process for process in self._processes if not process.is_alive()]
+            for process in dead:
+                self._processes.remove(process)
+        if dead:
+            exit_codes = ", ".join(str(process.exitcode) for process in dead)
+            print(f"--Embedding worker died (exit code {exit_codes}), {len(self._processes)} left--")
+            self._fail_pending(RuntimeError(f"An embedding worker died (exit code {exit_codes}) while this task was pending."))
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._lock:
+            futures = list(self._pending.values())
+            self._pending.clear()
+        for future in futures:
+            future.set_exception(error)
+
+    def _submit(self, texts: List[str]) -> Future:
+        """Sends one batch of chunks to whichever worker is free next."""
+        future = Future()
+        with self._lock:
+            if self._closed or not self._processes:
+                raise RuntimeError("The embedding pool is closed." if self._closed else "Every embedding worker has died.")
+            task_id = next(self._task_ids)
+            self._pending[task_id] = future
+        self._tasks.put((task_id, texts))
+        return future
+
+    def close(self) -> None:
+        """
+        Stops the worker processes. Tasks still pending fail with a RuntimeError.
+        """
+        with self._lock:
+            self._closed = True
+            processes = list(self._processes)
+            self._processes.clear()
+        self._fail_pending(RuntimeError("The embedding pool was closed while this task was pending."))
+        for _ in processes:
+            self._tasks.put(None)
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        """
+        Get embedding for a single chunk of text.
+
+        Args:
+            text: The text to embed
+
+        Returns:
+            List of floats representing the text embedding vector
+        """
+        return self._submit([text]).result()[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Get embeddings for multiple text chunks, spread over the workers.
+
+        Args:
+            texts: List of chunks to embed
+
+        Returns:
+            List of embedding vectors, one for each input chunk, in input order
+        """
+        futures = [
+            self._submit(texts[start:start + self.max_batch_seqs])
+            for start in range(0, len(texts), self.max_batch_seqs)
+        ]
+        embeddings = []
+        for future in futures:
+            embeddings.extend(future.result())
+        return embeddings
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        """
+        Get embedding for a query string.
+
+        Args:
+            query: The query text to embed
+
+        Returns:
+            List of floats representing the query embedding vector
+        """
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        """
+        Async query embedding: waits for the worker without blocking the event loop.
+        """
+        return (await asyncio.wrap_future(self._submit([query])))[0]
+
+    def _get_image_embedding(self, img_file_path: str) -> List[float]:
+        raise NotImplementedError("Image embedding is not supported by LlamaCppEmbeddingPool")
+
+    async def _aget_image_embedding(self, img_file_path: str) -> List[float]:
+        raise NotImplementedError("Async image embedding is not supported by LlamaCppEmbeddingPool")
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Memoizing wrapper around any LlamaIndex embedding model, so text that was embedded before (boilerplate repeated
+    on every page, re-asked questions, re-indexed documents) is never computed twice.
+    Vectors are keyed by model key, text kind (query or text) and whitespace-normalized text, and kept as float32
+    in a bounded in-memory LRU, optionally backed by an SQLite file that survives restarts. The file is bounded too:
+    past max_disk_entries vectors, the least recently used ones are deleted (SQLite reuses their space).
+    """
+
+    model_key: str = Field(
+        description="Identifies the wrapped model and every setting that changes its vectors (see embedding_model_key). Part of every cache key."
+    )
+    max_entries: int = Field(
+        default=10000,
+        description="Maximum number of vectors kept in memory.",
+        ge=1
+    )
+    cache_path: Optional[str] = Field(
+        default=None,
+        description="SQLite file that persists vectors across sessions. In-memory only if not set."
+    )
+    max_disk_entries: int = Field(
+        default=100000,
+        description="Maximum number of vectors kept in the SQLite file.",
+        ge=1
+    )
+
+    # private attributes that won't be serialized
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _memory: "OrderedDict[str, np.ndarray]" = PrivateAttr(default_factory=OrderedDict)
+    _db: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+    _disk_entries: int = PrivateAttr(default=0)
+    _uses: Any = PrivateAttr(default=None)  # counter ordering the uses of vectors on disk
+    _touched: Dict[str, int] = PrivateAttr(default_factory=dict)  # key -> last use not yet written to disk
+    _lock: Any = PrivateAttr()
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        model_key: str,
+        max_entries: int = 10000,
+        cache_path: Optional[str] = None,
+        max_disk_entries: int = 100000,
+        **kwargs
+    ):
+        """
+        Args:
+            embed_model: The embedding model to memoize
+            model_key: Identifies the wrapped model and its settings, e.g. the model_key of a llama.cpp embedding model
+            max_entries: Maximum number of vectors kept in memory
+            cache_path: Optional SQLite file that persists vectors across sessions
+            max_disk_entries: Maximum number of vectors kept in the SQLite file, least recently used ones are deleted
+        """
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            model_key=model_key,
+            max_entries=max_entries,
+            cache_path=cache_path,
+            max_disk_entries=max_disk_entries,
+            **kwargs
+        )
+        self._embed_model = embed_model
+        self._lock = threading.Lock()
+        if cache_path:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_used INTEGER NOT NULL DEFAULT 0)")
+            if "last_used" not in [column[1] for column in self._db.execute("PRAGMA table_info(embeddings)")]:
+                # written before the file was bounded: its vectors count as least recently used
+                self._db.execute("ALTER TABLE embeddings ADD COLUMN last_used INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._db.commit()
+            self._disk_entries, last_use = self._db.execute("SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()
+            self._uses = itertools.count(last_use + 1)
+            with self._lock:
+                self._prune()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "cached_embedding"
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        return self._embed_model
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._memory), "disk_entries": self._disk_entries, "hits": self._hits, "misses": self._misses}
+
+    def close(self) -> None:
+        """
+        Closes the on-disk store and the wrapped model, if it has anything to close.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._flush_touched()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+        if hasattr(self._embed_model, "close"):
+            self._embed_model.close()
+
+    def _key(self, kind: str, text: str) -> str:
+        normalized = " ".join(text.split())
+        return hashlib.sha256(f"{self.model_key}\0{kind}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Returns the cached vectors of the given keys, from memory first and then from disk."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            missing = [key for key in keys if key not in found]
+            if missing and self._db is not None:
+                for start in range(0, len(missing), 500):  # stay below SQLite's variable limit
+                    chunk = missing[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, found[key])
+            self._hits += sum(1 for key in keys if key in found)
+            self._misses += sum(1 for key in keys if key not in found)
+            if self._db is not None:
+                use = next(self._uses)
+                self._touched.update((key, use) for key in found)
+        return found
+
+    def _store(self, vectors: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+            if self._db is not None:
+                use = next(self._uses)
+                self._flush_touched()
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, vector.tobytes(), use) for key, vector in vectors.items()]
+                )
+                self._disk_entries += len(vectors)
+                self._prune()
+                self._db.commit()
+
+    def _flush_touched(self) -> None:
+        """
+        Writes the last use of the vectors looked up since the previous write, without committing: lookups don't
+        write to disk themselves. Must be called with the lock held.
+        """
+        if self._touched:
+            self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(use, key) for key, use in self._touched.items()])
+            self._touched.clear()
+
+    def _prune(self) -> None:
+        """
+        Deletes the least recently used vectors from disk once there are more than max_disk_entries, down to 90% of
+        the cap, so pruning doesn't run on every store. Must be called with the lock held.
+        """
+        if self._disk_entries <= self.max_disk_entries:
+            return
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]  # replaced keys were counted twice
+        excess = self._disk_entries - int(self.max_disk_entries * 0.9)
+        if self._disk_entries <= self.max_disk_entries:
+            return
+        self._db.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+        self._db.commit()
+        self._disk_entries -= excess
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        """Adds a vector to the in-memory LRU. Must be called with the lock held."""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _embed_cached(self, kind: str, texts: List[str], compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        Returns the embeddings of the texts, computing only the ones that aren't cached yet, each distinct text once.
+        """
+        keys = [self._key(kind, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, compute(list(missing.values())))}
+            self._store(computed)
+            found.update(computed)
+        return [found[key].tolist() for key in keys]
+
+    async def _aembed_cached(self, kind: str, texts: List[str], compute) -> List[List[float]]:
+        """Async version of _embed_cached, compute is awaited on a miss."""
+        keys = [self._key(kind, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = await compute(list(missing.values()))
+            computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, vectors)}
+            self._store(computed)
+            found.update(computed)
+        return [found[key].tolist() for key in keys]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed_cached("query", [query], lambda texts: [self._embed_model._get_query_embedding(texts[0])])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        async def compute(texts: List[str]) -> List[List[float]]:
+            return [await self._embed_model._aget_query_embedding(texts[0])]
+        return (await self._aembed_cached("query", [query], compute))[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed_cached("text", [text], self._embed_model._get_text_embeddings)[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached("text", texts, self._embed_model._get_text_embeddings)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed_cached("text", texts, self._embed_model._aget_text_embeddings)
 
 class DockerLLM(FunctionCallingLLM):
     """
@@ -162,6 +756,11 @@ class DockerLLM(FunctionCallingLLM):
         ge=1,
         le=4096
     )
+    context_window: int = Field(
+        default=4096,
+        description="Context size the model is served with (prompt and completion tokens together).",
+        gt=0
+    )
     temperature: float = Field(
         default=1.0,
         description="Temperature for sampling during text generation.",
@@ -172,6 +771,30 @@ class DockerLLM(FunctionCallingLLM):
         default=60.0,
         description="Timeout for HTTP requests to the Docker Model Runner."
     )
+    pool_size: int = Field(
+        default=8,
+        description="Maximum number of pooled keep-alive connections to the Docker Model Runner.",
+        ge=1
+    )
+    keepalive_timeout: float = Field(
+        default=30.0,
+        description="Seconds an idle pooled connection is kept open (async client).",
+        gt=0.0
+    )
+    max_concurrency: int = Field(
+        default=0,
+        description="Maximum number of generations running at once, sync and async together (0: no limit).",
+        ge=0
+    )
+
+    # private attributes that won't be serialized
+    _session: requests.Session = PrivateAttr()
+    _call_slots: Optional[threading.BoundedSemaphore] = PrivateAttr(default=None)
+    _call_stats_lock: Any = PrivateAttr()
+    _calls_running: int = PrivateAttr(default=0)
+    _calls_waiting: int = PrivateAttr(default=0)
+    _async_session: Optional[aiohttp.ClientSession] = PrivateAttr(default=None)
+    _async_session_loop: Optional[asyncio.AbstractEventLoop] = PrivateAttr(default=None)
 
     def __init__(
         self,
@@ -180,6 +803,10 @@ class DockerLLM(FunctionCallingLLM):
         temperature: float = 0.5,
         timeout: float = 60.0,
         max_tokens: int = 512,
+        context_window: int = 4096,
+        pool_size: int = 8,
+        keepalive_timeout: float = 30.0,
+        max_concurrency: int = 0,
         *args: Any,
         **kwargs: Any
     ) -> None:
@@ -190,8 +817,117 @@ class DockerLLM(FunctionCallingLLM):
             temperature=temperature,
             timeout=timeout,
             max_tokens=max_tokens,
+            context_window=context_window,
+            pool_size=pool_size,
+            keepalive_timeout=keepalive_timeout,
+            max_concurrency=max_concurrency,
             *args, **kwargs
         )
+        # One pooled session for every sync call, so consecutive calls reuse TCP connections instead of reconnecting
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # Generations beyond max_concurrency wait for a slot instead of piling up in the model server's queue
+        self._call_slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._call_stats_lock = threading.Lock()
+
+    def call_stats(self) -> Dict[str, int]:
+        """
+        Generations running and waiting for a slot right now, and the limit (0: none).
+        """
+        with self._call_stats_lock:
+            return {"running": self._calls_running, "waiting": self._calls_waiting, "max_concurrency": self.max_concurrency}
+
+    def _count_call(self, running: int = 0, waiting: int = 0) -> None:
+        with self._call_stats_lock:
+            self._calls_running += running
+            self._calls_waiting += waiting
+
+    @contextmanager
+    def _call_slot(self):
+        """
+        Holds one of the max_concurrency generation slots for a sync call (for streams: until the stream is consumed).
+        """
+        if self._call_slots is not None:
+            self._count_call(waiting=1)
+            self._call_slots.acquire()
+            self._count_call(running=1, waiting=-1)
+        else:
+            self._count_call(running=1)
+        try:
+            yield
+        finally:
+            self._count_call(running=-1)
+            if self._call_slots is not None:
+                self._call_slots.release()
+
+    @asynccontextmanager
+    async def _acall_slot(self):
+        """
+        Async version of _call_slot. The slots are shared with sync calls from other threads, so the semaphore is
+        waited for in a worker thread instead of on the event loop.
+        """
+        if self._call_slots is not None:
+            self._count_call(waiting=1)
+            acquiring = asyncio.ensure_future(asyncio.to_thread(self._call_slots.acquire))
+            try:
+                await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # the thread still takes a slot once one frees up: hand it back then
+                acquiring.add_done_callback(lambda _: self._call_slots.release())
+                raise
+            finally:
+                self._count_call(waiting=-1)
+        self._count_call(running=1)
+        try:
+            yield
+        finally:
+            self._count_call(running=-1)
+            if self._call_slots is not None:
+                self._call_slots.release()
+
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        """
+        Returns the pooled aiohttp session shared by every async call. aiohttp sessions are bound to the event loop
+        they were created on, so a new one is created when called from a different loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_session is None or self._async_session.closed or self._async_session_loop is not loop:
+            self._close_async_session()
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            self._async_session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._async_session_loop = loop
+        return self._async_session
+
+    def _close_async_session(self) -> None:
+        """
+        Closes the pooled async connections. Closing the connector directly works from any thread,
+        even after the loop the session was created on has finished.
+        """
+        if self._async_session is not None and not self._async_session.closed:
+            connector = self._async_session.connector
+            self._async_session.detach()
+            connector.close()
+        self._async_session = None
+        self._async_session_loop = None
+
+    def close(self) -> None:
+        """
+        Closes the pooled sync and async connections.
+        """
+        self._session.close()
+        self._close_async_session()
+
+    async def aclose(self) -> None:
+        """
+        Closes the pooled sync and async connections from within the event loop.
+        """
+        self._session.close()
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+        self._async_session_loop = None
 
     @classmethod
     def class_name(cls) -> str:
@@ -201,6 +937,8 @@ class DockerLLM(FunctionCallingLLM):
     def metadata(self) -> LLMMetadata:
         """Docker LLM metadata."""
         return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.max_tokens,
             is_chat_model=True,
             model_name=self.model,
             is_function_calling_model=True
@@ -225,17 +963,34 @@ class DockerLLM(FunctionCallingLLM):
             "stream": False,
             **kwargs
         }
-        response = requests.post(url=self._get_completions_endpoint(), json=payload, timeout=self.timeout)
-        response.raise_for_status()
-        response_data = response.json()
+        with self._call_slot():
+            response = self._session.post(url=self._get_completions_endpoint(), json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            response_data = response.json()
         return CompletionResponse(
             text=response_data["choices"][0]["text"]
         )
     
     @llm_completion_callback()
-    async def acomplete(self):
-        """Just a placeholder"""
-        raise NotImplementedError('acomplete is not yet implemented in DockerLLM.')
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        """
+        Non-blocking complete on the pooled aiohttp session, so concurrent calls share one event loop without stalling it.
+        """
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stream": False,
+            **kwargs
+        }
+        session = self._get_async_session()
+        async with self._acall_slot(), session.post(url=self._get_completions_endpoint(), json=payload) as response:
+            response.raise_for_status()
+            response_data = await response.json()
+        return CompletionResponse(
+            text=response_data["choices"][0]["text"]
+        )
     
     @llm_completion_callback()
     def stream_complete(self, prompt: str, **kwargs: Any) -> CompletionResponseGen:
@@ -253,47 +1008,95 @@ class DockerLLM(FunctionCallingLLM):
         }
 
         def gen() -> CompletionResponseGen:
-            response = requests.post(
+            # the with block hands the connection (and the generation slot) back once the stream is consumed
+            with self._call_slot(), self._session.post(
                 url=self._get_completions_endpoint(),
                 json=payload,
                 timeout=self.timeout,
                 stream=True
-            )
-            response.raise_for_status()
+            ) as response:
+                response.raise_for_status()
             
-            text = ""
-            # The http response needs to be iterated over line by line as it comes in
-            for line in response.iter_lines(decode_unicode=True):
-                if not line or line == "[DONE]":
-                    continue
+                text = ""
+                # The http response needs to be iterated over line by line as it comes in
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or line == "[DONE]":
+                        continue
 
-                # Handle Server-Sent Events (SSE) format (remove 'data' prefix)
-                if line.startswith("data: "):
-                    line = line[6:]
+                    # Handle Server-Sent Events (SSE) format (remove 'data' prefix)
+                    if line.startswith("data: "):
+                        line = line[6:]
 
-                try:
-                    data = json.loads(line)
+                    try:
+                        data = json.loads(line)
 
-                    delta = ""
-                    # flexible delta extraction depending on response format (in case DMR makes changes in the future)
-                    if "choices" in data and len(data["choices"]) > 0:
-                        choice = data["choices"][0]
-                        delta = (choice.get("text", "") or
-                                 choice.get("delta", {}).get("content", "") or
-                                 choice.get("delta", {}).get("text", ""))
+                        delta = ""
+                        # flexible delta extraction depending on response format (in case DMR makes changes in the future)
+                        if "choices" in data and len(data["choices"]) > 0:
+                            choice = data["choices"][0]
+                            delta = (choice.get("text", "") or
+                                     choice.get("delta", {}).get("content", "") or
+                                     choice.get("delta", {}).get("text", ""))
                         
-                    if delta:
-                        text += delta
-                        yield CompletionResponse(delta=delta, text=text, raw=data)
-                except (json.JSONDecodeError, KeyError, IndexError, TypeError):
-                    continue
+                        if delta:
+                            text += delta
+                            yield CompletionResponse(delta=delta, text=text, raw=data)
+                        elif data.get("usage"):
+                            # llama.cpp's last chunk reports the prompt size: pass it on to the callback handlers
+                            yield CompletionResponse(delta="", text=text, raw=data)
+                    except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                        continue
 
         return gen()
 
     @llm_completion_callback()
-    async def astream_complete(self):
-        """Just a placeholder"""
-        raise NotImplementedError('astream_complete is not yet implemented in DockerLLM.')
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        """
+        Async streaming complete that returns an async generator of deltas, read from the pooled aiohttp session.
+        """
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stream": True,
+            **kwargs
+        }
+
+        async def gen() -> CompletionResponseAsyncGen:
+            session = self._get_async_session()
+            async with self._acall_slot(), session.post(url=self._get_completions_endpoint(), json=payload) as response:
+                response.raise_for_status()
+
+                text = ""
+                async for line_bytes in response.content:
+                    line = line_bytes.decode('utf-8').strip()
+                    if not line or line == "[DONE]":
+                        continue
+
+                    if line.startswith("data: "):
+                        line = line[6:]
+
+                    try:
+                        data = json.loads(line)
+
+                        delta = ""
+                        if "choices" in data and len(data["choices"]) > 0:
+                            choice = data["choices"][0]
+                            delta = (choice.get("text", "") or
+                                     choice.get("delta", {}).get("content", "") or
+                                     choice.get("delta", {}).get("text", ""))
+
+                        if delta:
+                            text += delta
+                            yield CompletionResponse(delta=delta, text=text, raw=data)
+                        elif data.get("usage"):
+                            # llama.cpp's last chunk reports the prompt size: pass it on to the callback handlers
+                            yield CompletionResponse(delta="", text=text, raw=data)
+                    except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                        continue
+
+        return gen()
 
     def _prepare_chat_with_tools(
         self,
@@ -344,9 +1147,13 @@ class DockerLLM(FunctionCallingLLM):
     @llm_chat_callback()
     async def achat(self, messages: List[ChatMessage], **kwargs: Any) -> ChatResponse:
         """
-        Async chat method - for now, just call the sync version.
+        Async chat method required by FunctionCallingLLM. Mirrors chat on top of astream_chat, so it never blocks the loop.
         """
-        return self.chat(messages, **kwargs)
+        response_gen = await self.astream_chat(messages, **kwargs)
+        final_response = None
+        async for response in response_gen:
+            final_response = response
+        return final_response or ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=""))
 
     def get_tool_calls_from_response(
         self,
@@ -441,51 +1248,55 @@ class DockerLLM(FunctionCallingLLM):
         }
 
         def gen() -> ChatResponseGen:
-            response = requests.post(
+            # the with block hands the connection (and the generation slot) back once the stream is consumed
+            with self._call_slot(), self._session.post(
                 url=self._get_chat_endpoint(),
                 json=payload,
                 timeout=self.timeout,
                 stream=True
-            )
-            response.raise_for_status()
+            ) as response:
+                response.raise_for_status()
             
-            content = ""
-            # The http response needs to be iterated over line by line as it comes in
-            for line in response.iter_lines(decode_unicode=True):
-                if not line or line == "[DONE]":
-                    continue
+                content = ""
+                # The http response needs to be iterated over line by line as it comes in
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or line == "[DONE]":
+                        continue
 
-                # Handle Server-Sent Events (SSE) format (remove 'data' prefix)
-                if line.startswith("data: "):
-                    line = line[6:]
-
-                try:
-                    data = json.loads(line)
-
-                    delta = ""
-                    # Extract delta from chat completion response format
-                    if "choices" in data and len(data["choices"]) > 0:
-                        choice = data["choices"][0]
-                        # For chat completions, delta is usually in choice.delta.content
-                        if "delta" in choice and "content" in choice["delta"]:
-                            delta = choice["delta"]["content"]
-                        # Fallback for other possible formats
-                        elif "message" in choice and "content" in choice["message"]:
-                            delta = choice["message"]["content"]
-                        elif "text" in choice:
-                            delta = choice["text"]
+                    # Handle Server-Sent Events (SSE) format (remove 'data' prefix)
+                    if line.startswith("data: "):
+                        line = line[6:]
+
+                    try:
+                        data = json.loads(line)
+
+                        delta = ""
+                        # Extract delta from chat completion response format
+                        if "choices" in data and len(data["choices"]) > 0:
+                            choice = data["choices"][0]
+                            # For chat completions, delta is usually in choice.delta.content
+                            if "delta" in choice and "content" in choice["delta"]:
+                                delta = choice["delta"]["content"]
+                            # Fallback for other possible formats
+                            elif "message" in choice and "content" in choice["message"]:
+                                delta = choice["message"]["content"]
+                            elif "text" in choice:
+                                delta = choice["text"]
                         
-                    if delta:
-                        content += delta
-                        # Create ChatResponse instead of CompletionResponse for chat methods
-                        chat_response = ChatResponse(
-                            message=ChatMessage(role="assistant", content=content),
-                            delta=delta,
-                            raw=data
-                        )
-                        yield chat_response
-                except (json.JSONDecodeError, KeyError, IndexError, TypeError):
-                    continue
+                        if delta:
+                            content += delta
+                            # Create ChatResponse instead of CompletionResponse for chat methods
+                            chat_response = ChatResponse(
+                                message=ChatMessage(role="assistant", content=content),
+                                delta=delta,
+                                raw=data
+                            )
+                            yield chat_response
+                        elif data.get("usage"):
+                            # llama.cpp's last chunk reports the prompt size: pass it on to the callback handlers
+                            yield ChatResponse(message=ChatMessage(role="assistant", content=content), delta="", raw=data)
+                    except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                        continue
 
         return gen()
 
@@ -514,47 +1325,50 @@ class DockerLLM(FunctionCallingLLM):
         }
 
         async def stream_generator() -> AsyncGenerator:
-            timeout = aiohttp.ClientTimeout(total=self.timeout)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    url=self._get_chat_endpoint(),
-                    json=payload
-                ) as response:
-                    response.raise_for_status()
-                    
-                    content = ""
-                    async for line_bytes in response.content:
-                        line = line_bytes.decode('utf-8').strip()
-                        if not line or line == "[DONE]":
-                            continue
+            # the pooled session keeps the connection alive for the next call
+            session = self._get_async_session()
+            async with self._acall_slot(), session.post(
+                url=self._get_chat_endpoint(),
+                json=payload
+            ) as response:
+                response.raise_for_status()
+                
+                content = ""
+                async for line_bytes in response.content:
+                    line = line_bytes.decode('utf-8').strip()
+                    if not line or line == "[DONE]":
+                        continue
 
-                        if line.startswith("data: "):
-                            line = line[6:]
-
-                        try:
-                            data = json.loads(line)
-
-                            delta = ""
-                            if "choices" in data and len(data["choices"]) > 0:
-                                choice = data["choices"][0]
-                                if "delta" in choice and "content" in choice["delta"]:
-                                    delta = choice["delta"]["content"]
-                                elif "message" in choice and "content" in choice["message"]:
-                                    delta = choice["message"]["content"]
-                                elif "text" in choice:
-                                    delta = choice["text"]
-                                
-                            if delta:
-                                content += delta
-                                chat_response = ChatResponse(
-                                    message=ChatMessage(role=MessageRole.ASSISTANT, content=content),
-                                    delta=delta,
-                                    raw=data
-                                )
-                                yield chat_response
-                        except (json.JSONDecodeError, KeyError, IndexError, TypeError):
-                            continue
-                        
+                    if line.startswith("data: "):
+                        line = line[6:]
+
+                    try:
+                        data = json.loads(line)
+
+                        delta = ""
+                        if "choices" in data and len(data["choices"]) > 0:
+                            choice = data["choices"][0]
+                            if "delta" in choice and "content" in choice["delta"]:
+                                delta = choice["delta"]["content"]
+                            elif "message" in choice and "content" in choice["message"]:
+                                delta = choice["message"]["content"]
+                            elif "text" in choice:
+                                delta = choice["text"]
+                            
+                        if delta:
+                            content += delta
+                            chat_response = ChatResponse(
+                                message=ChatMessage(role=MessageRole.ASSISTANT, content=content),
+                                delta=delta,
+                                raw=data
+                            )
+                            yield chat_response
+                        elif data.get("usage"):
+                            # llama.cpp's last chunk reports the prompt size: pass it on to the callback handlers
+                            yield ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=content), delta="", raw=data)
+                    except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                        continue
+                    
         return stream_generator()
 
 
@@ -0,0 +1,125 @@
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from typing import Any, Callable, Dict, List, Optional
+import threading, time
+import numpy as np
+
+class MMRReranker(BaseNodePostprocessor):
+    """
+    Reranks over-fetched retrieval candidates with maximal marginal relevance (MMR) and keeps only the best top_n,
+    so the chat model gets the most relevant chunks without near-duplicates (overlapping chunks of the same page).
+    Relevance is the candidates' retrieval score (whatever mode ranked them, min-max scaled to [0, 1]), redundancy
+    the cosine similarity to the chunks already kept, taken from their stored embeddings: nothing is embedded.
+    Reranking has a latency budget of budget_ms, checked after the embedding lookup and at every MMR step: once it is
+    spent, the candidates are kept in retrieval order instead. The same fallback applies if a candidate has no stored
+    embedding. stats() reports latency, fallbacks and the prompt tokens saved by passing top_n chunks instead of
+    every candidate.
+    """
+
+    top_n: int = Field(
+        default=2,
+        description="Number of chunks kept.",
+        ge=1
+    )
+    mmr_lambda: float = Field(
+        default=0.5,
+        description="Weight of relevance against redundancy: 1 ranks by relevance alone, lower favours diversity.",
+        ge=0.0,
+        le=1.0
+    )
+    budget_ms: float = Field(
+        default=50.0,
+        description="Latency budget of one rerank. Past it, candidates are kept in retrieval order.",
+        gt=0.0
+    )
+
+    # private attributes that won't be serialized
+    _embedding_fn: Callable[[List[NodeWithScore]], np.ndarray] = PrivateAttr()
+    _token_counter: Callable[[str], int] = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _stats: Dict[str, float] = PrivateAttr()
+
+    def __init__(
+        self,
+        embedding_fn: Callable[[List[NodeWithScore]], np.ndarray],
+        token_counter: Callable[[str], int],
+        top_n: int = 2,
+        mmr_lambda: float = 0.5,
+        budget_ms: float = 50.0,
+        **kwargs
+    ):
+        """
+        Args:
+            embedding_fn: Returns the unit-length embeddings of the given nodes, one row each, raising KeyError
+                for nodes it doesn't know (e.g. CorpusRetriever.node_embeddings)
+            token_counter: Counts the tokens of a text, for the prompt token metrics
+            top_n: Number of chunks kept
+            mmr_lambda: Weight of relevance against redundancy
+            budget_ms: Latency budget of one rerank
+        """
+        super().__init__(top_n=top_n, mmr_lambda=mmr_lambda, budget_ms=budget_ms, **kwargs)
+        self._embedding_fn = embedding_fn
+        self._token_counter = token_counter
+        self._lock = threading.Lock()
+        self._stats = {"queries": 0, "fallbacks": 0, "rerank_ms": 0.0, "candidate_tokens": 0, "kept_tokens": 0}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "mmr_reranker"
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        queries = stats["queries"] or 1
+        stats["mean_rerank_ms"] = round(stats.pop("rerank_ms") / queries, 3)
+        stats["prompt_tokens_saved"] = stats["candidate_tokens"] - stats["kept_tokens"]
+        return stats
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        start = time.perf_counter()
+        fallback = False
+        if len(nodes) <= self.top_n:
+            kept = nodes
+        else:
+            try:
+                kept = self._select(nodes, deadline=start + self.budget_ms / 1000)
+            except (KeyError, TimeoutError) as e:
+                fallback = True
+                kept = nodes[:self.top_n]
+                print(f"--Rerank fell back to retrieval order: {'over budget' if isinstance(e, TimeoutError) else 'embedding missing'}--")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        candidate_tokens = [self._token_counter(node.node.get_content(metadata_mode=MetadataMode.LLM)) for node in nodes]
+        kept_ids = {node.node.node_id for node in kept}
+        kept_tokens = sum(count for node, count in zip(nodes, candidate_tokens) if node.node.node_id in kept_ids)
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["fallbacks"] += fallback
+            self._stats["rerank_ms"] += elapsed_ms
+            self._stats["candidate_tokens"] += sum(candidate_tokens)
+            self._stats["kept_tokens"] += kept_tokens
+        print(f"--Reranked {len(nodes)} -> {len(kept)} chunks in {round(elapsed_ms, 2)}ms, {sum(candidate_tokens) - kept_tokens} prompt tokens saved--")
+        return kept
+
+    def _select(self, nodes: List[NodeWithScore], deadline: float) -> List[NodeWithScore]:
+        """
+        Greedy MMR: repeatedly keeps the candidate with the best mmr_lambda * relevance - (1 - mmr_lambda) * redundancy.
+        Raises TimeoutError once the deadline has passed.
+        """
+        vectors = np.asarray(self._embedding_fn(nodes), dtype=np.float32)
+        scores = np.asarray([node.score or 0.0 for node in nodes], dtype=np.float32)
+        spread = scores.max() - scores.min()
+        relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+        redundancy = np.zeros(len(nodes), dtype=np.float32)  # max similarity to the kept chunks
+        available = np.ones(len(nodes), dtype=bool)
+        selected: List[int] = []
+        while len(selected) < self.top_n:
+            if time.perf_counter() > deadline:
+                raise TimeoutError
+            mmr = np.where(available, self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy, -np.inf)
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            available[best] = False
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+        return [nodes[i] for i in selected]
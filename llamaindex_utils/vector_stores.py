@@ -0,0 +1,637 @@
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+from array import array
+from collections import Counter
+from typing import IO, Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+import fsspec, json, math, os, re
+import numpy as np
+
+# words, and compound identifiers such as part numbers, error codes and versions (PN-140, E012, 2.4.1)
+_TOKEN_RE = re.compile(r"[0-9a-z]+(?:[-_./:][0-9a-z]+)*")
+_SEPARATOR_RE = re.compile(r"[-_./:]")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its me of on or page pages that the this to was what "
+    "when where which who why will with you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased terms for keyword search. A compound identifier is kept whole and also split into its parts,
+    so 'PN-140' matches both the exact code and a query for '140'.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in _SEPARATOR_RE.split(token) if part and part not in _STOPWORDS)
+    return tokens
+
+class BM25Stats(NamedTuple):
+    """The collection statistics of a BM25 query: rows, total terms, and rows containing each query term."""
+    rows: int
+    total_length: int
+    document_frequencies: Dict[str, int]
+
+    @property
+    def mean_length(self) -> float:
+        return self.total_length / self.rows if self.rows else 0.0
+
+    @classmethod
+    def combine(cls, stats: Sequence["BM25Stats"]) -> "BM25Stats":
+        """The statistics of the collection made of several indexes."""
+        document_frequencies: Dict[str, int] = {}
+        for stat in stats:
+            for term, df in stat.document_frequencies.items():
+                document_frequencies[term] = document_frequencies.get(term, 0) + df
+        return cls(sum(stat.rows for stat in stats), sum(stat.total_length for stat in stats), document_frequencies)
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring, aligned row for row with the vector store's matrix.
+    Posting lists are compact typed arrays per term (uint32 rows and uint16 term frequencies, 6 bytes per posting)
+    that numpy reads without copying, so scoring a query term is one vectorized scatter-add over its postings.
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._terms: Dict[str, int] = {}  # term -> position in the posting lists
+        self._rows: List[array] = []  # per term: rows containing it, ascending
+        self._tfs: List[array] = []  # per term: its frequency in each of those rows
+        self._lengths = array("I")  # terms per row
+        self._norms: Optional[np.ndarray] = None  # k1 * (1 - b + b * length / mean length), rebuilt lazily after changes
+
+    @property
+    def size(self) -> int:
+        return len(self._lengths)
+
+    def add(self, texts: Sequence[str]) -> None:
+        """Indexes new rows (appended after the existing ones)."""
+        for text in texts:
+            row = len(self._lengths)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                position = self._terms.get(term)
+                if position is None:
+                    position = self._terms[term] = len(self._rows)
+                    self._rows.append(array("I"))
+                    self._tfs.append(array("H"))
+                self._rows[position].append(row)
+                self._tfs[position].append(min(tf, 65535))
+            self._lengths.append(sum(counts.values()))
+        self._norms = None
+
+    def remove(self, keep: np.ndarray) -> None:
+        """Drops the rows where keep is False and renumbers the rest, like the matrix does."""
+        if keep.all():
+            return
+        new_rows = np.cumsum(keep, dtype=np.int64) - 1
+        first_removed = int(np.argmin(keep))
+        for position in range(len(self._rows)):
+            rows = np.frombuffer(self._rows[position], dtype=np.uint32)
+            if not len(rows) or rows[-1] < first_removed:  # rows are ascending: nothing to drop or renumber
+                continue
+            kept = keep[rows]
+            self._rows[position] = array("I", new_rows[rows[kept]].astype(np.uint32).tobytes())
+            self._tfs[position] = array("H", np.frombuffer(self._tfs[position], dtype=np.uint16)[kept].tobytes())
+        self._lengths = array("I", np.frombuffer(self._lengths, dtype=np.uint32)[keep].tobytes())
+        self._norms = None
+
+    def term_stats(self, query_str: str) -> BM25Stats:
+        """
+        The collection statistics BM25 scores the query's terms with: rows, total terms and rows containing each
+        query term. Summed over several indexes (see BM25Stats.combine), they score all of them as one collection.
+        """
+        document_frequencies = {}
+        for term in set(tokenize(query_str)):
+            position = self._terms.get(term)
+            document_frequencies[term] = len(self._rows[position]) if position is not None else 0
+        return BM25Stats(self.size, int(np.frombuffer(self._lengths, dtype=np.uint32).sum()), document_frequencies)
+
+    def search(self, query_str: str, k: int, candidates: Optional[np.ndarray] = None,
+               collection_stats: Optional[BM25Stats] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (rows, scores) of the k best matching rows, best first. Only rows sharing a term with the query
+        are returned, and only rows among candidates if given. IDF and mean row length are this index's own unless
+        collection_stats (of a collection including this index) are given, which makes the scores comparable with
+        those of the collection's other indexes.
+        """
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if not self.size or k <= 0:
+            return empty
+        if collection_stats is None:
+            if self._norms is None:
+                lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+                self._norms = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths.mean()), 1.0))
+            norms, n_rows = self._norms, self.size
+        else:
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            norms = self.k1 * (1 - self.b + self.b * lengths / max(collection_stats.mean_length, 1.0))
+            n_rows = collection_stats.rows
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query_str)):
+            position = self._terms.get(term)
+            if position is None or not len(self._rows[position]):
+                continue
+            rows = np.frombuffer(self._rows[position], dtype=np.uint32)
+            tfs = np.frombuffer(self._tfs[position], dtype=np.uint16).astype(np.float32)
+            df = len(rows) if collection_stats is None else collection_stats.document_frequencies.get(term, len(rows))
+            idf = math.log(1 + (n_rows - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norms[rows])
+        rows = np.flatnonzero(scores) if candidates is None else candidates[scores[candidates] > 0]
+        if not len(rows):
+            return empty
+        k = min(k, len(rows))
+        top = np.argpartition(-scores[rows], k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(-scores[rows][top], kind="stable")]
+        return rows[top], scores[rows][top]
+
+    def save(self, file: Union[str, IO[bytes]]) -> None:
+        """Saves the posting lists concatenated term by term, with offsets (CSR layout)."""
+        offsets = np.zeros(len(self._rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows) for rows in self._rows])
+        np.savez(
+            file,
+            terms=np.array(list(self._terms), dtype=str),
+            offsets=offsets,
+            rows=np.frombuffer(b"".join(rows.tobytes() for rows in self._rows), dtype=np.uint32),
+            tfs=np.frombuffer(b"".join(tfs.tobytes() for tfs in self._tfs), dtype=np.uint16),
+            lengths=np.frombuffer(self._lengths, dtype=np.uint32),
+            params=np.array([self.k1, self.b])
+        )
+
+    @classmethod
+    def load(cls, file: Union[str, IO[bytes]]) -> "BM25Index":
+        with np.load(file) as data:
+            index = cls(k1=float(data["params"][0]), b=float(data["params"][1]))
+            offsets, rows, tfs = data["offsets"], data["rows"], data["tfs"]
+            index._terms = {str(term): position for position, term in enumerate(data["terms"])}
+            index._rows = [array("I", rows[start:end].tobytes()) for start, end in zip(offsets[:-1], offsets[1:])]
+            index._tfs = [array("H", tfs[start:end].tobytes()) for start, end in zip(offsets[:-1], offsets[1:])]
+            index._lengths = array("I", data["lengths"].tobytes())
+        return index
+
+class IVFIndex:
+    """
+    Inverted file index for approximate nearest neighbour search over a matrix of unit-length rows.
+    Spherical k-means centroids partition the rows into nlist lists; a query is only scored against the rows
+    of the nprobe lists whose centroids are closest to it. nprobe trades recall for latency (nprobe = nlist is exact).
+    """
+    def __init__(self, nlist: int, nprobe: int = 16, n_iter: int = 10, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None  # nlist x dim
+        self.assignments = np.empty(0, dtype=np.int32)  # list of every row
+        self.trained_rows = 0
+        self._order: Optional[np.ndarray] = None  # rows sorted by list, rebuilt lazily after changes
+        self._offsets: Optional[np.ndarray] = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, matrix: np.ndarray) -> None:
+        """
+        Learns the centroids on (a sample of) the matrix with spherical k-means, then assigns every row.
+        """
+        rng = np.random.default_rng(self.seed)
+        nlist = min(self.nlist, len(matrix))
+        sample = matrix[rng.choice(len(matrix), size=min(len(matrix), 64 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            labels = self._nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            centroids = np.where(empty[:, None], centroids, sums / np.where(norms == 0, 1, norms))  # empty lists keep their centroid
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assignments = self._nearest(matrix, self.centroids)
+        self.trained_rows = len(matrix)
+        self._order = None
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Assigns new rows (appended after the existing ones) to their nearest list."""
+        self.assignments = np.concatenate([self.assignments, self._nearest(vectors, self.centroids)])
+        self._order = None
+
+    def remove(self, keep: np.ndarray) -> None:
+        """Drops the rows where keep is False, like the matrix does."""
+        self.assignments = self.assignments[keep]
+        self._order = None
+
+    def search_rows(self, query_vector: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """
+        Returns the rows of the lists closest to the query (sorted), the only ones that need exact scoring.
+        """
+        if self._order is None:
+            self._order = np.argsort(self.assignments, kind="stable")
+            self._offsets = np.searchsorted(self.assignments[self._order], np.arange(len(self.centroids) + 1))
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query_vector
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe] if nprobe < len(self.centroids) else np.arange(len(self.centroids))
+        rows = np.concatenate([self._order[self._offsets[l]:self._offsets[l + 1]] for l in probes])
+        rows.sort()
+        return rows
+
+    def save(self, file: Union[str, IO[bytes]]) -> None:
+        np.savez(file, centroids=self.centroids, assignments=self.assignments, trained_rows=self.trained_rows)
+
+    @classmethod
+    def load(cls, file: Union[str, IO[bytes]], nprobe: int = 16) -> "IVFIndex":
+        with np.load(file) as data:
+            index = cls(nlist=len(data["centroids"]), nprobe=nprobe)
+            index.centroids = data["centroids"]
+            index.assignments = data["assignments"]
+            index.trained_rows = int(data["trained_rows"])
+        return index
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+        """Index of the most similar centroid of every vector, in blocks to bound the size of the score matrix."""
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), block):
+            labels[start:start + block] = np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+        return labels
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Vector store backed by one contiguous float32 matrix (one unit-length row per node) and a parallel node id array.
+    Cosine top-k is a single matrix-vector product followed by argpartition, instead of a Python loop over a dict
+    of float lists, and takes a quarter of the memory of Python floats.
+    Persists as a .npy matrix next to a JSON sidecar with ids and metadata. Loading memory-maps the matrix,
+    so a cached index is searchable without reading it into memory first, and map_persisted does the same for a store
+    that was just persisted: a mapped matrix is read-only and lives in the OS page cache, one copy however many stores
+    and processes map the file. Writes copy it back into memory first (copy-on-write).
+    With ann="ivf", an IVFIndex is trained once the store holds ann_min_rows rows (and retrained when it has grown 4x),
+    and queries only score the rows of the closest lists. Smaller stores, and filtered queries that leave too few
+    candidates, fall back to exact search.
+    With keyword_index=True, the text of every added node also goes into a BM25Index, persisted next to the matrix.
+    Queries in TEXT_SEARCH mode use it alone, and HYBRID queries fuse the keyword and vector rankings with
+    reciprocal rank fusion (RRF), which needs no score calibration between the two.
+    Not thread-safe: callers serialize writes against reads (PDFAgent holds its index lock for both).
+    """
+
+    stores_text: bool = False  # node text lives in the docstore
+    ann: str = Field(
+        default="flat",
+        description="Search backend: 'flat' (exact) or 'ivf' (approximate, inverted file index)."
+    )
+    ivf_nlist: int = Field(
+        default=0,
+        description="Number of IVF lists. 0 picks 4 * sqrt(rows) when the index is trained.",
+        ge=0
+    )
+    ivf_nprobe: int = Field(
+        default=16,
+        description="IVF lists scanned per query: higher is more accurate and slower.",
+        ge=1
+    )
+    ann_min_rows: int = Field(
+        default=20000,
+        description="Rows needed before the IVF index is trained; exact search is fast enough below that.",
+        ge=1
+    )
+    keyword_index: bool = Field(
+        default=True,
+        description="Also index node text with BM25, for TEXT_SEARCH and HYBRID queries."
+    )
+    rrf_k: int = Field(
+        default=60,
+        description="Rank offset of reciprocal rank fusion: higher flattens the weight of the top ranks.",
+        ge=1
+    )
+
+    # private attributes that won't be serialized
+    _matrix: np.ndarray = PrivateAttr()  # capacity x dim, rows past _size are unused
+    _size: int = PrivateAttr(default=0)
+    _ids: List[str] = PrivateAttr(default_factory=list)
+    _ref_doc_ids: List[str] = PrivateAttr(default_factory=list)
+    _metadata: List[Dict[str, Any]] = PrivateAttr(default_factory=list)
+    _rows: Dict[str, int] = PrivateAttr(default_factory=dict)  # node id -> row
+    _ivf: Optional[IVFIndex] = PrivateAttr(default=None)
+    _bm25: Optional[BM25Index] = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        assert self.ann in ("flat", "ivf"), f"Unknown ann backend '{self.ann}'. Available options: 'flat', 'ivf'."
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        if self.keyword_index:
+            self._bm25 = BM25Index()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "numpy_vector_store"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        The stored unit-length embeddings, one row per node (read-only view).
+        """
+        view = self._matrix[:self._size]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def node_ids(self) -> List[str]:
+        return list(self._ids)
+
+    @property
+    def size(self) -> int:
+        """
+        Number of stored nodes. (Deliberately not __len__: an empty store must stay truthy for StorageContext.)
+        """
+        return self._size
+
+    @property
+    def is_memory_mapped(self) -> bool:
+        return isinstance(self._matrix, np.memmap)
+
+    @property
+    def has_keyword_index(self) -> bool:
+        return self._bm25 is not None
+
+    def build_keyword_index(self, nodes: Dict[str, BaseNode]) -> None:
+        """
+        (Re)builds the BM25 index from the stored nodes' text, e.g. for a store persisted without one.
+        nodes maps node ids to nodes holding the text (such as a docstore's docs), since the store itself keeps none.
+        """
+        self._bm25 = BM25Index()
+        self._bm25.add([nodes[node_id].get_content(metadata_mode=MetadataMode.NONE) for node_id in self._ids])
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        """
+        Appends the nodes' embeddings. Re-adding a node id replaces its row.
+        """
+        if not nodes:
+            return []
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        self.delete_nodes([node.node_id for node in nodes if node.node_id in self._rows])
+        self._reserve(self._size + len(nodes), vectors.shape[1])
+        self._matrix[self._size:self._size + len(nodes)] = vectors
+        for node in nodes:
+            metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+            metadata.pop("_node_content", None)
+            self._rows[node.node_id] = self._size
+            self._ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id or "None")
+            self._metadata.append(metadata)
+            self._size += 1
+        if self._ivf is not None and self._ivf.is_trained:
+            self._ivf.add(vectors)
+        if self._bm25 is not None:
+            self._bm25.add([node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes])
+        self._maybe_train_ivf()
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """
+        Deletes every node of the given source document.
+        """
+        self._remove_rows([row for row, doc_id in enumerate(self._ref_doc_ids) if doc_id == ref_doc_id])
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        rows = range(self._size) if node_ids is None else [self._rows[i] for i in node_ids if i in self._rows]
+        filter_fn = _build_metadata_filter_fn(lambda row: self._metadata[row], filters)
+        self._remove_rows([row for row in rows if filter_fn(row)])
+
+    def clear(self) -> None:
+        self._remove_rows(list(range(self._size)))
+
+    def get(self, text_id: str) -> List[float]:
+        """
+        Returns the stored (unit-length) embedding of a node.
+        """
+        return self._matrix[self._rows[text_id]].tolist()
+
+    def contains(self, node_id: str) -> bool:
+        return node_id in self._rows
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """
+        Top-k over the rows that pass the query's node id and metadata filters: cosine similarity in DEFAULT mode,
+        BM25 in TEXT_SEARCH mode, and the RRF fusion of both rankings in HYBRID mode. BM25 scores against the
+        collection_stats keyword argument if given (see keyword_stats), otherwise against this store's rows alone.
+        """
+        modes = (VectorStoreQueryMode.DEFAULT, VectorStoreQueryMode.TEXT_SEARCH, VectorStoreQueryMode.HYBRID)
+        if query.mode not in modes:
+            raise ValueError(f"NumpyVectorStore doesn't support the {query.mode} query mode. Available options: {[m.value for m in modes]}.")
+        if query.mode != VectorStoreQueryMode.DEFAULT and self._bm25 is None:
+            raise ValueError(f"The {query.mode} query mode needs the keyword index (keyword_index=True).")
+        empty = VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        if self._size == 0:
+            return empty
+        k = query.similarity_top_k
+        candidates = self._candidate_rows(query)
+        collection_stats: Optional[BM25Stats] = kwargs.get("collection_stats")
+
+        if query.mode == VectorStoreQueryMode.DEFAULT:
+            if query.query_embedding is None:
+                return empty
+            rows, scores = self._vector_top(query.query_embedding, k, candidates)
+        elif query.mode == VectorStoreQueryMode.TEXT_SEARCH:
+            rows, scores = self._bm25.search(query.query_str or "", k, candidates, collection_stats)
+        else:
+            # fuse deeper rankings than k, so a row ranked moderately by both can beat one ranked high by one
+            depth = max(query.hybrid_top_k or 0, query.sparse_top_k or 0, 4 * k, 20)
+            rankings = [self._bm25.search(query.query_str or "", depth, candidates, collection_stats)[0]]
+            if query.query_embedding is not None:
+                rankings.append(self._vector_top(query.query_embedding, depth, candidates)[0])
+            rows, scores = self._fuse(rankings, k)
+        return VectorStoreQueryResult(
+            similarities=scores.tolist(),
+            ids=[self._ids[row] for row in rows]
+        )
+
+    def keyword_stats(self, query_str: str) -> BM25Stats:
+        """
+        This store's BM25 statistics for the query: combined with those of other stores and passed to query as
+        collection_stats, the BM25 scores of all of them are comparable.
+        """
+        if self._bm25 is None:
+            raise ValueError("Keyword statistics need the keyword index (keyword_index=True).")
+        return self._bm25.term_stats(query_str)
+
+    def _vector_top(self, query_embedding: List[float], k: int, candidates: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, cosine similarities) of the k rows closest to the query embedding, best first."""
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        if self._ivf is not None and self._ivf.is_trained:
+            probed = self._ivf.search_rows(query_vector, self.ivf_nprobe)
+            probed = probed if candidates is None else np.intersect1d(probed, candidates, assume_unique=True)
+            if len(probed) >= k:  # otherwise too selective a filter: search its rows exactly
+                candidates = probed
+        matrix = self._matrix[:self._size] if candidates is None else self._matrix[candidates]
+        scores = matrix @ query_vector
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        rows = top if candidates is None else candidates[top]
+        return rows, scores[top]
+
+    def _fuse(self, rankings: List[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Reciprocal rank fusion: every ranking adds 1 / (rrf_k + rank) to the score of each of its rows."""
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, row in enumerate(ranking.tolist(), start=1):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (self.rrf_k + rank)
+        top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        return np.array([row for row, _ in top], dtype=np.int64), np.array([score for _, score in top], dtype=np.float32)
+
+    def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+        """
+        Writes the matrix to <persist_path stem>.npy and ids and metadata to persist_path (JSON).
+        """
+        fs = fs or fsspec.filesystem("file")
+        dirpath = os.path.dirname(persist_path)
+        if not fs.exists(dirpath):
+            fs.makedirs(dirpath)
+        with fs.open(self._matrix_path(persist_path), "wb") as f:
+            np.save(f, np.ascontiguousarray(self._matrix[:self._size]))
+        with fs.open(persist_path, "w") as f:
+            json.dump({"ids": self._ids, "ref_doc_ids": self._ref_doc_ids, "metadata": self._metadata}, f)
+        if self._ivf is not None and self._ivf.is_trained:
+            with fs.open(self._ivf_path(persist_path), "wb") as f:
+                self._ivf.save(f)
+        if self._bm25 is not None:
+            with fs.open(self._bm25_path(persist_path), "wb") as f:
+                self._bm25.save(f)
+
+    def map_persisted(self, persist_path: str) -> None:
+        """
+        Swaps the in-memory matrix for a read-only memory map of the one persisted at persist_path, which must hold
+        the same rows (e.g. right after persist), releasing the in-memory copy.
+        """
+        if not self._size:
+            return
+        matrix = np.load(self._matrix_path(persist_path), mmap_mode="r")
+        assert matrix.shape == (self._size, self._matrix.shape[1]), f"{persist_path} doesn't match the store ({matrix.shape[0]} rows, {self._size} ids)."
+        self._matrix = matrix
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None, **kwargs: Any) -> "NumpyVectorStore":
+        """
+        Loads a persisted store. The matrix is memory-mapped, and copied into memory only when nodes are added.
+        kwargs configure the search backend (ann, ivf_nprobe, ...): a persisted IVF index is reused if ann="ivf",
+        and one is trained on load if the store is large enough but was saved without it.
+        A persisted keyword index is loaded if keyword_index=True. If there is none, has_keyword_index is False
+        until build_keyword_index is called, since the store doesn't keep the text to rebuild it from.
+        """
+        fs = fs or fsspec.filesystem("file")
+        with fs.open(persist_path, "r") as f:
+            data = json.load(f)
+        store = cls(**kwargs)
+        store._matrix = np.load(cls._matrix_path(persist_path), mmap_mode="r")
+        store._size = len(data["ids"])
+        assert store._matrix.shape[0] == store._size, f"{persist_path} doesn't match its matrix ({store._matrix.shape[0]} rows, {store._size} ids)."
+        store._ids = data["ids"]
+        store._ref_doc_ids = data["ref_doc_ids"]
+        store._metadata = data["metadata"]
+        store._rows = {node_id: row for row, node_id in enumerate(store._ids)}
+        if store.ann == "ivf" and fs.exists(cls._ivf_path(persist_path)):
+            with fs.open(cls._ivf_path(persist_path), "rb") as f:
+                store._ivf = IVFIndex.load(f, nprobe=store.ivf_nprobe)
+            if len(store._ivf.assignments) != store._size:
+                store._ivf = None  # stale, retrained below
+        store._maybe_train_ivf()
+        store._bm25 = None
+        if store.keyword_index and fs.exists(cls._bm25_path(persist_path)):
+            with fs.open(cls._bm25_path(persist_path), "rb") as f:
+                store._bm25 = BM25Index.load(f)
+            if store._bm25.size != store._size:
+                store._bm25 = None  # stale, see build_keyword_index
+        return store
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, namespace: str = "default", fs: Optional[fsspec.AbstractFileSystem] = None,
+                         **kwargs: Any) -> "NumpyVectorStore":
+        """
+        Loads the store StorageContext.persist wrote into persist_dir under the given namespace.
+        """
+        return cls.from_persist_path(cls.persist_path(persist_dir, namespace), fs=fs, **kwargs)
+
+    @staticmethod
+    def persist_path(persist_dir: str, namespace: str = "default") -> str:
+        """
+        Where StorageContext.persist writes the store of the given namespace in persist_dir.
+        """
+        return os.path.join(persist_dir, f"{namespace}__vector_store.json")
+
+    @staticmethod
+    def _matrix_path(persist_path: str) -> str:
+        return f"{os.path.splitext(persist_path)[0]}.npy"
+
+    @staticmethod
+    def _ivf_path(persist_path: str) -> str:
+        return f"{os.path.splitext(persist_path)[0]}.ivf.npz"
+
+    @staticmethod
+    def _bm25_path(persist_path: str) -> str:
+        return f"{os.path.splitext(persist_path)[0]}.bm25.npz"
+
+    def _maybe_train_ivf(self) -> None:
+        """Trains the IVF index once the store is big enough, and retrains it once it has grown 4x since."""
+        if self.ann != "ivf" or self._size < self.ann_min_rows:
+            return
+        if self._ivf is not None and self._ivf.is_trained and self._size < 4 * self._ivf.trained_rows:
+            return
+        nlist = self.ivf_nlist or int(4 * np.sqrt(self._size))
+        self._ivf = IVFIndex(nlist=nlist, nprobe=self.ivf_nprobe)
+        self._ivf.train(self._matrix[:self._size])
+
+    def _reserve(self, rows: int, dim: int) -> None:
+        """Grows the matrix to hold at least the given number of rows, doubling its capacity (amortized O(1) adds)."""
+        if self._size and self._matrix.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {dim} doesn't match the store's dimension {self._matrix.shape[1]}.")
+        if rows <= self._matrix.shape[0] and self._matrix.flags.writeable:
+            return
+        grown = np.empty((max(rows, 2 * self._matrix.shape[0], 64), dim), dtype=np.float32)
+        if self._size:
+            grown[:self._size] = self._matrix[:self._size]  # also detaches a memory-mapped matrix from its file
+        self._matrix = grown
+
+    def _remove_rows(self, rows: List[int]) -> None:
+        """Deletes rows, keeping the matrix contiguous."""
+        if not rows:
+            return
+        keep = np.ones(self._size, dtype=bool)
+        keep[rows] = False
+        self._matrix = np.ascontiguousarray(self._matrix[:self._size][keep])
+        self._ids = [node_id for node_id, kept in zip(self._ids, keep) if kept]
+        self._ref_doc_ids = [doc_id for doc_id, kept in zip(self._ref_doc_ids, keep) if kept]
+        self._metadata = [metadata for metadata, kept in zip(self._metadata, keep) if kept]
+        if self._ivf is not None and self._ivf.is_trained:
+            self._ivf.remove(keep)
+        if self._bm25 is not None:
+            self._bm25.remove(keep)
+        self._size = len(self._ids)
+        self._rows = {node_id: row for row, node_id in enumerate(self._ids)}
+
+    def _candidate_rows(self, query: VectorStoreQuery) -> Optional[np.ndarray]:
+        """Rows allowed by the query's node ids and metadata filters, or None if every row is."""
+        if query.node_ids is None and not (query.filters and query.filters.filters):
+            return None
+        rows = range(self._size) if query.node_ids is None else sorted(self._rows[i] for i in query.node_ids if i in self._rows)
+        filter_fn = _build_metadata_filter_fn(lambda row: self._metadata[row], query.filters)
+        return np.fromiter((row for row in rows if filter_fn(row)), dtype=np.int64)
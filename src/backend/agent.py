@@ -1,15 +1,35 @@
-from llama_index.core import VectorStoreIndex, Settings, SimpleDirectoryReader
+from llama_index.core import VectorStoreIndex, Settings, SimpleDirectoryReader, StorageContext, load_index_from_storage
 from llama_index.core.base.base_query_engine import BaseQueryEngine
 from llama_index.core.workflow.handler import WorkflowHandler
 from llama_index.core.agent.workflow import ReActAgent
+from llama_index.core.agent.react.formatter import ReActChatFormatter
+from llama_index.core.instrumentation import get_dispatcher
 from llama_index.core.tools import FunctionTool
 from llama_index.core.workflow import Context
 
-from llamaindex_utils.integrations import LlamaCppEmbedding, DockerLLM
-
-import os, time, shutil, requests, subprocess, platform, json
+from llamaindex_utils.integrations import LlamaCppEmbedding, LlamaCppEmbeddingPool, CachedEmbedding, DockerLLM
+from llamaindex_utils.vector_stores import NumpyVectorStore
+from llamaindex_utils.postprocessors import MMRReranker
+from src.backend.cache import IndexCache, QueryCache, PageDiff, file_sha256
+from src.backend.ingest import IngestionPipeline, reusable_nodes
+from src.backend.budget import TokenBudget, PromptSizeTracker
+from src.backend.memory import RollingSummaryMemory, SessionStore
+from src.backend.corpus import DocumentRegistry, IndexedDocument, SharedIndex, CorpusRetriever, format_sources, format_chunks, best_page
+
+from llama_index.core.base.response.schema import AsyncStreamingResponse
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
+from llama_index.core.vector_stores.types import VectorStoreQueryMode
+from llama_index.core.schema import QueryBundle, NodeWithScore, BaseNode
+
+import os, time, shutil, requests, subprocess, platform, json, threading, asyncio
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    import pymupdf as pd
+
 load_dotenv(verbose=True)
 
 # Parse CHAT_MODELS from JSON environment variable
@@ -22,35 +42,143 @@ RAG_TOOL_DESC = os.getenv('RAG_TOOL_DESC')
 GOTO_PAGE_TOOL_NAME = os.getenv('GOTO_PAGE_TOOL_NAME')
 GOTO_PAGE_TOOL_DESC = os.getenv('GOTO_PAGE_TOOL_DESC')
 
-class PDFAgent():
-
-    def __init__(self, llm_backend: str = "docker", ui_callbacks: dict = None):
-
-        # Initialize embedding model
-        Settings.embed_model = LlamaCppEmbedding(model_path=os.getenv('EMBED_MODEL_PATH'), verbose=False)
-        self._embed_model_path = os.getenv('EMBED_MODEL_PATH')
+# Embedding model configuration
+EMBED_N_CTX = int(os.getenv('EMBED_N_CTX', '512'))
+EMBED_N_BATCH = int(os.getenv('EMBED_N_BATCH', '2048'))
+EMBED_WORKERS = int(os.getenv('EMBED_WORKERS', '1'))
+EMBED_THREADS_PER_WORKER = int(os.getenv('EMBED_THREADS_PER_WORKER', '0')) or None  # 0: split CPU cores evenly
+EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', '10000'))  # 0: no memoization
+EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', 'storage/embeddings.sqlite')  # empty: in-memory only
+EMBED_CACHE_DISK_ENTRIES = int(os.getenv('EMBED_CACHE_DISK_ENTRIES', '100000'))
+
+# Persisted index cache configuration
+INDEX_CACHE_PATH = os.getenv('INDEX_CACHE_PATH', 'storage/index')
+INDEX_CACHE_MAX_MB = int(os.getenv('INDEX_CACHE_MAX_MB', '2048'))
+
+# Answer cache of the RAG tool: exact repeats and near-identical questions (query embedding cosine similarity) skip synthesis
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '128'))
+QUERY_CACHE_TTL_S = float(os.getenv('QUERY_CACHE_TTL_S', '900'))
+QUERY_CACHE_SIMILARITY = float(os.getenv('QUERY_CACHE_SIMILARITY', '0.95'))
+
+# Connection pool of the chat model client: connections are kept alive and reused across calls
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', '8'))
+LLM_KEEPALIVE_S = float(os.getenv('LLM_KEEPALIVE_S', '30'))
+# Generations the chat model runs at once across all sessions (0: no limit); the rest wait for a free slot
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '4'))
+
+# Vector search backend: 'flat' (exact) or 'ivf' (approximate, for very large documents)
+VECTOR_INDEX = os.getenv('VECTOR_INDEX', 'flat')
+IVF_NLIST = int(os.getenv('IVF_NLIST', '0'))  # 0: 4 * sqrt(chunks)
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', '16'))
+ANN_MIN_ROWS = int(os.getenv('ANN_MIN_ROWS', '20000'))
+
+# Retrieval of the RAG tool: 'hybrid' (BM25 + vector, rank fusion), 'vector' (dense only) or 'keyword' (BM25 only)
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')
+RETRIEVAL_QUERY_MODES = {'vector': VectorStoreQueryMode.DEFAULT, 'keyword': VectorStoreQueryMode.TEXT_SEARCH, 'hybrid': VectorStoreQueryMode.HYBRID}
+RRF_K = int(os.getenv('RRF_K', '60'))
+
+# What the RAG tool returns: 'synthesize' (an answer written by the chat model from the retrieved chunks) or
+# 'extractive' (the retrieved chunks themselves, with their pages; the agent writes the only answer, saving a generation)
+RAG_MODE = os.getenv('RAG_MODE', 'synthesize')
+RAG_MODES = ('synthesize', 'extractive')
+
+# Reranking of the retrieved chunks before they reach the chat model: 'none' or 'mmr' (RERANK_CANDIDATES chunks are
+# retrieved and the RERANK_TOP_N most relevant, least redundant ones kept, within RERANK_BUDGET_MS)
+RERANK_MODE = os.getenv('RERANK_MODE', 'none')
+RERANK_MODES = ('none', 'mmr')
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '10'))
+RERANK_TOP_N = int(os.getenv('RERANK_TOP_N', str(DEFAULT_SIMILARITY_TOP_K)))
+RERANK_MMR_LAMBDA = float(os.getenv('RERANK_MMR_LAMBDA', '0.5'))
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '50'))
+
+# Token budget of the chat model's prompts: the context window is split between the answer (CHAT_MAX_TOKENS), the
+# retrieved chunks of one RAG call (RAG_CONTEXT_TOKENS) and the chat history (HISTORY_TOKENS, 0: whatever is left).
+# The history keeps the last HISTORY_TURNS turns verbatim; older turns are condensed into a rolling summary by the chat
+# model between questions ('summarize') or dropped ('trim'). Conversations are saved per document under SESSION_PATH
+# (empty: not saved), so reopening a PDF resumes its conversation
+CHAT_CONTEXT_WINDOW = int(os.getenv('CHAT_CONTEXT_WINDOW', '4096'))
+CHAT_MAX_TOKENS = int(os.getenv('CHAT_MAX_TOKENS', '512'))
+RAG_CONTEXT_TOKENS = int(os.getenv('RAG_CONTEXT_TOKENS', '2048'))
+HISTORY_TOKENS = int(os.getenv('HISTORY_TOKENS', '0'))
+HISTORY_MODE = os.getenv('HISTORY_MODE', 'summarize')
+HISTORY_MODES = ('trim', 'summarize')
+HISTORY_TURNS = int(os.getenv('HISTORY_TURNS', '6'))
+SESSION_PATH = os.getenv('SESSION_PATH', 'storage/sessions')
+
+# Progressive indexing: the agent becomes available once this many pages are embedded
+AGENT_READY_PAGES = int(os.getenv('AGENT_READY_PAGES', '10'))
+
+class AgentResources:
+    """
+    The part of the agent every conversation in the process can share: the embedding and chat models, the prompt token
+    budget and its tracking, the index cache, and the registry of the indexes of the documents open in any session,
+    so a file opened by several sessions is embedded and held in memory once. A PDFAgent creates its own unless given one.
+    """
+    def __init__(self, llm_backend: str = "docker"):
+
+        # Initialize embedding model, optionally as a pool of worker processes (index builds use it transparently)
+        if EMBED_WORKERS > 1:
+            self.embed_model = LlamaCppEmbeddingPool(
+                model_path=os.getenv('EMBED_MODEL_PATH'),
+                n_workers=EMBED_WORKERS,
+                n_threads_per_worker=EMBED_THREADS_PER_WORKER,
+                n_ctx=EMBED_N_CTX,
+                n_batch=EMBED_N_BATCH
+            )
+        else:
+            self.embed_model = LlamaCppEmbedding(model_path=os.getenv('EMBED_MODEL_PATH'), n_ctx=EMBED_N_CTX, n_batch=EMBED_N_BATCH, verbose=False)
+        # model path and the settings that change the vectors: keys cached embeddings and indexes
+        self.embed_model_key = self.embed_model.model_key
+        # Memoize embeddings, so repeated text and re-asked questions are embedded once
+        if EMBED_CACHE_SIZE > 0:
+            Settings.embed_model = CachedEmbedding(
+                self.embed_model,
+                model_key=self.embed_model_key,
+                max_entries=EMBED_CACHE_SIZE,
+                cache_path=EMBED_CACHE_PATH or None,
+                max_disk_entries=EMBED_CACHE_DISK_ENTRIES
+            )
+        else:
+            Settings.embed_model = self.embed_model
 
         # Initialize chat model with the specified backend
         if llm_backend == "docker":
             self._ensure_docker_running()
             # Initialize chat model with Ollama using Docker Model Runner (experiment)
-            self._chat_model = DockerLLM(model=CHAT_MODELS["gemma3n"])
+            self.chat_model = DockerLLM(model=CHAT_MODELS["gemma3n"], max_tokens=CHAT_MAX_TOKENS, context_window=CHAT_CONTEXT_WINDOW,
+                                        pool_size=LLM_POOL_SIZE, keepalive_timeout=LLM_KEEPALIVE_S, max_concurrency=LLM_MAX_CONCURRENCY)
             print("\n\n###-Chat model initialized: Docker Model Runner with Gemma3n-###\n\n")
         else:
             raise ValueError(f"Unsupported LLM backend: {llm_backend}. Available options: 'docker'.")
 
-        # UI callbacks for agent
-        self.ui_callbacks = ui_callbacks
+        # Token budget of every prompt, and the size of every prompt actually sent (all chat model calls in the process)
+        assert HISTORY_MODE in HISTORY_MODES, f"Unknown HISTORY_MODE '{HISTORY_MODE}'. Available options: {list(HISTORY_MODES)}."
+        self.token_budget = TokenBudget(CHAT_CONTEXT_WINDOW, CHAT_MAX_TOKENS, rag_tokens=RAG_CONTEXT_TOKENS, history_tokens=HISTORY_TOKENS)
+        self.prompt_tracker = PromptSizeTracker(self.token_budget)
+        get_dispatcher().add_event_handler(self.prompt_tracker)
 
-        # Index and query engine
-        self._index = None
-        self._query_engine = None
+        self.index_cache = IndexCache(root=INDEX_CACHE_PATH, max_bytes=INDEX_CACHE_MAX_MB * 2**20)
+        # The lock guards the indexes and every agent's corpus while background ingestion inserts into them
+        self.index_lock = threading.Lock()
 
-        # Agent with function calling and Context
-        self._react_agent = None
-        self._context = None
+        # Indexes of the documents open in any agent, by doc_id, with the number of agents using each
+        self.documents = DocumentRegistry(self.index_cache)
 
-    def _ensure_docker_running(self) -> None:
+    def close(self) -> None:
+        """
+        Stops prompt size tracking and releases the chat model's pooled connections and the embedding workers.
+        """
+        dispatcher = get_dispatcher()
+        if self.prompt_tracker in dispatcher.event_handlers:
+            dispatcher.event_handlers.remove(self.prompt_tracker)
+        self.chat_model.close()
+        if isinstance(Settings.embed_model, CachedEmbedding):
+            Settings.embed_model.close()  # also closes the wrapped model
+        elif isinstance(self.embed_model, LlamaCppEmbeddingPool):
+            self.embed_model.close()
+
+    @staticmethod
+    def _ensure_docker_running() -> None:
         """
         Ensures that the Docker engine is running so that Docker Model Runner is available. If not, starts it.
         """
@@ -84,6 +212,80 @@ class PDFAgent():
                 except:
                     continue
 
+class PDFAgent():
+
+    def __init__(self, llm_backend: str = "docker", ui_callbacks: dict = None, resources: Optional[AgentResources] = None,
+                 save_conversations: bool = True):
+        """
+        Args:
+            llm_backend: Chat model backend of the agent's own resources (ignored if resources are given)
+            ui_callbacks: 'goto_page' navigates the UI of this agent's user
+            resources: Models and document indexes shared with other agents, e.g. one per server session
+            save_conversations: Persist the conversation per document under SESSION_PATH
+        """
+        # Models, token budget, index cache and indexes, shared with other agents if given
+        self._owns_resources = resources is None
+        self._resources = resources or AgentResources(llm_backend)
+        self._chat_model = self._resources.chat_model
+        self._embed_model_key = self._resources.embed_model_key
+        self._token_budget = self._resources.token_budget
+        self._prompt_tracker = self._resources.prompt_tracker
+        self._index_cache = self._resources.index_cache
+        self._index_lock = self._resources.index_lock
+        self._registry = self._resources.documents
+
+        # UI callbacks for agent
+        self.ui_callbacks = ui_callbacks
+
+        # RAG tool output, see RAG_MODE
+        assert RAG_MODE in RAG_MODES, f"Unknown RAG_MODE '{RAG_MODE}'. Available options: {list(RAG_MODES)}."
+        self._rag_mode = RAG_MODE
+
+        # Corpus of indexed documents (one index each, keyed by content hash) and the query engine searching it
+        self._documents: "OrderedDict[str, IndexedDocument]" = OrderedDict()
+        assert RETRIEVAL_MODE in RETRIEVAL_QUERY_MODES, f"Unknown RETRIEVAL_MODE '{RETRIEVAL_MODE}'. Available options: {list(RETRIEVAL_QUERY_MODES)}."
+        assert RERANK_MODE in RERANK_MODES, f"Unknown RERANK_MODE '{RERANK_MODE}'. Available options: {list(RERANK_MODES)}."
+        self._retriever = CorpusRetriever(
+            self._documents,
+            similarity_top_k=RERANK_CANDIDATES if RERANK_MODE != "none" else DEFAULT_SIMILARITY_TOP_K,
+            vector_store_query_mode=RETRIEVAL_QUERY_MODES[RETRIEVAL_MODE]
+        )
+        self._reranker = None
+        if RERANK_MODE == "mmr":
+            self._reranker = MMRReranker(
+                embedding_fn=self._retriever.node_embeddings,
+                token_counter=lambda text: len(Settings.tokenizer(text)),
+                top_n=RERANK_TOP_N,
+                mmr_lambda=RERANK_MMR_LAMBDA,
+                budget_ms=RERANK_BUDGET_MS
+            )
+        self._query_engine = RetrieverQueryEngine.from_args(
+            retriever=self._retriever,
+            llm=self._chat_model,
+            streaming=True,
+            node_postprocessors=[self._reranker] if self._reranker is not None else None
+        )
+        self._query_cache = QueryCache(max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL_S, similarity_threshold=QUERY_CACHE_SIMILARITY)
+
+        # Agent with function calling and its token-budgeted chat history
+        self._react_agent = None
+        self._memory: Optional[RollingSummaryMemory] = None
+        self._sessions = SessionStore(SESSION_PATH) if SESSION_PATH and save_conversations else None
+
+    def close(self) -> None:
+        """
+        Stops background indexing and lets go of the documents in the corpus. Agents with resources of their own also
+        stop prompt size tracking and release the chat model's pooled connections and the embedding workers.
+        """
+        self.cancel_indexing()
+        with self._index_lock:
+            doc_ids = list(self._documents)
+            self._documents.clear()
+        for doc_id in doc_ids:
+            self._registry.release(doc_id)
+        if self._owns_resources:
+            self._resources.close()
+
     def _initialize_agent(self) -> None:
         """Create tools from existing functionality and pass them to FunctionAgent"""
         assert isinstance(self._query_engine, BaseQueryEngine), f"Make sure _query_engine is created before you initialize the agent. Type received: {type(self._query_engine)}"
@@ -92,6 +294,7 @@ class PDFAgent():
         # RAG tool
         rag_tool = FunctionTool.from_defaults(
             fn=self._rag_query,
+            async_fn=self._arag_query,  # used by the agent workflow, keeps the event loop free during synthesis
             name=RAG_TOOL_NAME,
             description=RAG_TOOL_DESC
         )
@@ -110,53 +313,448 @@ class PDFAgent():
             system_prompt=AGENT_SYS_PROMPT
         )
 
-        # Add context
-        self._context = Context(self._react_agent)
+        self._memory = self._create_memory([rag_tool, goto_page_tool])
+
+    def _create_memory(self, tools: List[FunctionTool]) -> RollingSummaryMemory:
+        """
+        Chat history of the agent, kept within what the token budget leaves next to the fixed part of the ReAct prompt
+        (system prompt, instructions and tool descriptions), which is measured here once. It resumes the conversation
+        saved for the current corpus, if any.
+        """
+        fixed_prompt = ReActChatFormatter.from_defaults(context=AGENT_SYS_PROMPT or "").format(tools, chat_history=[])
+        fixed_tokens = self._token_budget.count_messages(fixed_prompt)
+        history_limit = self._token_budget.history_limit(fixed_tokens)
+        print(f"--Prompt budget: {self._token_budget.prompt_tokens} tokens; agent instructions {fixed_tokens}, "
+              f"retrieved chunks {RAG_CONTEXT_TOKENS}, history {history_limit} ({HISTORY_MODE})--")
+        return RollingSummaryMemory(
+            tokenizer_fn=self._token_budget.tokenizer_fn,
+            llm=self._chat_model if HISTORY_MODE == "summarize" else None,
+            token_limit=history_limit,
+            max_turns=HISTORY_TURNS,
+            store=self._sessions,
+            session_key=SessionStore.make_key(list(self._documents))
+        )
+
+    def create_index(
+        self,
+        file_path: str,
+        document: Optional["pd.Document"] = None,
+        on_progress: Optional[Callable[[int, int, int], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        revision: Optional[PageDiff] = None
+    ) -> Optional[str]:
+        """
+        Single document mode: replaces the whole corpus with the given file, see add_document.
+        """
+        for doc_id in list(self._documents):
+            self.remove_document(doc_id)
+        return self.add_document(file_path, document=document, on_progress=on_progress, cancel_event=cancel_event, revision=revision)
+
+    def add_document(
+        self,
+        file_path: str,
+        document: Optional["pd.Document"] = None,
+        on_progress: Optional[Callable[[int, int, int], None]] = None,
+        cancel_event: Optional[threading.Event] = None,
+        revision: Optional[PageDiff] = None
+    ) -> Optional[str]:
+        """
+        Adds a file to the corpus and returns its doc_id (content hash). Only the new file is embedded: it gets an index
+        of its own, loaded from the index cache if this exact file was indexed before with the same embedding model
+        and chunking parameters. Adding a file that is already in the corpus does nothing.
+        If the already open PyMuPDF document is passed, indexing is progressive: pages are streamed into the index
+        in the background and this method returns as soon as the first AGENT_READY_PAGES pages are searchable.
+        on_progress receives (pages indexed, total pages, chunks embedded), also after this method has returned.
+        Setting cancel_event stops the indexing, drops the file from the corpus and makes this method return None.
+        If the file is a revision of one indexed before (see PDFService), pages with unchanged text keep their
+        embeddings from the previous version's cached index and only the changed pages are embedded.
+        """
+        start = time.time()
+        doc_id = file_sha256(file_path)
+        if doc_id in self._documents:
+            print(f"--{os.path.basename(file_path)} is already indexed--")
+            return doc_id
+
+        cache_key = IndexCache.make_key(doc_id, self._embed_model_key, Settings.chunk_size, Settings.chunk_overlap,
+                                        vector_store=NumpyVectorStore.class_name())
+        shared = self._registry.acquire(doc_id)
+        if shared is not None:
+            # another agent (session) has this file open: search its index, even while it is still being built
+            entry = self._add_to_corpus(IndexedDocument(file_name=os.path.basename(file_path), file_path=file_path, shared=shared))
+            if not self._wait_until_searchable(entry, cancel_event):
+                return None
+            print(f"--Index shared with {self._registry.users(doc_id) - 1} other session(s)--")
+        elif self._index_cache.contains(cache_key):
+            persist_dir = self._index_cache.path(cache_key)
+            vector_store = NumpyVectorStore.from_persist_dir(persist_dir, **self._vector_store_config())
+            index = load_index_from_storage(StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store))
+            if vector_store.keyword_index and not vector_store.has_keyword_index:
+                # cached before keyword search existed: index the stored text, no embedding needed
+                vector_store.build_keyword_index(index.docstore.docs)
+                self._persist_index(cache_key, index)
+            else:
+                self._index_cache.touch(cache_key)
+            entry = self._register_document(SharedIndex(doc_id=doc_id, index=index, cache_key=cache_key), file_path)
+            if entry.index is index:
+                entry.shared.total_pages = entry.shared.indexed_pages = document.page_count if document is not None else 0
+                entry.shared.ready.set()
+            if on_progress is not None:
+                on_progress(entry.total_pages, entry.total_pages, len(entry.index.docstore.docs))
+            print(f"--Index loaded from cache in {round(time.time() - start, 2)}s.--")
+        elif document is not None:
+            index = VectorStoreIndex(nodes=[], storage_context=StorageContext.from_defaults(vector_store=NumpyVectorStore(**self._vector_store_config())))
+            entry = self._register_document(SharedIndex(doc_id=doc_id, index=index, cache_key=cache_key, total_pages=document.page_count), file_path)
+            if entry.index is index:
+                reused_nodes = self._reusable_nodes(revision, document) if revision is not None else {}
+                entry.shared.indexing_thread = threading.Thread(
+                    # MuPDF is not thread-safe: indexing reads the file by path, in a worker process (see IngestionPipeline)
+                    target=self._index_in_background,
+                    args=(document.name, document.page_count, entry.shared, on_progress, reused_nodes),
+                    daemon=True
+                )
+                entry.shared.indexing_thread.start()
+            if not self._wait_until_searchable(entry, cancel_event):
+                return None
+            print(f"--First {entry.indexed_pages} of {entry.total_pages} pages indexed in {round(time.time() - start, 2)}s.--")
+        else:
+            # copy file into ~/storage/data to only index the file we need
+            data_path = shutil.copy(file_path, os.getenv('DATA_PATH'))
+            documents = SimpleDirectoryReader(input_files=[data_path]).load_data()
+            storage_context = StorageContext.from_defaults(vector_store=NumpyVectorStore(**self._vector_store_config()))
+            index = VectorStoreIndex.from_documents(documents, storage_context=storage_context, show_progress=True)
+            print(f"--Index created in {round(time.time() - start, 2)}s.--")
+            self._persist_index(cache_key, index)
+            self._register_document(SharedIndex(doc_id=doc_id, index=index, cache_key=cache_key), file_path).shared.ready.set()
+
+        if self._react_agent is None:
+            self._initialize_agent()
+            print(f"--Function Agent initialized--")
+        else:
+            self._memory.session_key = SessionStore.make_key(list(self._documents))  # the conversation now covers this file too
+        return doc_id
+
+    def _register_document(self, shared: SharedIndex, file_path: str) -> IndexedDocument:
+        """
+        Makes a newly built document index available to every agent sharing the resources and adds it to this agent's
+        corpus as file_path. If another agent registered the same file first, its index is used instead.
+        """
+        shared = self._registry.register(shared)
+        return self._add_to_corpus(IndexedDocument(file_name=os.path.basename(file_path), file_path=file_path, shared=shared))
+
+    def _persist_index(self, cache_key: str, index: VectorStoreIndex) -> None:
+        """
+        Stores a finished index in the index cache and memory-maps its vectors from there, releasing the in-memory
+        matrix: agents and processes that open the same file then share one copy of it.
+        Writing the index only reads it, so searches go on meanwhile; the index lock is held for the swap alone.
+        """
+        self._index_cache.store(cache_key, index)
+        with self._index_lock:
+            index.vector_store.map_persisted(NumpyVectorStore.persist_path(self._index_cache.path(cache_key)))
+
+    def _add_to_corpus(self, entry: IndexedDocument) -> IndexedDocument:
+        """
+        Makes a document's index part of the corpus. Cached answers may be missing its content, so they are dropped.
+        """
+        with self._index_lock:
+            self._documents[entry.doc_id] = entry
+        self._query_cache.clear()
+        return entry
+
+    def _wait_until_searchable(self, entry: IndexedDocument, cancel_event: Optional[threading.Event]) -> bool:
+        """
+        Waits until the first AGENT_READY_PAGES pages of a document indexed in the background are searchable.
+        If cancel_event is set meanwhile, drops the file from the corpus and returns False; indexing errors are raised.
+        """
+        while not entry.shared.ready.wait(0.1):
+            if cancel_event is not None and cancel_event.is_set():
+                self.remove_document(entry.doc_id)
+                return False
+        if entry.shared.error is not None:
+            self.remove_document(entry.doc_id)
+            raise entry.shared.error
+        return True
+
+    def remove_document(self, doc_id: str) -> None:
+        """
+        Removes a file from the corpus: stops its background indexing and drops its index, unless another agent
+        sharing the resources still uses it. The other documents' indexes are left as they are.
+        Once the corpus is empty, the agent and its chat history are discarded.
+        """
+        assert doc_id in self._documents, f"Document {doc_id} is not in the corpus."
+        self.cancel_indexing(doc_id)
+        with self._index_lock:
+            entry = self._documents.pop(doc_id)
+            if self._retriever.scope == doc_id:
+                self._retriever.scope = None
+        self._registry.release(doc_id)
+        self._query_cache.clear()
+        if not self._documents:
+            self._react_agent = None
+            self._memory = None
+        elif self._memory is not None:
+            self._memory.session_key = SessionStore.make_key(list(self._documents))
+        print(f"--{entry.file_name} removed from the corpus--")
+
+    def documents(self) -> List[IndexedDocument]:
+        """
+        Documents in the corpus, in the order they were added.
+        """
+        return list(self._documents.values())
+
+    def set_scope(self, doc_id: Optional[str]) -> None:
+        """
+        Restricts retrieval to one document of the corpus, or searches all of them again with None.
+        """
+        assert doc_id is None or doc_id in self._documents, f"Document {doc_id} is not in the corpus."
+        with self._index_lock:
+            self._retriever.scope = doc_id
+        self._query_cache.clear()  # answers depend on what was searched
+
+    @staticmethod
+    def _vector_store_config() -> Dict[str, Any]:
+        """
+        Search backend settings of the vector store, applied to new and cached indexes alike.
+        """
+        return {"ann": VECTOR_INDEX, "ivf_nlist": IVF_NLIST, "ivf_nprobe": IVF_NPROBE, "ann_min_rows": ANN_MIN_ROWS,
+                "keyword_index": RETRIEVAL_MODE != "vector", "rrf_k": RRF_K}
 
-    def create_index(self, file_path: str) -> None:
+    def cancel_indexing(self, doc_id: Optional[str] = None, timeout: float = 10.0) -> None:
         """
-        The simplest, baseline way to create an index using LlamaIndex.
+        Stops background indexing of the given document, or of every document, and waits for it to finish, up to
+        timeout seconds per document (an embedding batch in flight is finished first; past the timeout, the thread
+        winds down on its own and its index is dropped). Documents another agent sharing the resources still uses
+        keep being indexed for it.
+        """
+        entries = [self._documents[doc_id]] if doc_id is not None else list(self._documents.values())
+        for shared in [entry.shared for entry in entries]:
+            if self._registry.users(shared.doc_id) > 1:
+                continue
+            shared.cancel_event.set()
+            if shared.indexing_thread is not None:
+                shared.indexing_thread.join(timeout)
+                if shared.indexing_thread.is_alive():
+                    print(f"--Indexing of {shared.doc_id[:8]} still finishing its last batch after {timeout}s, not waiting for it--")
+                shared.indexing_thread = None
+
+    def _reusable_nodes(self, revision: PageDiff, document: "pd.Document") -> Dict[int, List[BaseNode]]:
+        """
+        The embedded nodes of every page whose text is unchanged since the previous version of the file, copied out of
+        that version's cached index (see reusable_nodes), or nothing if the previous index is no longer cached.
+        """
+        previous_key = IndexCache.make_key(revision.previous_doc_hash, self._embed_model_key, Settings.chunk_size, Settings.chunk_overlap,
+                                           vector_store=NumpyVectorStore.class_name())
+        if not revision.text_matches or not self._index_cache.contains(previous_key):
+            return {}
+        reused_nodes = reusable_nodes(revision, document.name, self._index_cache.path(previous_key))
+        print(f"--Reusing embeddings of {len(reused_nodes)} unchanged pages ({sum(map(len, reused_nodes.values()))} chunks)--")
+        return reused_nodes
+
+    def _index_in_background(self, file_path: str, page_count: int, shared: SharedIndex,
+                             on_progress: Optional[Callable[[int, int, int], None]], reused_nodes: Dict[int, List[BaseNode]]) -> None:
+        """
+        Indexing thread: streams the file into the shared index, sets shared.ready once enough pages are searchable
+        and persists the finished index to the cache, from where its vectors are then memory-mapped.
+        Errors are handed back through shared.error.
         """
-        # copy file into ~/storage/data to only index the file we need
-        shutil.copy(file_path, os.getenv('DATA_PATH'))
         start = time.time()
-        documents = SimpleDirectoryReader(os.getenv('DATA_PATH')).load_data()
-        self._index = VectorStoreIndex.from_documents(documents, show_progress=True)
-        assert self._index is not None, "Index is None. Create an index before creating a query engine."
-        self._query_engine = self._index.as_query_engine(llm=self._chat_model, streaming=True)
-        print(f"--Index created in {round(time.time() - start, 2)}s.--")
-        self._initialize_agent()
-        print(f"--Function Agent initialized--")
+        ready_pages = min(AGENT_READY_PAGES, page_count)
+        cancel = shared.cancel_event
+
+        def track_progress(pages_done: int, total_pages: int, nodes_done: int) -> None:
+            if cancel.is_set():
+                return
+            shared.indexed_pages = pages_done
+            if pages_done >= ready_pages:
+                shared.ready.set()
+            if on_progress is not None:
+                on_progress(pages_done, total_pages, nodes_done)
+
+        try:
+            IngestionPipeline(
+                file_path,
+                page_count,
+                shared.index,
+                on_progress=track_progress,
+                index_lock=self._index_lock,
+                cancel_event=cancel,
+                first_batch_pages=ready_pages,
+                reused_nodes=reused_nodes
+            ).run()
+            if not cancel.is_set():
+                self._persist_index(shared.cache_key, shared.index)
+                print(f"--Background indexing of {os.path.basename(file_path)} finished in {round(time.time() - start, 2)}s.--")
+        except Exception as e:
+            shared.error = e
+            print(f"--Background indexing failed: {e}--")
+        finally:
+            shared.ready.set()
 
     def ask_agent(self, prompt: str) -> WorkflowHandler:
         """
         Asks the agent a question from the user and returns the WorkflowHandler for streaming.
         """
         assert isinstance(prompt, str), f"Prompt should be a string, instead got {type(prompt)}."
+        assert self._react_agent is not None, "The agent is not ready yet. Load a PDF file first."
         
         print(f"🔧 Agent received prompt: {prompt}")
 
-        # call react agent instead of function agent
-        handler = self._react_agent.run(user_msg=prompt, ctx=self._context)
+        # call react agent instead of function agent; the turn's messages go to the memory, which summarizes
+        # turns out of its window once the answer is done
+        memory = self._memory
+        memory.begin_turn()
+        # a new Context per run: events a cancelled or unread run left in a shared one would end this run's stream early.
+        # The conversation lives in the memory, so nothing else is carried over between runs
+        handler = self._react_agent.run(user_msg=prompt, ctx=Context(self._react_agent), memory=memory)
+        handler.add_done_callback(lambda _: memory.end_turn())
         
         return handler
 
     def _rag_query(self, query: str) -> str:
         """# Tool: a wrapper for the query engine for the agent to use"""
         print(f"🔧 RAG TOOL CALLED with query: {query}")
-        result = self._query_engine.query(query)
+        query_bundle, cached = self._lookup_answer(query)
+        if cached is not None:
+            return cached
+        generation = self._answer_generation()
+        nodes, searched = self._retrieve(query_bundle)
+        if self._rag_mode == "extractive":
+            result = format_chunks(nodes)
+        else:
+            result = self._query_engine.synthesize(query_bundle, nodes)
         print(f"🔧 RAG TOOL RESULT: {str(result)[:20]}...")
-        return str(result)
-    
-
-
-
+        return self._store_answer(query_bundle, str(result), nodes, searched, generation)
 
+    async def _arag_query(self, query: str) -> str:
+        """
+        Async version of the RAG tool: retrieval (local embedding, CPU-bound) runs in a worker thread,
+        and the answer is synthesized with the chat model's async API on the pooled connection.
+        """
+        print(f"🔧 RAG TOOL CALLED with query: {query}")
+        query_bundle, cached = await asyncio.to_thread(self._lookup_answer, query)
+        if cached is not None:
+            return cached
+        generation = self._answer_generation()
+        nodes, searched = await asyncio.to_thread(self._retrieve, query_bundle)
+        if self._rag_mode == "extractive":
+            result = format_chunks(nodes)
+        else:
+            result = await self._query_engine.asynthesize(query_bundle, nodes)
+            if isinstance(result, AsyncStreamingResponse):
+                result = await result.get_response()
+        print(f"🔧 RAG TOOL RESULT: {str(result)[:20]}...")
+        return self._store_answer(query_bundle, str(result), nodes, searched, generation)
 
+    def _lookup_answer(self, query: str) -> Tuple[QueryBundle, Optional[str]]:
+        """
+        Looks the question up in the answer cache: first by text, then by query embedding.
+        The embedding is kept in the returned QueryBundle, so retrieval on a miss doesn't compute it again.
+        """
+        cached = self._query_cache.get_exact(query)
+        if cached is None:
+            embedding = Settings.embed_model.get_query_embedding(query)
+            query_bundle = QueryBundle(query, embedding=embedding)
+            cached = self._query_cache.get(query, embedding)
+        else:
+            query_bundle = QueryBundle(query)
+        if cached is not None:
+            print(f"🔧 RAG TOOL CACHE HIT: {self._query_cache.stats()}")
+        return query_bundle, cached
 
+    def _answer_generation(self) -> Optional[int]:
+        """
+        The answer cache generation an answer retrieved now is cached under, taken before retrieval, so an answer is
+        dropped if the corpus changes meanwhile. None if it must not be cached: answers from a partially indexed
+        document are not, since the same question may get a better answer once every page is searchable.
+        """
+        if not all(document.fully_indexed for document in self._retriever.documents_in_scope()):
+            return None
+        return self._query_cache.generation
 
+    def _store_answer(self, query_bundle: QueryBundle, answer: str, nodes: List[NodeWithScore], searched: str,
+                      generation: Optional[int]) -> str:
+        """
+        Formats the tool output (a synthesized answer or the chunks themselves) with the documents, pages and
+        page regions it is based on, and caches it under generation (see _answer_generation).
+        The best matching page is named explicitly, so the agent can call the goto_page tool with it right away.
+        """
+        output = answer
+        if nodes and self._rag_mode != "extractive":  # extractive output already names the page of every chunk
+            output += f"\n\nSources: {format_sources(nodes)}"
+        page = best_page(nodes)
+        if page is not None:
+            output += f"\n\nBest matching page: {page[1]} ({page[0]})"
+        if searched:
+            output += f"\n\n({searched})"
+        if generation is not None:
+            self._query_cache.put(query_bundle.query_str, output, query_bundle.embedding, generation=generation)
+        return output
+
+    @property
+    def rag_mode(self) -> str:
+        return self._rag_mode
+
+    def set_rag_mode(self, mode: str) -> None:
+        """
+        Switches what the RAG tool returns, see RAG_MODE. Cached tool outputs of the other mode are dropped.
+        """
+        assert mode in RAG_MODES, f"Unknown RAG mode '{mode}'. Available options: {list(RAG_MODES)}."
+        self._rag_mode = mode
+        self._query_cache.clear()
 
+    def query_cache_stats(self) -> Dict[str, int]:
+        """
+        Hit/miss counters of the RAG answer cache.
+        """
+        return self._query_cache.stats()
 
+    def rerank_stats(self) -> Dict[str, float]:
+        """
+        Latency, fallback and prompt token counters of the reranker (empty if reranking is off).
+        """
+        return self._reranker.stats() if self._reranker is not None else {}
 
+    def prompt_stats(self) -> Dict[str, float]:
+        """
+        Prompt sizes of the chat model calls so far (tokens), and the calibrated tokenizer ratio.
+        """
+        return self._prompt_tracker.stats()
 
+    def memory_stats(self) -> Dict[str, int]:
+        """
+        Turns kept verbatim, turns waiting to be summarized and the size of the summary (empty before the agent exists).
+        """
+        return self._memory.stats() if self._memory is not None else {}
 
+    def _retrieve(self, query_bundle: QueryBundle) -> Tuple[List[NodeWithScore], str]:
+        """
+        Retrieves (and reranks, see RERANK_MODE) under the lock, since background indexing may be inserting, so
+        synthesis can run without holding it, and packs the chunks into the RAG token budget.
+        Returns the nodes and the searched pages note.
+        """
+        start = time.perf_counter()
+        with self._index_lock:
+            nodes, searched = self._query_engine.retrieve(query_bundle), self._searched_pages()
+        nodes = self._token_budget.pack_chunks(nodes)
+        print(f"--Retrieved {len(nodes)} chunks ({RETRIEVAL_MODE}) in {round((time.perf_counter() - start) * 1000, 1)}ms--")
+        return nodes, searched
+
+    def _searched_pages(self) -> str:
+        """
+        Describes which documents and pages the corpus covered at query time, so the agent knows when an answer
+        may be incomplete.
+        """
+        documents = self._retriever.documents_in_scope()
+        total_pages = sum(document.total_pages for document in documents)
+        if not total_pages:
+            return ""
+        if len(documents) == 1:
+            document = documents[0]
+            if not document.fully_indexed:
+                return f"Searched pages 1-{document.indexed_pages} of {document.total_pages}; the rest of the document is still being indexed."
+            return f"Searched all {document.total_pages} pages."
+        note = f"Searched {len(documents)} documents ({total_pages} pages)"
+        partial = [document for document in documents if not document.fully_indexed]
+        if partial:
+            note += "; still being indexed: " + ", ".join(
+                f"{document.file_name} (pages 1-{document.indexed_pages} of {document.total_pages})" for document in partial)
+        return note + "."
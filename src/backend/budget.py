@@ -0,0 +1,146 @@
+from llama_index.core import Settings
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.llm import LLMChatEndEvent, LLMCompletionEndEvent
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import math, threading
+
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separator tokens the chat template adds to every message
+REASONING_RESERVE_TOKENS = 256  # the question and the agent's thought and action lines of the current turn
+MIN_HISTORY_TOKENS = 256
+
+class TokenBudget:
+    """
+    Splits the chat model's context window between the answer (max_output_tokens), the retrieved chunks of one RAG
+    call (rag_tokens) and the chat history, and counts tokens the way the model does: with a local tokenizer
+    (Settings.tokenizer unless given), scaled by a ratio calibrated against the prompt sizes the model server reports,
+    so no request is spent on counting.
+    """
+    def __init__(self, context_window: int, max_output_tokens: int, rag_tokens: int, history_tokens: int = 0,
+                 tokenizer: Optional[Callable[[str], List[int]]] = None):
+        assert max_output_tokens < context_window, f"max_output_tokens ({max_output_tokens}) leaves no room for a prompt in a context window of {context_window}."
+        self.context_window = context_window
+        self.max_output_tokens = max_output_tokens
+        self.rag_tokens = rag_tokens
+        self.history_tokens = history_tokens  # 0: whatever the rest of the prompt leaves
+        self._tokenizer = tokenizer or Settings.tokenizer
+        self._ratio = 1.0  # model tokens per local tokenizer token
+        self._lock = threading.Lock()
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.context_window - self.max_output_tokens
+
+    @property
+    def ratio(self) -> float:
+        return self._ratio
+
+    def count(self, text: str, calibrated: bool = True) -> int:
+        tokens = len(self._tokenizer(text))
+        return math.ceil(tokens * self._ratio) if calibrated else tokens
+
+    def tokenizer_fn(self, text: str) -> range:
+        """
+        The calibrated count in the shape chat memories expect from a tokenizer (they take its len()).
+        """
+        return range(self.count(text))
+
+    def count_messages(self, messages: Sequence[ChatMessage], calibrated: bool = True) -> int:
+        tokens = sum(self.count(message.content or "", calibrated=False) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+        return math.ceil(tokens * self._ratio) if calibrated else tokens
+
+    def calibrate(self, local_tokens: int, model_tokens: int) -> None:
+        """
+        Moves the ratio towards model_tokens / local_tokens, the counts of one prompt by the model server and by
+        the local tokenizer (uncalibrated).
+        """
+        if local_tokens <= 0 or model_tokens <= 0:
+            return
+        with self._lock:
+            self._ratio = 0.8 * self._ratio + 0.2 * (model_tokens / local_tokens)
+
+    def history_limit(self, fixed_tokens: int) -> int:
+        """
+        Tokens of chat history that fit next to the fixed part of the agent's prompt (system prompt, ReAct
+        instructions and tool descriptions), the retrieved chunks and the current turn.
+        """
+        if self.history_tokens:
+            return self.history_tokens
+        return max(self.prompt_tokens - fixed_tokens - self.rag_tokens - REASONING_RESERVE_TOKENS, MIN_HISTORY_TOKENS)
+
+    def pack_chunks(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """
+        Keeps the best ranked chunks that fit into rag_tokens together, in rank order. The best chunk is always kept.
+        """
+        kept, used = [], 0
+        for node in nodes:
+            tokens = self.count(node.node.get_content(metadata_mode=MetadataMode.LLM))
+            if kept and used + tokens > self.rag_tokens:
+                continue
+            kept.append(node)
+            used += tokens
+        if len(kept) < len(nodes):
+            print(f"--Packed {len(kept)} of {len(nodes)} chunks ({used} tokens) into the RAG budget of {self.rag_tokens}--")
+        return kept
+
+class PromptSizeTracker(BaseEventHandler):
+    """
+    Instrumentation handler that reports the prompt size of every chat model call, as counted by the TokenBudget
+    and, where the server reports it (usage.prompt_tokens), by the model itself, which calibrates the budget.
+    (llama.cpp's timings.prompt_n is not used: it leaves out the prompt prefix served from its cache.)
+    Register it with the root dispatcher: llama_index.core.instrumentation.get_dispatcher().add_event_handler(tracker).
+    """
+    _budget: TokenBudget = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _calls: int = PrivateAttr(default=0)
+    _total_tokens: int = PrivateAttr(default=0)
+    _max_tokens: int = PrivateAttr(default=0)
+    _last_tokens: int = PrivateAttr(default=0)
+    _last_response: Any = PrivateAttr(default=None)
+
+    def __init__(self, budget: TokenBudget, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._budget = budget
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "PromptSizeTracker"
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"calls": self._calls, "last_prompt_tokens": self._last_tokens, "max_prompt_tokens": self._max_tokens,
+                    "mean_prompt_tokens": round(self._total_tokens / self._calls, 1) if self._calls else 0.0,
+                    "tokenizer_ratio": round(self._budget.ratio, 3)}
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> None:
+        if isinstance(event, LLMChatEndEvent):
+            local_tokens = self._budget.count_messages(event.messages, calibrated=False)
+        elif isinstance(event, LLMCompletionEndEvent):
+            local_tokens = self._budget.count(event.prompt, calibrated=False)
+        else:
+            return
+        with self._lock:
+            if event.response is not None and event.response is self._last_response:
+                return  # a sync chat call wraps a streaming one, both report the same response
+            self._last_response = event.response
+        model_tokens = self._reported_prompt_tokens(event.response.raw if event.response is not None else None)
+        if model_tokens:
+            self._budget.calibrate(local_tokens, model_tokens)
+        tokens = model_tokens or math.ceil(local_tokens * self._budget.ratio)
+        with self._lock:
+            self._calls += 1
+            self._total_tokens += tokens
+            self._max_tokens = max(self._max_tokens, tokens)
+            self._last_tokens = tokens
+        print(f"--LLM call: {tokens} prompt tokens ({'counted by the model' if model_tokens else 'estimated'}), "
+              f"{round(100 * tokens / self._budget.prompt_tokens)}% of the prompt budget--")
+
+    @staticmethod
+    def _reported_prompt_tokens(raw: Any) -> Optional[int]:
+        if not isinstance(raw, dict):
+            return None
+        return (raw.get("usage") or {}).get("prompt_tokens")
@@ -0,0 +1,440 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import hashlib, json, os, re, shutil, threading, time
+import numpy as np
+
+# (path, size, mtime) -> sha256, so a file isn't hashed twice while it stays unchanged on disk
+_HASH_MEMO: Dict[Tuple[str, int, float], str] = {}
+
+def file_sha256(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of the file's content. Used as the cache key of a document.
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+    if memo_key not in _HASH_MEMO:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _HASH_MEMO[memo_key] = digest.hexdigest()
+    return _HASH_MEMO[memo_key]
+
+class PageImageCache:
+    """
+    Content-addressed disk cache of rendered page images that persists across sessions.
+    Images are keyed by the document's content hash, page index and dpi. File modification times track recency,
+    and the least recently used images are evicted once the cache grows past its size budget.
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def page_path(self, doc_hash: str, page_index: int, dpi: int) -> str:
+        """
+        Returns the path of a page image. The hash prefix is long enough that different files never collide.
+        """
+        return os.path.join(self.root, f"{doc_hash[:32]}_{dpi}_{page_index:04d}.png")
+
+    def has_document(self, doc_hash: str, page_count: int, dpi: int) -> bool:
+        """
+        Whether every page of the document is already cached at the given dpi.
+        """
+        return all(os.path.exists(self.page_path(doc_hash, i, dpi)) for i in range(page_count))
+
+    def touch(self, paths: List[str]) -> None:
+        """
+        Marks cached images as recently used.
+        """
+        for path in paths:
+            if os.path.exists(path):
+                os.utime(path)
+
+    def evict(self, keep_doc_hash: Optional[str] = None) -> int:
+        """
+        Deletes least recently used images until the cache fits its budget. Images of keep_doc_hash are never deleted.
+        Returns the number of bytes freed.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            total += stat.st_size
+            if keep_doc_hash is None or not entry.name.startswith(keep_doc_hash[:32]):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            os.remove(path)
+            freed += size
+        if freed:
+            print(f"--Page cache: evicted {round(freed / 2**20, 1)}MB--")
+        return freed
+
+class IndexCache:
+    """
+    Disk cache of persisted vector indexes, one storage directory per key.
+    A key covers everything that changes the embeddings: document content, embedding model and chunking parameters.
+    Directory modification times track recency, and the least recently used indexes are evicted past the size budget.
+    Indexes whose vectors are memory-mapped from the cache are pinned while in use and never evicted.
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._pinned: Set[str] = set()
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(doc_hash: str, embed_model_key: str, chunk_size: int, chunk_overlap: int, vector_store: str = "simple") -> str:
+        """
+        Builds the cache key of an index from the document hash, embedding model key (model path and the settings that
+        change its vectors, see embedding_model_key), chunking parameters and the vector store format it is persisted in.
+        """
+        parts = f"{doc_hash}|{embed_model_key}|{chunk_size}|{chunk_overlap}|{vector_store}"
+        return hashlib.sha256(parts.encode("utf-8")).hexdigest()[:32]
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def contains(self, key: str) -> bool:
+        return os.path.isdir(self.path(key))
+
+    def touch(self, key: str) -> None:
+        """
+        Marks a cached index as recently used.
+        """
+        os.utime(self.path(key))
+
+    def pin(self, key: str) -> None:
+        self._pinned.add(key)
+
+    def unpin(self, key: str) -> None:
+        self._pinned.discard(key)
+
+    def store(self, key: str, index) -> None:
+        """
+        Persists the index under the given key. The index is written to a temporary directory first and renamed
+        into place, so a crash mid-write never leaves a half-written index behind that would count as a hit.
+        """
+        partial_dir = f"{self.path(key)}.part"
+        if os.path.exists(partial_dir):
+            shutil.rmtree(partial_dir)
+        index.storage_context.persist(persist_dir=partial_dir)
+        if os.path.exists(self.path(key)):
+            shutil.rmtree(self.path(key))
+        os.replace(partial_dir, self.path(key))
+        self.evict(keep_key=key)
+
+    def evict(self, keep_key: Optional[str] = None) -> int:
+        """
+        Deletes least recently used indexes until the cache fits its budget. The index under keep_key is never deleted,
+        nor are the <key>.part directories of indexes being written by store (they neither count nor get evicted).
+        Returns the number of bytes freed.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name.endswith(".part"):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+            total += size
+            if entry.name != keep_key and entry.name not in self._pinned:
+                entries.append((entry.stat().st_mtime, size, entry.path))
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            try:
+                shutil.rmtree(path)
+            except OSError:  # mapped by another process, on Windows: evicted once that process lets go of it
+                continue
+            freed += size
+        if freed:
+            print(f"--Index cache: evicted {round(freed / 2**20, 1)}MB--")
+        return freed
+
+# an indirect reference ("12 0 R") in a PDF object's source
+_OBJECT_REFERENCE = re.compile(rb"(\d+) (\d+) R")
+
+def _resource_objects(document, page) -> Iterator[bytes]:
+    """
+    The page's resource dictionary (inherited from the page tree if the page has none) and every object it refers to,
+    directly or indirectly: fonts and their embedded programs, images, form XObjects, graphics states, color spaces,
+    patterns. Object sources come with their references blanked, so renumbering the objects doesn't change them,
+    followed by their raw stream if they have one.
+    """
+    xref = page.xref
+    kind, resources = document.xref_get_key(xref, "Resources")
+    while kind == "null":  # inherited from a Pages node
+        parent_kind, parent = document.xref_get_key(xref, "Parent")
+        if parent_kind != "xref":
+            return
+        xref = int(parent.split()[0])
+        kind, resources = document.xref_get_key(xref, "Resources")
+    source = resources.encode("utf-8")
+    pending = [int(ref) for ref, _ in _OBJECT_REFERENCE.findall(source)]
+    yield _OBJECT_REFERENCE.sub(b"R", source)
+    seen: Set[int] = set()
+    while pending:
+        xref = pending.pop(0)
+        if xref in seen:
+            continue
+        seen.add(xref)
+        source = document.xref_object(xref, compressed=True).encode("utf-8")
+        pending.extend(int(ref) for ref, _ in _OBJECT_REFERENCE.findall(source))
+        yield _OBJECT_REFERENCE.sub(b"R", source)
+        if document.xref_is_stream(xref):
+            yield document.xref_stream_raw(xref) or b""
+
+def page_fingerprints(document) -> List[Tuple[str, str]]:
+    """
+    Returns a (text hash, image hash) pair per page of an open PyMuPDF document. The text hash covers the extracted text,
+    which is all the index sees of a page. The image hash covers what rasterization depends on: page geometry,
+    content streams, the resources they draw with (fonts, images, form XObjects, ...), and annotations.
+    """
+    fingerprints = []
+    for page in document:
+        text_hash = hashlib.sha256(page.get_text().encode("utf-8")).hexdigest()
+        image_hash = hashlib.sha256(f"{tuple(page.rect)}|{page.rotation}".encode("utf-8"))
+        image_hash.update(page.read_contents())
+        for resource in _resource_objects(document, page):
+            image_hash.update(resource)
+        for annot in page.annots():
+            image_hash.update(document.xref_object(annot.xref).encode("utf-8"))
+        fingerprints.append((text_hash, image_hash.hexdigest()))
+    return fingerprints
+
+def write_page_manifest(root: str, max_entries: int, doc_hash: str, file_path: str) -> None:
+    """
+    Worker entry point: fingerprints the pages of the file with a PyMuPDF handle of its own and stores them
+    in the PageManifestCache at root, unless the file was replaced by another version meanwhile.
+    """
+    import pymupdf as pd
+    with pd.open(file_path) as document:
+        fingerprints = page_fingerprints(document)
+    if file_sha256(file_path) == doc_hash:
+        PageManifestCache(root, max_entries=max_entries).store(doc_hash, file_path, fingerprints)
+
+def _page_ranges(page_numbers: List[int]) -> str:
+    """Compacts sorted page numbers for display, e.g. [1, 2, 3, 7] -> '1-3, 7'."""
+    ranges = []
+    for number in page_numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+@dataclass
+class PageDiff:
+    """
+    Page-level differences between a file and the previous version of it that was opened from the same path.
+    Unchanged pages are matched by hash wherever they moved to, so inserting a page doesn't invalidate the ones after it.
+    Page indexes are 0-based, page numbers in the report 1-based.
+    """
+    file_name: str
+    previous_doc_hash: str
+    previous_page_count: int
+    page_count: int
+    text_matches: Dict[int, int]  # page index -> index of the previous version's page with the same text
+    image_matches: Dict[int, int]  # page index -> index of the previous version's page that renders the same
+
+    @classmethod
+    def compare(cls, previous: dict, fingerprints: List[Tuple[str, str]], file_name: str) -> "PageDiff":
+        previous_text, previous_image = {}, {}
+        for index, (text_hash, image_hash) in enumerate(previous["pages"]):
+            previous_text.setdefault(text_hash, index)
+            previous_image.setdefault(image_hash, index)
+        return cls(
+            file_name=file_name,
+            previous_doc_hash=previous["doc_hash"],
+            previous_page_count=len(previous["pages"]),
+            page_count=len(fingerprints),
+            text_matches={i: previous_text[t] for i, (t, _) in enumerate(fingerprints) if t in previous_text},
+            image_matches={i: previous_image[h] for i, (_, h) in enumerate(fingerprints) if h in previous_image}
+        )
+
+    @property
+    def text_changed(self) -> List[int]:
+        """Pages (0-based) whose text has to be embedded again."""
+        return [i for i in range(self.page_count) if i not in self.text_matches]
+
+    @property
+    def image_changed(self) -> List[int]:
+        """Pages (0-based) that have to be rendered again."""
+        return [i for i in range(self.page_count) if i not in self.image_matches]
+
+    @property
+    def removed(self) -> int:
+        """Number of the previous version's pages that no longer exist in any form."""
+        kept = set(self.text_matches.values()) | set(self.image_matches.values())
+        return self.previous_page_count - len(kept)
+
+    def report(self) -> str:
+        changed = sorted(set(self.text_changed) | set(self.image_changed))
+        if not changed and self.page_count == self.previous_page_count:
+            return f"{self.file_name}: no page changed since the previous version."
+        lines = [f"{self.file_name}: {len(changed)} of {self.page_count} pages changed since the previous version "
+                 f"({self.previous_page_count} pages, {self.removed} of them removed)."]
+        if self.text_changed:
+            lines.append(f"  Text changed (re-embedded): p. {_page_ranges([i + 1 for i in self.text_changed])}")
+        if self.image_changed:
+            lines.append(f"  Layout changed (re-rendered): p. {_page_ranges([i + 1 for i in self.image_changed])}")
+        return "\n".join(lines)
+
+class PageManifestCache:
+    """
+    Disk store of per-page fingerprints, one small JSON manifest per version of a file (path and content hash).
+    When a file is opened again after being edited, the manifest of the version previously opened from the same path
+    tells which pages are unchanged, so their cached page images and embeddings can be reused.
+    Only the most recently written max_entries manifests are kept.
+    """
+    def __init__(self, root: str, max_entries: int = 512):
+        self.root = root
+        self.max_entries = max_entries
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def _path_prefix(file_path: str) -> str:
+        return hashlib.sha256(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:16]
+
+    def path(self, doc_hash: str, file_path: str) -> str:
+        return os.path.join(self.root, f"{self._path_prefix(file_path)}_{doc_hash[:32]}.json")
+
+    def contains(self, doc_hash: str, file_path: str) -> bool:
+        return os.path.exists(self.path(doc_hash, file_path))
+
+    def store(self, doc_hash: str, file_path: str, fingerprints: List[Tuple[str, str]]) -> None:
+        manifest = {"doc_hash": doc_hash, "file_path": os.path.abspath(file_path), "pages": fingerprints}
+        partial_path = f"{self.path(doc_hash, file_path)}.part"
+        with open(partial_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(partial_path, self.path(doc_hash, file_path))
+        entries = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(self.root) if entry.name.endswith(".json"))
+        for _, path in entries[:-self.max_entries]:
+            os.remove(path)
+
+    def previous_version(self, doc_hash: str, file_path: str) -> Optional[dict]:
+        """
+        Returns the manifest most recently stored for another version of the file at file_path, if any.
+        """
+        prefix = f"{self._path_prefix(file_path)}_"
+        current = os.path.basename(self.path(doc_hash, file_path))
+        versions = sorted(
+            (entry.stat().st_mtime, entry.path) for entry in os.scandir(self.root)
+            if entry.name.startswith(prefix) and entry.name.endswith(".json") and entry.name != current
+        )
+        for _, path in reversed(versions):
+            try:
+                with open(path) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                continue
+        return None
+
+class QueryCache:
+    """
+    In-memory cache of RAG answers for the current document. A question hits when its normalized text was asked
+    before, or when its query embedding is close enough (cosine similarity) to one that was.
+    Entries expire after ttl seconds and the least recently used ones are dropped past max_entries.
+    Every clear starts a new generation: an answer computed before it (put with the generation its lookup saw)
+    is not stored, since it may be missing what changed.
+    """
+    def __init__(self, max_entries: int = 128, ttl: float = 900.0, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.generation = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        # normalized query -> (answer, unit-length query embedding or None, time stored)
+        self._entries: "OrderedDict[str, Tuple[str, Optional[np.ndarray], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """
+        Normalizes a query for exact matching: case, surrounding punctuation and repeated whitespace don't matter.
+        """
+        return re.sub(r"\s+", " ", query).strip().strip("?!.").strip().lower()
+
+    def get_exact(self, query: str) -> Optional[str]:
+        """
+        Returns the cached answer of an exact match. A miss isn't counted, so callers can try this before
+        computing the query embedding for get.
+        """
+        key = self.normalize(query)
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            return None
+
+    def get(self, query: str, embedding: Optional[List[float]] = None) -> Optional[str]:
+        """
+        Returns the cached answer of an exact match, or of the most similar cached query if an embedding is given.
+        """
+        cached = self.get_exact(query)
+        if cached is not None:
+            return cached
+        with self._lock:
+            if embedding is not None:
+                vector = self._unit(embedding)
+                best_key, best_score = None, self.similarity_threshold
+                for other_key, (_, other_vector, _) in self._entries.items():
+                    if other_vector is not None and other_vector.shape == vector.shape:
+                        score = float(np.dot(vector, other_vector))
+                        if score >= best_score:
+                            best_key, best_score = other_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.hits += 1
+                    self.near_hits += 1
+                    return self._entries[best_key][0]
+            self.misses += 1
+            return None
+
+    def put(self, query: str, answer: str, embedding: Optional[List[float]] = None, generation: Optional[int] = None) -> None:
+        """
+        Caches an answer, unless the cache was cleared since the given generation.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            key = self.normalize(query)
+            self._entries[key] = (answer, None if embedding is None else self._unit(embedding), time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drops every answer, e.g. when another document is indexed, and starts a new generation. Counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "near_hits": self.near_hits, "misses": self.misses}
+
+    def _expire(self) -> None:
+        """Drops expired entries. Must be called with the lock held."""
+        now = time.monotonic()
+        for key in [k for k, (_, _, stored) in self._entries.items() if now - stored > self.ttl]:
+            del self._entries[key]
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,272 @@
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import VectorStoreQueryMode
+from llamaindex_utils.vector_stores import BM25Stats
+from src.backend.cache import IndexCache
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import threading
+import numpy as np
+
+@dataclass
+class SharedIndex:
+    """
+    The vector index of one file's content plus the state of its background indexing. Held once per process by the
+    DocumentRegistry and searched read-only by every agent that has the file open; only its background indexing
+    writes to it.
+    """
+    doc_id: str  # content hash of the file
+    index: VectorStoreIndex
+    cache_key: Optional[str] = None  # where the index is persisted in the index cache
+    total_pages: int = 0  # 0 if the page count is unknown (indexed without an open document)
+    indexed_pages: int = 0
+    indexing_thread: Optional[threading.Thread] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    ready: threading.Event = field(default_factory=threading.Event)  # set once the first pages are searchable
+    error: Optional[Exception] = None  # why background indexing failed, if it did
+
+    @property
+    def fully_indexed(self) -> bool:
+        return self.indexed_pages >= self.total_pages
+
+@dataclass
+class IndexedDocument:
+    """
+    One document of an agent's corpus: the shared index of its content, under the name and path this agent opened
+    it from. Each document has a separate index, so adding or removing one never touches the embeddings of the others.
+    """
+    file_name: str
+    file_path: str
+    shared: SharedIndex
+
+    @property
+    def doc_id(self) -> str:
+        return self.shared.doc_id
+
+    @property
+    def index(self) -> VectorStoreIndex:
+        return self.shared.index
+
+    @property
+    def total_pages(self) -> int:
+        return self.shared.total_pages
+
+    @property
+    def indexed_pages(self) -> int:
+        return self.shared.indexed_pages
+
+    @property
+    def fully_indexed(self) -> bool:
+        return self.shared.fully_indexed
+
+    def own_metadata(self, node: NodeWithScore) -> NodeWithScore:
+        """
+        The retrieved node under this agent's file name and path. The shared index keeps those of the agent that
+        indexed the file, so a node is copied, never changed, when they differ (copy-on-write).
+        """
+        metadata = node.node.metadata
+        if metadata.get("file_name") == self.file_name and metadata.get("file_path") == self.file_path:
+            return node
+        own_node = node.node.model_copy(update={"metadata": {**metadata, "file_name": self.file_name, "file_path": self.file_path}})
+        return NodeWithScore(node=own_node, score=node.score)
+
+class DocumentRegistry:
+    """
+    The indexes of the files open in any agent of the process, keyed by content hash and counted by the agents using
+    them, so a file opened by several sessions is embedded and held in memory once; the last agent to let go of a file
+    drops its index. Finished indexes are memory-mapped from the index cache (see NumpyVectorStore.map_persisted),
+    so worker processes opening the same file share its vectors through the OS page cache too. Their cache entries
+    are pinned while in use.
+    """
+    def __init__(self, index_cache: Optional[IndexCache] = None):
+        self.index_cache = index_cache
+        self._indexes: Dict[str, SharedIndex] = {}
+        self._users: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, doc_id: str) -> Optional[SharedIndex]:
+        """
+        The index another agent has already built (or is building), counted as used by one more agent,
+        or None if no agent has it.
+        """
+        with self._lock:
+            shared = self._indexes.get(doc_id)
+            if shared is None or shared.cancel_event.is_set():
+                return None
+            self._users[doc_id] += 1
+            return shared
+
+    def register(self, shared: SharedIndex) -> SharedIndex:
+        """
+        Makes a newly built index available to every agent, used by one. If another agent registered the same file
+        in the meantime, its index is used (and returned) instead.
+        """
+        with self._lock:
+            existing = self._indexes.get(shared.doc_id)
+            if existing is not None and not existing.cancel_event.is_set():
+                self._users[shared.doc_id] += 1
+                return existing
+            self._indexes[shared.doc_id] = shared
+            self._users[shared.doc_id] = 1
+            if self.index_cache is not None and shared.cache_key is not None:
+                self.index_cache.pin(shared.cache_key)
+            return shared
+
+    def release(self, doc_id: str) -> None:
+        """
+        One agent less uses the index; the last one to let go of it drops it from memory.
+        """
+        with self._lock:
+            self._users[doc_id] -= 1
+            if self._users[doc_id] <= 0:
+                shared = self._indexes.pop(doc_id)
+                del self._users[doc_id]
+                if self.index_cache is not None and shared.cache_key is not None:
+                    self.index_cache.unpin(shared.cache_key)
+
+    def users(self, doc_id: str) -> int:
+        with self._lock:
+            return self._users.get(doc_id, 0)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Indexes held in memory, the agents using them (one per document and session), and how many of the indexes
+        have their vectors memory-mapped.
+        """
+        with self._lock:
+            return {"documents": len(self._indexes), "document_users": sum(self._users.values()),
+                    "memory_mapped": sum(getattr(shared.index.vector_store, "is_memory_mapped", False) for shared in self._indexes.values())}
+
+class CorpusRetriever(BaseRetriever):
+    """
+    Searches every document of the corpus, or only the one in scope, and merges the hits as one ranking.
+    The query is embedded once and the same embedding is used for every document's index.
+    vector_store_query_mode picks dense, keyword (TEXT_SEARCH) or HYBRID search. Cosine similarities compare across
+    documents as they are; BM25 scores only do when every document is scored against the same collection statistics,
+    so keyword search combines those of the documents in scope first. HYBRID fuses the corpus-wide dense and keyword
+    rankings, since the rank-based scores of per-document fusions don't compare (every document's best hit would tie).
+    """
+    def __init__(self, documents: Dict[str, IndexedDocument], similarity_top_k: int = DEFAULT_SIMILARITY_TOP_K,
+                 vector_store_query_mode: VectorStoreQueryMode = VectorStoreQueryMode.DEFAULT):
+        super().__init__()
+        self._documents = documents  # live mapping owned by PDFAgent
+        self.similarity_top_k = similarity_top_k
+        self.vector_store_query_mode = vector_store_query_mode
+        self.scope: Optional[str] = None  # doc_id to search, None for the whole corpus
+
+    def documents_in_scope(self) -> List[IndexedDocument]:
+        if self.scope is not None and self.scope in self._documents:
+            return [self._documents[self.scope]]
+        return list(self._documents.values())
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        documents = self.documents_in_scope()
+        if not documents:
+            return []
+        if query_bundle.embedding is None:
+            query_bundle.embedding = Settings.embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+        k = self.similarity_top_k
+        if self.vector_store_query_mode == VectorStoreQueryMode.DEFAULT:
+            return self._search(documents, query_bundle, VectorStoreQueryMode.DEFAULT, k)
+        collection_stats = BM25Stats.combine([document.index.vector_store.keyword_stats(query_bundle.query_str) for document in documents])
+        if self.vector_store_query_mode == VectorStoreQueryMode.TEXT_SEARCH:
+            return self._search(documents, query_bundle, VectorStoreQueryMode.TEXT_SEARCH, k, collection_stats)
+        if self.vector_store_query_mode != VectorStoreQueryMode.HYBRID:
+            raise ValueError(f"CorpusRetriever doesn't support the {self.vector_store_query_mode} query mode.")
+        # fuse deeper rankings than k, as NumpyVectorStore does within a document
+        depth = max(4 * k, 20)
+        rankings = [self._search(documents, query_bundle, VectorStoreQueryMode.TEXT_SEARCH, depth, collection_stats),
+                    self._search(documents, query_bundle, VectorStoreQueryMode.DEFAULT, depth)]
+        return fuse_rankings(rankings, k, rrf_k=getattr(documents[0].index.vector_store, "rrf_k", 60))
+
+    def _search(self, documents: List[IndexedDocument], query_bundle: QueryBundle, mode: VectorStoreQueryMode, k: int,
+                collection_stats: Optional[BM25Stats] = None) -> List[NodeWithScore]:
+        """The k best hits of every document, merged by score (so the scores must compare across documents)."""
+        vector_store_kwargs = {"collection_stats": collection_stats} if collection_stats is not None else {}
+        nodes: List[NodeWithScore] = []
+        for document in documents:
+            retriever = document.index.as_retriever(similarity_top_k=k, vector_store_query_mode=mode, vector_store_kwargs=vector_store_kwargs)
+            nodes.extend(document.own_metadata(node) for node in retriever.retrieve(query_bundle))
+        nodes.sort(key=lambda node: node.score or 0.0, reverse=True)
+        return nodes[:k]
+
+    def node_embeddings(self, nodes: List[NodeWithScore]) -> np.ndarray:
+        """
+        Stored (unit-length) embeddings of retrieved nodes, one row each, looked up in the vector stores of the
+        documents in scope, so nothing is embedded again. Raises KeyError for a node none of them holds.
+        """
+        stores = [document.index.vector_store for document in self.documents_in_scope()]
+        rows = []
+        for node in nodes:
+            store = next((store for store in stores if store.contains(node.node.node_id)), None)
+            if store is None:
+                raise KeyError(node.node.node_id)
+            rows.append(store.get(node.node.node_id))
+        return np.asarray(rows, dtype=np.float32)
+
+def fuse_rankings(rankings: List[List[NodeWithScore]], k: int, rrf_k: int = 60) -> List[NodeWithScore]:
+    """
+    Reciprocal rank fusion of rankings of nodes: every ranking adds 1 / (rrf_k + rank) to the score of each of its
+    nodes. Returns the k best, scored by their fused score.
+    """
+    fused: Dict[str, float] = {}
+    nodes: Dict[str, NodeWithScore] = {}
+    for ranking in rankings:
+        for rank, node in enumerate(ranking, start=1):
+            node_id = node.node.node_id
+            fused[node_id] = fused.get(node_id, 0.0) + 1.0 / (rrf_k + rank)
+            nodes.setdefault(node_id, node)
+    top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [NodeWithScore(node=nodes[node_id].node, score=score) for node_id, score in top]
+
+def _page_number(page_label: str) -> int:
+    return int(page_label) if page_label.isdigit() else 0
+
+def format_sources(nodes: List[NodeWithScore]) -> str:
+    """
+    Lists the documents, pages and page regions the retrieved chunks come from, e.g.
+    'a.pdf p. 3 [72, 90, 540, 310], p. 5; b.pdf p. 7'. Regions are bounding boxes in PDF points (x0, y0, x1, y1,
+    origin top left), merged per page; chunks indexed without layout have none.
+    """
+    pages: Dict[str, Dict[str, Optional[List[float]]]] = {}  # file name -> page label -> bounding box
+    for node in nodes:
+        file_name = node.node.metadata.get("file_name", "unknown")
+        page_label = node.node.metadata.get("page_label")
+        labels = pages.setdefault(file_name, {})
+        if page_label is None:
+            continue
+        bbox = node.node.metadata.get("bbox")
+        if page_label in labels and labels[page_label] is not None and bbox is not None:
+            merged = labels[page_label]
+            bbox = [min(merged[0], bbox[0]), min(merged[1], bbox[1]), max(merged[2], bbox[2]), max(merged[3], bbox[3])]
+        labels[page_label] = bbox if page_label not in labels or bbox is not None else labels[page_label]
+    return "; ".join(
+        f"{file_name} " + ", ".join(
+            f"p. {label}" + (f" [{', '.join(f'{v:g}' for v in bbox)}]" if bbox is not None else "")
+            for label, bbox in sorted(labels.items(), key=lambda item: _page_number(item[0]))
+        ) if labels else file_name
+        for file_name, labels in pages.items()
+    )
+
+def format_chunks(nodes: List[NodeWithScore]) -> str:
+    """
+    The retrieved chunks as tool output for the agent, best match first, each headed by its document and page.
+    """
+    if not nodes:
+        return "No matching passages found."
+    return "\n\n".join(
+        f"[{rank}] {format_sources([node])}\n{node.node.get_content(metadata_mode=MetadataMode.NONE).strip()}"
+        for rank, node in enumerate(nodes, start=1)
+    )
+
+def best_page(nodes: List[NodeWithScore]) -> Optional[Tuple[str, int]]:
+    """
+    (file name, page number) of the best matching chunk, the page to navigate to for an answer.
+    """
+    for node in nodes:
+        page_label = node.node.metadata.get("page_label", "")
+        if page_label.isdigit():
+            return node.node.metadata.get("file_name", "unknown"), int(page_label)
+    return None
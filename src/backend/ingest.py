@@ -0,0 +1,303 @@
+from llama_index.core import Document, Settings, StorageContext, VectorStoreIndex
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.node_parser import NodeParser
+from llama_index.core.schema import BaseNode, MetadataMode, NodeRelationship
+from llamaindex_utils.vector_stores import NumpyVectorStore
+from src.backend.renderer import extract_page_blocks
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+import multiprocessing, os, queue, threading, time, uuid
+
+if TYPE_CHECKING:
+    from src.backend.cache import PageDiff
+
+# marks the end of a stage's output
+_DONE = object()
+
+# (start, end) character range of a text block within its page's text, and the block's bounding box
+BlockSpan = Tuple[int, int, Tuple[float, float, float, float]]
+
+def chunk_bbox(spans: List[BlockSpan], start: Optional[int], end: Optional[int]) -> Optional[List[float]]:
+    """
+    Bounding box (x0, y0, x1, y1 in PDF points, origin top left) of the text blocks overlapping a chunk's character range.
+    """
+    if start is None or end is None:
+        return None
+    boxes = [bbox for block_start, block_end, bbox in spans if block_start < end and block_end > start]
+    if not boxes:
+        return None
+    return [round(min(b[0] for b in boxes), 1), round(min(b[1] for b in boxes), 1),
+            round(max(b[2] for b in boxes), 1), round(max(b[3] for b in boxes), 1)]
+
+def reusable_nodes(revision: "PageDiff", file_path: str, persist_dir: str) -> Dict[int, List[BaseNode]]:
+    """
+    Copies the embedded nodes of every page whose text is unchanged since the previous version of the file out of
+    that version's index persisted in persist_dir, relabelled with the page's new number and the file's name and path.
+    Returns them by page index (0-based), for IngestionPipeline's reused_nodes.
+    """
+    vector_store = NumpyVectorStore.from_persist_dir(persist_dir, keyword_index=False)
+    docstore = StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store).docstore
+    previous_pages: Dict[int, List[BaseNode]] = {}
+    for node in docstore.docs.values():
+        previous_pages.setdefault(int(node.metadata["page_label"]) - 1, []).append(node)
+
+    reused: Dict[int, List[BaseNode]] = {}
+    for page_index, previous_page_index in revision.text_matches.items():
+        reused[page_index] = []
+        for node in previous_pages.get(previous_page_index, []):
+            copy = node.model_copy(deep=True)
+            copy.id_ = str(uuid.uuid4())
+            copy.metadata.update(page_label=str(page_index + 1), file_name=os.path.basename(file_path), file_path=file_path)
+            copy.relationships = {NodeRelationship.SOURCE: node.relationships[NodeRelationship.SOURCE]} if NodeRelationship.SOURCE in node.relationships else {}
+            copy.embedding = vector_store.get(node.node_id)
+            reused[page_index].append(copy)
+    return reused
+
+class IngestionPipeline:
+    """
+    Streams a PDF file into a vector index in three concurrent stages:
+    a producer extracts text page by page, a chunker thread turns pages into nodes, and the embedder
+    (the thread calling run) embeds nodes in batches and inserts them into the index as soon as they are ready.
+    MuPDF is not thread-safe, so the producer thread reads the text from a worker process with its own document handle.
+    Stages are connected by bounded queues, so memory stays flat no matter how long the document is,
+    and the index is queryable while later pages are still being embedded.
+    Chunks never cross a page boundary: every node carries its page number (page_label) and the bounding box
+    of its text on the page (bbox), so answers can point at an exact page location.
+    """
+    def __init__(
+        self,
+        file_path: str,
+        page_count: int,
+        index: VectorStoreIndex,
+        embed_model: Optional[BaseEmbedding] = None,
+        node_parser: Optional[NodeParser] = None,
+        embed_batch_size: Optional[int] = None,
+        queue_size: int = 8,
+        on_progress: Optional[Callable[[int, int, int], None]] = None,
+        index_lock: Optional[threading.Lock] = None,
+        cancel_event: Optional[threading.Event] = None,
+        first_batch_pages: int = 0,
+        reused_nodes: Optional[Dict[int, List[BaseNode]]] = None
+    ):
+        """
+        Args:
+            file_path: PDF file to ingest
+            page_count: Number of pages of the file
+            index: Index the embedded nodes are inserted into
+            embed_model: Embedding model (defaults to Settings.embed_model)
+            node_parser: Chunker (defaults to Settings.node_parser, same chunking as VectorStoreIndex.from_documents)
+            embed_batch_size: Nodes embedded per batch (defaults to the embedding model's batch size)
+            queue_size: Capacity of the queues between stages
+            on_progress: Called after every inserted batch with (pages embedded, total pages, nodes embedded)
+            index_lock: Held while inserting into the index, so readers can search it safely during ingestion
+            cancel_event: Stops the pipeline after the current batch once set
+            first_batch_pages: If set, the first batch is inserted as soon as these pages are chunked, even if it isn't full
+            reused_nodes: Already embedded nodes of unchanged pages by page index (0-based); these pages are neither
+                extracted, chunked nor embedded again
+        """
+        self.file_path = file_path
+        self.page_count = page_count
+        self.index = index
+        self.embed_model = embed_model or Settings.embed_model
+        self.node_parser = node_parser or Settings.node_parser
+        self.embed_batch_size = embed_batch_size or self.embed_model.embed_batch_size
+        self.on_progress = on_progress
+        self.index_lock = index_lock or threading.Lock()
+        self.cancel_event = cancel_event or threading.Event()
+        self.first_batch_pages = first_batch_pages
+        self.reused_nodes = reused_nodes or {}
+
+        self._pages: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._nodes: queue.Queue = queue.Queue(maxsize=queue_size * self.embed_batch_size)
+        self._error: Optional[BaseException] = None
+
+    def run(self) -> int:
+        """
+        Runs the pipeline to completion and returns the number of nodes inserted into the index.
+        If cancelled, returns early with the nodes inserted so far.
+        """
+        start = time.time()
+        producer = threading.Thread(target=self._stage, args=(self._produce_pages,), daemon=True)
+        chunker = threading.Thread(target=self._stage, args=(self._chunk_pages,), daemon=True)
+        producer.start()
+        chunker.start()
+
+        total_pages = self.page_count
+        node_count = 0
+        batch: List[BaseNode] = []
+        first_pages_flushed = not self.first_batch_pages
+        pages_done = 0
+        while True:
+            node = self._get(self._nodes)
+            if self.cancel_event.is_set():
+                break
+            page_number = None if node is _DONE else int(node.metadata["page_label"])
+            if batch and not first_pages_flushed and page_number is not None and page_number > self.first_batch_pages:
+                # the first pages are complete: make them searchable without waiting for a full batch
+                pages_done = page_number - 1
+                node_count += self._flush(batch, pages_done, total_pages, node_count)
+                batch, first_pages_flushed = [], True
+            if node is not _DONE:
+                batch.append(node)
+            if batch and (node is _DONE or len(batch) >= self.embed_batch_size):
+                # pages before the last one in the batch are fully embedded
+                pages_done = total_pages if node is _DONE else page_number - 1
+                node_count += self._flush(batch, pages_done, total_pages, node_count)
+                batch = []
+            if node is _DONE:
+                if self.on_progress is not None and pages_done != total_pages and self._error is None:
+                    self.on_progress(total_pages, total_pages, node_count)  # nothing was left to flush
+                break
+        if self.cancel_event.is_set():
+            producer.join(timeout=1)
+            chunker.join(timeout=1)
+            print(f"--Ingestion cancelled after {node_count} nodes--")
+            return node_count
+
+        if self._error is not None:
+            raise self._error
+        producer.join()
+        chunker.join()
+        print(f"--Ingested {total_pages} pages into {node_count} nodes in {round(time.time() - start, 2)}s--")
+        return node_count
+
+    def _flush(self, batch: List[BaseNode], pages_done: int, total_pages: int, node_count: int) -> int:
+        """Embeds and inserts a batch, reports progress and returns the batch size."""
+        self._embed_and_insert(batch)
+        if self.on_progress is not None:
+            self.on_progress(pages_done, total_pages, node_count + len(batch))
+        return len(batch)
+
+    def _stage(self, target: Callable[[], None]) -> None:
+        """Runs a stage, making sure its failure stops the pipeline instead of hanging it."""
+        try:
+            target()
+        except BaseException as e:
+            self._error = e
+            self._nodes.put(_DONE)
+            try:
+                self._pages.put_nowait(_DONE)
+            except queue.Full:
+                pass
+
+    def _put(self, stage_queue: queue.Queue, item) -> None:
+        """
+        Blocking put that gives up once the pipeline is cancelled, so stages never hang on a full queue.
+        The end of a stage's output is still passed on if there is room (the next stage stops on cancel either way).
+        """
+        while not self.cancel_event.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        if item is _DONE:
+            try:
+                stage_queue.put_nowait(_DONE)
+            except queue.Full:
+                pass
+
+    def _get(self, stage_queue: queue.Queue):
+        """Blocking get that returns _DONE once the pipeline is cancelled, so stages never hang on an empty queue."""
+        while not self.cancel_event.is_set():
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _produce_pages(self) -> None:
+        """
+        Producer: builds the text of every page, with the same metadata as SimpleDirectoryReader, along with the
+        character range and bounding box of each text block, from the blocks a worker process extracts (see
+        extract_page_blocks). Reused pages are passed on as their list of embedded nodes instead, and never extracted.
+        """
+        file_path = self.file_path
+        context = multiprocessing.get_context("spawn")
+        blocks_queue = context.Queue(maxsize=self._pages.maxsize)
+        stop_event = context.Event()
+        worker = context.Process(
+            target=extract_page_blocks,
+            args=(file_path, [i for i in range(self.page_count) if i not in self.reused_nodes], blocks_queue, stop_event),
+            daemon=True
+        )
+        worker.start()
+        try:
+            for page_index in range(self.page_count):
+                if self._error is not None or self.cancel_event.is_set():
+                    break
+                if page_index in self.reused_nodes:
+                    self._put(self._pages, self.reused_nodes[page_index])
+                    continue
+                blocks = self._receive_blocks(blocks_queue, worker, page_index)
+                if blocks is None:
+                    break  # cancelled
+                # the text blocks, concatenated in order, are exactly the page's plain text
+                texts, spans, offset = [], [], 0
+                for x0, y0, x1, y1, text in blocks:
+                    texts.append(text)
+                    spans.append((offset, offset + len(text), (x0, y0, x1, y1)))
+                    offset += len(text)
+                self._put(self._pages, (Document(
+                    text="".join(texts),
+                    metadata={
+                        "page_label": str(page_index + 1),
+                        "file_name": os.path.basename(file_path),
+                        "file_path": file_path
+                    },
+                    # layout only, neither embedded nor shown to the LLM
+                    excluded_embed_metadata_keys=["bbox"],
+                    excluded_llm_metadata_keys=["bbox"]
+                ), spans))
+        finally:
+            stop_event.set()
+            worker.join(timeout=1)
+            if worker.is_alive():  # blocked on a full queue nobody reads anymore
+                worker.terminate()
+        self._put(self._pages, _DONE)
+
+    def _receive_blocks(self, blocks_queue, worker, page_index: int) -> Optional[list]:
+        """
+        Waits for the extraction worker's text blocks of the given page. Returns None once the pipeline is cancelled,
+        and raises if the worker failed or died.
+        """
+        while not self.cancel_event.is_set():
+            alive = worker.is_alive()
+            try:
+                item = blocks_queue.get(timeout=0.1)
+            except queue.Empty:
+                if not alive:
+                    raise RuntimeError(f"The text extraction worker exited with code {worker.exitcode} before page {page_index + 1}.")
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            assert item is not None and item[0] == page_index, f"The text extraction worker skipped page {page_index + 1}."
+            return item[1]
+        return None
+
+    def _chunk_pages(self) -> None:
+        """Chunker: splits each page into nodes as soon as it arrives and locates every node on its page."""
+        while True:
+            page = self._get(self._pages)
+            if page is _DONE or self._error is not None:
+                break
+            if isinstance(page, list):
+                nodes = page
+            else:
+                document, spans = page
+                nodes = self.node_parser.get_nodes_from_documents([document])
+                for node in nodes:
+                    bbox = chunk_bbox(spans, node.start_char_idx, node.end_char_idx)
+                    if bbox is not None:
+                        node.metadata["bbox"] = bbox
+            for node in nodes:
+                self._put(self._nodes, node)
+        self._put(self._nodes, _DONE)
+
+    def _embed_and_insert(self, nodes: List[BaseNode]) -> None:
+        """Embedder: embeds one batch of nodes (except reused ones, which already are) and makes them searchable."""
+        pending = [node for node in nodes if node.embedding is None]
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in pending]
+        for node, embedding in zip(pending, self.embed_model.get_text_embedding_batch(texts) if texts else []):
+            node.embedding = embedding
+        with self.index_lock:
+            self.index.insert_nodes(nodes)
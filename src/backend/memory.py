@@ -0,0 +1,265 @@
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms import LLM
+from llama_index.core.memory.types import BaseMemory
+from typing import Any, Callable, Dict, List, Optional
+import hashlib, json, os, threading, time
+
+SUMMARY_PROMPT = (
+    "You condense a conversation between a user and an assistant that answers questions about PDF documents. "
+    "Merge the summary so far with the new turns into one short summary (at most 150 words): keep the user's goals, "
+    "the facts the assistant found with their document names and page numbers, and open questions. "
+    "Reply with the summary only."
+)
+
+class SessionStore:
+    """
+    Conversations persisted per document (or set of documents), one small JSON file each, so reopening a PDF resumes
+    its conversation from the stored summary and recent turns without replaying anything to the chat model.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(doc_ids: List[str]) -> str:
+        """
+        The session of a single document is keyed by its content hash, a corpus by the hash of its sorted hashes.
+        """
+        if len(doc_ids) == 1:
+            return doc_ids[0]
+        return hashlib.sha256("|".join(sorted(doc_ids)).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key[:32]}.json")
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def save(self, key: str, state: Dict[str, Any]) -> None:
+        """
+        Writes to a temporary file first, so a crash mid-write never leaves a broken session behind.
+        """
+        path = self._path(key)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({**state, "saved_at": time.time()}, f)
+        os.replace(f"{path}.tmp", path)
+
+class RollingSummaryMemory(BaseMemory):
+    """
+    Chat history of the agent that stays bounded however long the session runs: the last max_turns turns verbatim,
+    and, with an llm, a rolling summary of everything older. Turns that fall out of the window are folded into the
+    summary by a background thread as soon as a turn ends, so summarization happens between questions and never
+    in front of one; turns whose summary isn't ready yet are sent verbatim meanwhile. Without an llm they are dropped.
+    Reads also keep to token_limit, dropping the oldest turns first.
+    A turn is everything from begin_turn() to end_turn(): the question, the agent's reasoning and its answer.
+    With a SessionStore, the summary and recent turns are saved under session_key after every change.
+    """
+
+    token_limit: int = Field(
+        default=3000,
+        description="Maximum tokens of history returned by get(), summary included.",
+        gt=0
+    )
+    max_turns: int = Field(
+        default=6,
+        description="Number of most recent turns kept verbatim. 0 keeps every turn that fits into token_limit.",
+        ge=0
+    )
+    summary_max_tokens: int = Field(
+        default=256,
+        description="Maximum tokens the chat model may generate for a summary.",
+        gt=0
+    )
+
+    # private attributes that won't be serialized
+    _llm: Optional[LLM] = PrivateAttr(default=None)
+    _tokenizer_fn: Callable[[str], Any] = PrivateAttr()
+    _store: Optional[SessionStore] = PrivateAttr(default=None)
+    _session_key: Optional[str] = PrivateAttr(default=None)
+    _summary: str = PrivateAttr(default="")
+    _pending: List[List[ChatMessage]] = PrivateAttr(default_factory=list)  # evicted turns waiting for the summary
+    _turns: List[List[ChatMessage]] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr()
+    _save_lock: Any = PrivateAttr()  # the summarizer thread saves too
+    _summarizer: Optional[threading.Thread] = PrivateAttr(default=None)  # set while summarizing
+
+    def __init__(
+        self,
+        tokenizer_fn: Callable[[str], Any],
+        llm: Optional[LLM] = None,
+        token_limit: int = 3000,
+        max_turns: int = 6,
+        summary_max_tokens: int = 256,
+        store: Optional[SessionStore] = None,
+        session_key: Optional[str] = None,
+        **kwargs: Any
+    ):
+        """
+        Args:
+            tokenizer_fn: Tokenizes a text; only the length of its result is used
+            llm: Chat model that writes the rolling summary. Turns out of the window are dropped without one
+            token_limit: Maximum tokens of history returned by get()
+            max_turns: Number of most recent turns kept verbatim
+            summary_max_tokens: Maximum tokens of a summary
+            store: Where the session is persisted, if anywhere
+            session_key: Key of the session in the store; its saved state is loaded right away
+        """
+        super().__init__(token_limit=token_limit, max_turns=max_turns, summary_max_tokens=summary_max_tokens, **kwargs)
+        self._llm = llm
+        self._tokenizer_fn = tokenizer_fn
+        self._store = store
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        if store is not None and session_key is not None:
+            self._session_key = session_key
+            state = store.load(session_key)
+            if state is not None:
+                self._load_state(state)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RollingSummaryMemory"
+
+    @classmethod
+    def from_defaults(cls, **kwargs: Any) -> "RollingSummaryMemory":
+        return cls(**kwargs)
+
+    @property
+    def session_key(self) -> Optional[str]:
+        return self._session_key
+
+    @session_key.setter
+    def session_key(self, key: Optional[str]) -> None:
+        """
+        Moves the session to another key (e.g. when documents are added to the corpus) and saves it there.
+        """
+        self._session_key = key
+        self._save()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"turns": len(self._turns), "pending_turns": len(self._pending), "summary_tokens": len(self._tokenizer_fn(self._summary))}
+
+    def begin_turn(self) -> None:
+        with self._lock:
+            self._turns.append([])
+
+    def end_turn(self) -> None:
+        """
+        Closes the current turn, moves turns out of the window to the summary (in the background) and saves.
+        """
+        with self._lock:
+            while self.max_turns and len(self._turns) > self.max_turns:
+                evicted = self._turns.pop(0)
+                if self._llm is not None:
+                    self._pending.append(evicted)
+            start_summarizer = bool(self._pending) and self._summarizer is None
+            if start_summarizer:
+                self._summarizer = threading.Thread(target=self._summarize_pending, daemon=True)
+        if start_summarizer:
+            self._summarizer.start()
+        self._save()
+
+    def get(self, input: Optional[str] = None, **kwargs: Any) -> List[ChatMessage]:
+        """
+        The summary (as a system message), turns waiting to be summarized and the recent turns, oldest turns
+        dropped first until they fit into token_limit. The current turn is always kept.
+        """
+        with self._lock:
+            summary = [ChatMessage(role=MessageRole.SYSTEM, content=f"Summary of the earlier conversation: {self._summary}")] if self._summary else []
+            turns = [list(turn) for turn in self._pending + self._turns if turn]
+        tokens = [self._count(turn) for turn in turns]
+        budget = self.token_limit - self._count(summary)
+        while len(turns) > 1 and sum(tokens) > budget:
+            turns.pop(0)
+            tokens.pop(0)
+        return summary + [message for turn in turns for message in turn]
+
+    def get_all(self) -> List[ChatMessage]:
+        with self._lock:
+            summary = [ChatMessage(role=MessageRole.SYSTEM, content=f"Summary of the earlier conversation: {self._summary}")] if self._summary else []
+            return summary + [message for turn in self._pending + self._turns for message in turn]
+
+    def put(self, message: ChatMessage) -> None:
+        with self._lock:
+            if not self._turns:
+                self._turns.append([])
+            self._turns[-1].append(message)
+
+    def set(self, messages: List[ChatMessage]) -> None:
+        """
+        Replaces the history, starting a new turn at every user message.
+        """
+        with self._lock:
+            self._pending, self._turns = [], []
+            for message in messages:
+                if message.role == MessageRole.USER or not self._turns:
+                    self._turns.append([])
+                self._turns[-1].append(message)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._summary, self._pending, self._turns = "", [], []
+
+    def _count(self, messages: List[ChatMessage]) -> int:
+        return len(self._tokenizer_fn(" ".join(str(message.content) for message in messages))) if messages else 0
+
+    def _summarize_pending(self) -> None:
+        """
+        Summarizer thread: folds the pending turns into the summary, one chat model call per batch, until none are left.
+        On failure the turns stay pending (and are sent verbatim) until the next attempt after a later turn.
+        """
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._summarizer = None  # under the lock, so end_turn starts a new one for turns evicted from now on
+                    return
+                batch, summary = list(self._pending), self._summary
+            transcript = "\n".join(f"{message.role.value.capitalize()}: {message.content}" for turn in batch for message in turn)
+            prompt = [
+                ChatMessage(role=MessageRole.SYSTEM, content=SUMMARY_PROMPT),
+                ChatMessage(role=MessageRole.USER, content=f"Summary so far: {summary or '(none)'}\n\nNew turns:\n{transcript}")
+            ]
+            start = time.time()
+            try:
+                new_summary = (self._llm.chat(prompt, max_tokens=self.summary_max_tokens).message.content or "").strip()
+            except Exception as e:
+                print(f"--Conversation summary failed: {e}--")
+                with self._lock:
+                    self._summarizer = None
+                return
+            with self._lock:
+                self._summary = new_summary or summary
+                del self._pending[:len(batch)]
+            print(f"--Summarized {len(batch)} older turns in {round(time.time() - start, 2)}s--")
+            self._save()
+
+    def _state(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "summary": self._summary,
+                "turns": [[{"role": message.role.value, "content": message.content} for message in turn] for turn in self._pending + self._turns if turn]
+            }
+
+    def _load_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restores a saved session. Turns past the window go back to the summarizer on the next end_turn().
+        """
+        with self._lock:
+            self._summary = state.get("summary", "")
+            self._turns = [[ChatMessage(role=message["role"], content=message["content"]) for message in turn] for turn in state.get("turns", [])]
+        print(f"--Resumed conversation: {len(self._turns)} turns{' and a summary' if self._summary else ''}--")
+
+    def _save(self) -> None:
+        if self._store is None or self._session_key is None:
+            return
+        try:
+            with self._save_lock:
+                self._store.save(self._session_key, self._state())
+        except OSError as e:
+            print(f"--Failed to save the conversation: {e}--")
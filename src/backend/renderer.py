@@ -0,0 +1,193 @@
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, Dict, Iterable, List, Optional, Set
+import heapq, itertools, multiprocessing, threading, os
+
+def render_page_range(file_path: str, start: int, image_paths: List[str], dpi: int) -> int:
+    """
+    Worker entry point for multi-process rendering: opens its own PyMuPDF handle and renders pages
+    [start, start + len(image_paths)) into the given image paths. Returns the number of pages rendered.
+    """
+    import pymupdf as pd
+    with pd.open(file_path) as doc:
+        for offset, image_path in enumerate(image_paths):
+            save_pixmap(doc[start + offset].get_pixmap(dpi=dpi), image_path)
+    return len(image_paths)
+
+def extract_page_blocks(file_path: str, page_indices: List[int], pages, stop_event) -> None:
+    """
+    Worker entry point for text extraction: opens its own PyMuPDF handle and sends (page index, text blocks) for each
+    of the given pages through the pages queue, each block as (x0, y0, x1, y1, text), then None. Stops early once
+    stop_event is set. A failure is sent as a RuntimeError before the None.
+    """
+    try:
+        import pymupdf as pd
+        with pd.open(file_path) as doc:
+            for page_index in page_indices:
+                if stop_event.is_set():
+                    break
+                pages.put((page_index, [block[:5] for block in doc[page_index].get_text("blocks") if block[6] == 0]))
+    except Exception as e:
+        pages.put(RuntimeError(f"Text extraction of {file_path} failed: {e}"))  # MuPDF's own errors may not pickle
+    pages.put(None)
+
+def save_pixmap(pixmap, image_path: str) -> None:
+    """
+    Saves a pixmap as PNG atomically, so an interrupted render never leaves a truncated image in the page cache.
+    """
+    partial_path = f"{image_path[:-len('.png')]}.part.png"
+    pixmap.save(partial_path)
+    os.replace(partial_path, image_path)
+
+class PageRenderQueue:
+    """
+    Renders pages of a PDF on demand, most urgent first.
+    Pages are requested with a priority (lower renders sooner) and a dispatcher thread hands them to worker processes,
+    keeping at most one page in flight per worker so that a new viewport takes effect right away.
+    A page that fails to render is not retried: its error is kept and raised to anyone waiting for it.
+    """
+    def __init__(
+        self,
+        file_path: str,
+        image_paths: List[str],
+        dpi: int,
+        workers: int = 1,
+        on_rendered: Optional[Callable[[int, str], None]] = None
+    ):
+        self._file_path = file_path
+        self._image_paths = image_paths
+        self._dpi = dpi
+        self._workers = max(1, workers)
+        self._on_rendered = on_rendered
+
+        self._heap = []  # (priority, insertion order, page index)
+        self._order = itertools.count()
+        self._queued: Dict[int, int] = {}  # page index -> priority of its live heap entry
+        self._in_flight: Set[int] = set()
+        self._rendered: Dict[int, threading.Event] = {}  # page index -> set once the page is rendered or failed
+        self._errors: Dict[int, BaseException] = {}  # page index -> why it could not be rendered
+        for page_index, image_path in enumerate(image_paths):
+            if os.path.exists(image_path):  # already in the page cache
+                self._rendered[page_index] = threading.Event()
+                self._rendered[page_index].set()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # MuPDF is not thread-safe, so pages are rendered in processes with their own document handles
+        self._executor = ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context("spawn"))
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def request(self, page_indices: Iterable[int], priority: int = 0) -> None:
+        """
+        Queues pages for rendering. Pages that are already rendered, in flight or queued more urgently are left alone.
+        """
+        with self._cond:
+            for page_index in page_indices:
+                self._push(page_index, priority)
+            self._cond.notify_all()
+
+    def prioritize(self, first_visible: int, last_visible: int, lookahead: int = 3) -> None:
+        """
+        Replaces the queue with the pages around the viewport: visible pages first, then their neighbours by distance.
+        Pages that scrolled away are dropped until they come close to the viewport again.
+        """
+        with self._cond:
+            self._heap.clear()
+            self._queued.clear()
+            for page_index in range(first_visible, last_visible + 1):
+                self._push(page_index, 0)
+            for distance in range(1, lookahead + 1):
+                self._push(last_visible + distance, distance)
+                self._push(first_visible - distance, distance)
+            self._cond.notify_all()
+
+    def render(self, page_index: int, timeout: Optional[float] = None) -> str:
+        """
+        Renders the page with top priority and blocks until its image exists. Returns the image path.
+        Raises the error the page failed to render with, or RuntimeError if the queue is closed before it is rendered.
+        """
+        self.request([page_index], priority=-1)
+        with self._cond:
+            done = self._rendered.setdefault(page_index, threading.Event())
+            if self._closed and not done.is_set():
+                self._fail(page_index, RuntimeError(f"Page {page_index} was not rendered: the render queue is closed."))
+        assert done.wait(timeout), f"Page {page_index} was not rendered within {timeout}s."
+        with self._cond:
+            if page_index in self._errors:
+                raise self._errors[page_index]
+        return self._image_paths[page_index]
+
+    def is_rendered(self, page_index: int) -> bool:
+        with self._cond:
+            return page_index in self._rendered and self._rendered[page_index].is_set() and page_index not in self._errors
+
+    def close(self) -> None:
+        """
+        Stops the dispatcher and drops every page that hasn't started rendering yet. Threads waiting for a page
+        that won't be rendered anymore get a RuntimeError.
+        """
+        with self._cond:
+            self._closed = True
+            self._heap.clear()
+            self._queued.clear()
+            for page_index, done in self._rendered.items():
+                if not done.is_set():
+                    self._fail(page_index, RuntimeError(f"Page {page_index} was not rendered: the render queue was closed."))
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _push(self, page_index: int, priority: int) -> None:
+        """Adds a heap entry for the page. Must be called with the lock held."""
+        if not 0 <= page_index < len(self._image_paths) or page_index in self._in_flight or page_index in self._errors:
+            return
+        if page_index in self._rendered and self._rendered[page_index].is_set():
+            return
+        if page_index in self._queued and self._queued[page_index] <= priority:
+            return
+        self._queued[page_index] = priority
+        heapq.heappush(self._heap, (priority, next(self._order), page_index))
+
+    def _dispatch(self) -> None:
+        """Dispatcher thread: feeds the most urgent queued page to the next free worker."""
+        while True:
+            with self._cond:
+                while not self._closed and (not self._heap or len(self._in_flight) >= self._workers):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                priority, _, page_index = heapq.heappop(self._heap)
+                if self._queued.get(page_index) != priority:
+                    continue  # superseded by a more urgent entry or dropped by a viewport change
+                del self._queued[page_index]
+                self._in_flight.add(page_index)
+            try:
+                future = self._executor.submit(render_page_range, self._file_path, page_index, [self._image_paths[page_index]], self._dpi)
+            except RuntimeError as e:  # executor shut down while we were dispatching, or broken by a crashed worker
+                with self._cond:
+                    self._in_flight.discard(page_index)
+                    self._fail(page_index, e)
+                    if self._closed:
+                        return
+                continue
+            future.add_done_callback(lambda f, i=page_index: self._finish(i, f))
+
+    def _fail(self, page_index: int, error: BaseException) -> None:
+        """Records why a page could not be rendered and wakes up threads waiting for it. Must be called with the lock held."""
+        self._errors[page_index] = error
+        self._rendered.setdefault(page_index, threading.Event()).set()
+
+    def _finish(self, page_index: int, future: Future) -> None:
+        """Marks the page as rendered (or failed) and notifies the UI."""
+        with self._cond:
+            self._in_flight.discard(page_index)
+            self._cond.notify_all()
+            if future.cancelled():
+                self._fail(page_index, RuntimeError(f"Page {page_index} was not rendered: the render queue was closed."))
+                return
+            if future.exception() is not None:
+                print(f"--Failed to render page {page_index}: {future.exception()}--")
+                self._fail(page_index, future.exception())
+                return
+            self._rendered.setdefault(page_index, threading.Event()).set()
+        if self._on_rendered is not None and not self._closed:
+            self._on_rendered(page_index, self._image_paths[page_index])
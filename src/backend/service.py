@@ -1,6 +1,10 @@
-from typing import List, Optional, TYPE_CHECKING
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
 from dotenv import load_dotenv
-import time, os, shutil
+from src.backend.renderer import PageRenderQueue, render_page_range, save_pixmap
+from src.backend.cache import PageImageCache, PageManifestCache, PageDiff, file_sha256, page_fingerprints, write_page_manifest
+import time, os, shutil, math, multiprocessing, threading
 
 if TYPE_CHECKING:
     from src.backend.agent import PDFAgent
@@ -8,66 +12,447 @@ if TYPE_CHECKING:
 
 load_dotenv(verbose=True)
 
+# Page rendering configuration
+RENDER_DPI = int(os.getenv('RENDER_DPI', '150'))
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', str(min(os.cpu_count() or 1, 8))))
+RENDER_PARALLEL_MIN_PAGES = int(os.getenv('RENDER_PARALLEL_MIN_PAGES', '32'))
+RENDER_LAZY = os.getenv('RENDER_LAZY', 'true').lower() == 'true'
+RENDER_LOOKAHEAD = int(os.getenv('RENDER_LOOKAHEAD', '3'))
+PAGE_CACHE_MAX_MB = int(os.getenv('PAGE_CACHE_MAX_MB', '1024'))
+
+# Corpus mode: opening a PDF adds it to the open documents instead of replacing the current one
+CORPUS_MODE = os.getenv('CORPUS_MODE', 'false').lower() == 'true'
+
+@dataclass
+class LoadProgress:
+    """
+    Progress event of a PDF load. Stages are 'rendering' (pages rendered) and 'indexing' (pages embedded);
+    indexing events keep coming after load_pdf returns, while the rest of the document is indexed in the background.
+    """
+    stage: str
+    done: int
+    total: int
+    chunks: int = 0  # chunks embedded so far (indexing only)
+    eta: Optional[float] = None  # seconds left in this stage, estimated from the rate so far
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+class LoadCancelled(Exception):
+    """Raised inside a load that was cancelled because another file was picked."""
+
+class LoadTask:
+    """
+    Handle of a PDF load running in the background, see PDFService.load_pdf_in_background.
+    """
+    def __init__(self):
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.finished.wait(timeout)
+
+def _progress_reporter(stage: str, on_progress: Optional[Callable[[LoadProgress], None]]) -> Callable[..., None]:
+    """
+    Returns a function that turns (done, total[, chunks]) counts into LoadProgress events with an ETA.
+    """
+    start = time.time()
+
+    def report(done: int, total: int, chunks: int = 0) -> None:
+        if on_progress is None:
+            return
+        elapsed = time.time() - start
+        eta = elapsed / done * (total - done) if done else None
+        on_progress(LoadProgress(stage=stage, done=done, total=total, chunks=chunks, eta=eta))
+
+    return report
+
 class PDFService:
     """
     Service class for handling all PDF operations including loading, parsing, and querying.
     """
-    def __init__(self, agent: "PDFAgent" =None, ui_callbacks=None):
-        self.pdf: Optional["pd.Document"] = None  # raw document handle
+    def __init__(self, agent: "PDFAgent" =None, ui_callbacks=None, render_workers: int = RENDER_WORKERS, lazy_rendering: bool = RENDER_LAZY,
+                 corpus_mode: bool = CORPUS_MODE):
+        self.pdf: Optional["pd.Document"] = None  # raw handle of the displayed document
+        self.render_workers = max(1, render_workers)
+        self.lazy_rendering = lazy_rendering  # render pages on demand instead of all of them in load_pdf
+        self.corpus_mode = corpus_mode  # keep every loaded file open and searchable
+        self.ui_callbacks = ui_callbacks or {}
+        self._doc_hash: Optional[str] = None  # content hash of the displayed file, keys its cached page images
+        self._open_documents: Dict[str, "pd.Document"] = {}  # doc hash -> handle of every open file
+        self._render_queue: Optional[PageRenderQueue] = None
+        self._load_task: Optional[LoadTask] = None
+        self._load_lock = threading.Lock()  # one load at a time; a new one waits for the cancelled one to wind down
         self.agent = agent or self._create_default_agent(ui_callbacks=ui_callbacks)
-        # make sure storage/ui exists and clear it
-        os.makedirs("storage/ui", exist_ok=True)
-        self._clear_ui_folder()
+        # page images in storage/ui are a persistent cache, shared by every session that opens the same file
+        self.page_cache = PageImageCache(root=os.getenv('UI_PATH', 'storage/ui'), max_bytes=PAGE_CACHE_MAX_MB * 2**20)
+        # per-page hashes of every opened file version, so a revised file only re-renders and re-embeds changed pages
+        self.page_manifests = PageManifestCache(root=os.getenv('PAGE_HASH_PATH', 'storage/pages'))
+        self.revision: Optional[PageDiff] = None  # page diff of the last loaded file against its previous version
+        self._manifest_writer: Optional[multiprocessing.Process] = None  # fingerprints a file opened for the first time
         # make sure storage/data exists and clear it
         self._clear_data_folder()
 
-    def load_pdf(self, file_path: str) -> List[str]:
+    def load_pdf(
+        self,
+        file_path: str,
+        on_progress: Optional[Callable[[LoadProgress], None]] = None,
+        cancel_event: Optional[threading.Event] = None
+    ) -> List[str]:
         """
-        Discards old PDF, loads a new one from the given path.
+        Discards old PDF, loads a new one from the given path. In corpus mode the other open files stay open and
+        searchable, the new one is only added (or just displayed, if it is open already).
         Returns a list of image paths for each page in the PDF to be rendered in the UI.
+        Reports LoadProgress events through on_progress, and raises LoadCancelled once cancel_event is set.
         """
         import pymupdf as pd
         start = time.time()
-        self._discard_pdf()
-
+        cancel_event = cancel_event or threading.Event()
         assert os.path.exists(file_path), f"File {file_path} does not exist on the disk."
+        doc_hash = file_sha256(file_path)
+        if self.corpus_mode:
+            if doc_hash in self._open_documents:
+                self.revision = None
+                return self.show_pdf(doc_hash)
+            self._stop_rendering()
+        else:
+            self._discard_pdf()
+
         self.pdf = pd.open(file_path)
         assert self.pdf is not None, "PyMuPDF failed to load the document."
+        self._doc_hash = doc_hash
+        self._open_documents[doc_hash] = self.pdf
+        try:
+            self.revision = self._compare_with_previous_version(file_path)
+            self._show_loaded_pdf(on_progress, cancel_event)
+            print(f"-*-File {os.path.basename(file_path)} loaded successfully in {round(time.time()-start, 2)}s!-*-")
 
-        self._convert_pages_to_images(os.path.basename(file_path))
-        print(f"-*-File {os.path.basename(file_path)} loaded successfully in {round(time.time()-start, 2)}s!-*-")
+            index = self.agent.add_document if self.corpus_mode else self.agent.create_index
+            index(
+                file_path,
+                document=self.pdf,
+                on_progress=_progress_reporter("indexing", on_progress),
+                cancel_event=cancel_event,
+                revision=self.revision
+            )
+            self._check_cancelled(cancel_event)
+        except LoadCancelled:
+            if self.corpus_mode:
+                self.remove_pdf(doc_hash)  # a half-loaded file doesn't join the corpus
+            raise
 
-        self.agent.create_index(file_path)
+        return self._get_image_paths()
+
+    def _show_loaded_pdf(self, on_progress: Optional[Callable[[LoadProgress], None]] = None, cancel_event: Optional[threading.Event] = None) -> None:
+        """
+        Makes the page images of the displayed PDF available: from the page cache, lazily or all rendered up front.
+        """
+        cancel_event = cancel_event or threading.Event()
+        report_rendering = _progress_reporter("rendering", on_progress)
+        if self.page_cache.has_document(self._doc_hash, self.pdf.page_count, RENDER_DPI):
+            self.page_cache.touch(self._get_image_paths())
+            report_rendering(self.pdf.page_count, self.pdf.page_count)
+            print("--UI images loaded from cache!--")
+        elif self.lazy_rendering:
+            self._start_render_queue()
+        else:
+            self._convert_pages_to_images(report_rendering, cancel_event)
+            self.page_cache.evict(keep_doc_hash=self._doc_hash)
+        self._check_cancelled(cancel_event)
+
+    def _compare_with_previous_version(self, file_path: str) -> Optional[PageDiff]:
+        """
+        Fingerprints the pages of a file version opened for the first time and compares them with the version
+        previously opened from the same path. Pages that render the same get the previous version's cached image,
+        so only changed pages are rasterized. Returns the diff, or None if there is no previous version to compare to
+        (or this exact version was opened before, in which case everything is cached under its content hash anyway).
+        Without a previous version nothing waits for the fingerprints: a worker process writes them in the background,
+        for the next version to be compared with.
+        """
+        if self._manifest_writer is not None:
+            self._manifest_writer.join()  # the previous version's manifest may still be being written
+            self._manifest_writer = None
+        if self.page_manifests.contains(self._doc_hash, file_path):
+            return None
+        previous = self.page_manifests.previous_version(self._doc_hash, file_path)
+        if previous is None:
+            # MuPDF is not thread-safe, so the worker fingerprints the file with a document handle of its own
+            self._manifest_writer = multiprocessing.get_context("spawn").Process(
+                target=write_page_manifest,
+                args=(self.page_manifests.root, self.page_manifests.max_entries, self._doc_hash, file_path),
+                daemon=True
+            )
+            self._manifest_writer.start()
+            return None
+        start = time.time()
+        fingerprints = page_fingerprints(self.pdf)
+        self.page_manifests.store(self._doc_hash, file_path, fingerprints)
+        revision = PageDiff.compare(previous, fingerprints, os.path.basename(file_path))
+        reused = 0
+        for page_index, previous_index in revision.image_matches.items():
+            previous_path = self.page_cache.page_path(revision.previous_doc_hash, previous_index, RENDER_DPI)
+            if os.path.exists(previous_path) and not os.path.exists(self._page_image_path(page_index)):
+                shutil.copyfile(previous_path, self._page_image_path(page_index))
+                reused += 1
+        print(revision.report())
+        print(f"--Pages compared with the previous version in {round(time.time() - start, 2)}s, {reused} page images reused--")
+        return revision
 
+    def show_pdf(self, doc_hash: str) -> List[str]:
+        """
+        Corpus mode: displays another open file without touching the corpus. Returns its page image paths.
+        """
+        assert doc_hash in self._open_documents, f"Document {doc_hash} is not open."
+        if doc_hash != self._doc_hash:
+            self._stop_rendering()
+            self.pdf, self._doc_hash = self._open_documents[doc_hash], doc_hash
+            self._show_loaded_pdf()
         return self._get_image_paths()
 
+    def remove_pdf(self, doc_hash: Optional[str] = None) -> Optional[List[str]]:
+        """
+        Corpus mode: closes one open file (the displayed one by default) and removes only its chunks from the index.
+        If it was displayed, the most recently opened remaining file is shown instead and its image paths are returned;
+        returns None if nothing is left to display.
+        """
+        doc_hash = doc_hash or self._doc_hash
+        assert doc_hash in self._open_documents, f"Document {doc_hash} is not open."
+        if doc_hash in {document.doc_id for document in self.agent.documents()}:
+            self.agent.remove_document(doc_hash)  # also waits for its background indexing to stop
+        self._open_documents.pop(doc_hash).close()
+        print("--File closed!--")
+        if doc_hash != self._doc_hash:
+            return None
+        self._stop_rendering()
+        self.pdf, self._doc_hash = None, None
+        if not self._open_documents:
+            self.page_cache.evict()
+            return None
+        return self.show_pdf(list(self._open_documents)[-1])
+
+    def documents(self) -> List[Tuple[str, str]]:
+        """
+        (doc hash, file name) of every open file, in the order they were opened.
+        """
+        return [(doc_hash, os.path.basename(document.name)) for doc_hash, document in self._open_documents.items()]
+
+    def set_search_scope(self, doc_hash: Optional[str]) -> None:
+        """
+        Corpus mode: lets the agent search only one open file, or all of them again with None.
+        """
+        self.agent.set_scope(doc_hash)
+
+    def load_pdf_in_background(
+        self,
+        file_path: str,
+        on_progress: Optional[Callable[[LoadProgress], None]] = None,
+        on_done: Optional[Callable[[List[str]], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None
+    ) -> LoadTask:
+        """
+        Non-blocking load_pdf: loads the file in a background thread and returns right away.
+        Picking another file cancels the load that is still running. Callbacks of a cancelled load are never called,
+        on_done receives the image paths and on_error any exception raised by the load.
+        """
+        task = LoadTask()
+        previous, self._load_task = self._load_task, task
+        if previous is not None:
+            previous.cancel()
+
+        def forward_progress(progress: LoadProgress) -> None:
+            if on_progress is not None and not task.cancelled:
+                on_progress(progress)
+
+        def run() -> None:
+            try:
+                with self._load_lock:
+                    if task.cancelled:
+                        return
+                    image_paths = self.load_pdf(file_path, on_progress=forward_progress, cancel_event=task.cancel_event)
+                if on_done is not None and not task.cancelled:
+                    on_done(image_paths)
+            except LoadCancelled:
+                print(f"--Loading {os.path.basename(file_path)} cancelled--")
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(e)
+            finally:
+                task.finished.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return task
+
+    @staticmethod
+    def _check_cancelled(cancel_event: threading.Event) -> None:
+        if cancel_event.is_set():
+            raise LoadCancelled()
+
     def _discard_pdf(self) -> None:
         """
-        Discards the currently loaded file and clears all related data to prepare for a new file.
+        Discards every open file and clears all related data to prepare for a new file.
         """
-        if self.pdf is not None:
-            self.pdf.close()
+        self._stop_rendering()
+        if self._open_documents:
+            self.agent.cancel_indexing() # background indexing reads from the documents
+            for document in self._open_documents.values():
+                document.close()
+            self._open_documents.clear()
+            self.pdf, self._doc_hash = None, None
             print("--Old file closed!--")
-            self._clear_ui_folder()
+            self.page_cache.evict()
             self._clear_data_folder()
 
-    def _convert_pages_to_images(self, file_name: str) -> None:
+    def _stop_rendering(self) -> None:
+        """
+        Stops lazy rendering of the displayed file.
+        """
+        if self._render_queue is not None:
+            self._render_queue.close()
+            self._render_queue = None
+
+    def close(self) -> None:
+        """
+        Releases everything the service holds on to: the open file, render workers and the agent's connections.
+        """
+        if self._load_task is not None:
+            self._load_task.cancel()
+        with self._load_lock:  # waits for a cancelled load to stop
+            self._discard_pdf()
+            if self._manifest_writer is not None:
+                self._manifest_writer.join()
+                self._manifest_writer = None
+        self.agent.close()
+
+    def _convert_pages_to_images(self, report: Callable[[int, int], None], cancel_event: threading.Event) -> None:
+        """
+        Converts each page of the loaded PDF into a PNG image and saves them to the page cache (~/storage/ui) for rendering.
+        Pages whose image is already cached (e.g. unchanged pages of a revised file) are skipped.
+        Large documents are split into page ranges and rendered by a pool of worker processes.
+        Reports (pages rendered, total pages) after every page or range, and stops early once cancel_event is set.
+        """
+        assert os.path.exists(self.page_cache.root), "UI storage folder does not exist. Please create it first."
+        image_paths = [self._page_image_path(i) for i in range(self.pdf.page_count)]
+        missing = [i for i, path in enumerate(image_paths) if not os.path.exists(path)]
+        cached = len(image_paths) - len(missing)
+        if self.render_workers > 1 and len(missing) >= RENDER_PARALLEL_MIN_PAGES:
+            self._render_pages_parallel(image_paths, missing, report, cancel_event)
+        else:
+            for done, i in enumerate(missing):
+                self._check_cancelled(cancel_event)
+                page_png = self.pdf[i].get_pixmap(dpi=RENDER_DPI)
+                save_pixmap(page_png, image_paths[i])
+                report(cached + done + 1, len(image_paths))
+        print(f"--UI images created! ({len(missing)} rendered, {cached} cached)--")
+
+    def _render_pages_parallel(self, image_paths: List[str], missing: List[int], report: Callable[[int, int], None], cancel_event: threading.Event) -> None:
+        """
+        Renders the missing pages in worker processes, each of which opens its own handle to the file on disk.
+        Ranges are kept small (several per worker) so that heavy pages don't leave other workers idle.
+        """
+        workers = min(self.render_workers, len(missing))
+        range_size = max(1, math.ceil(len(missing) / (workers * 4)))
+        # split runs of consecutive missing pages into ranges of at most range_size pages
+        ranges = []
+        for i in missing:
+            if ranges and i == ranges[-1][0] + ranges[-1][1] and ranges[-1][1] < range_size:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([i, 1])
+        # spawn keeps workers independent of the UI threads running in this process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [
+                executor.submit(render_page_range, self.pdf.name, start, image_paths[start:start + count], RENDER_DPI)
+                for start, count in ranges
+            ]
+            rendered = len(image_paths) - len(missing)
+            for future in as_completed(futures):
+                if cancel_event.is_set():
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise LoadCancelled()
+                rendered += future.result()
+                report(rendered, len(image_paths))
+        print(f"--{len(missing)} pages rendered by {workers} worker processes--")
+
+    def _start_render_queue(self) -> None:
         """
-        Converts each page of the loaded PDF into a PNG image and saves them to ~/storage/ui for rendering.
+        Sets up on-demand rendering for the loaded PDF. Nothing is rendered until the UI requests pages,
+        so the time to the first visible page doesn't depend on the length of the document.
+        Pages that are already in the page cache are never rendered again.
         """
-        assert os.path.exists("storage/ui"), "UI storage folder does not exist. Please create it first."
-        for i, page in enumerate(self.pdf):
-            page_png = page.get_pixmap(dpi=150)
-            page_png.save(f"storage/ui/{file_name[:9]}_{i:04d}.png")
-        print("--UI images created!--")
+        assert os.path.exists(self.page_cache.root), "UI storage folder does not exist. Please create it first."
+        self.page_cache.evict(keep_doc_hash=self._doc_hash)
+        image_paths = [self._page_image_path(i) for i in range(self.pdf.page_count)]
+        self._render_queue = PageRenderQueue(
+            file_path=self.pdf.name,
+            image_paths=image_paths,
+            dpi=RENDER_DPI,
+            workers=self.render_workers,
+            on_rendered=self._on_page_rendered
+        )
+        print("--Lazy page rendering started--")
+
+    def _on_page_rendered(self, page_index: int, image_path: str) -> None:
+        """
+        Forwards a finished page to the UI callback registered under 'page_rendered', if any.
+        """
+        callback = self.ui_callbacks.get('page_rendered')
+        if callback is not None:
+            callback(page_index, os.path.abspath(image_path))
+
+    def render_page(self, page_index: int, priority: int = 0, wait: bool = False) -> str:
+        """
+        Queues a page (0-based) for rendering and returns the absolute path its image will have.
+        With wait=True, blocks until the image exists, and raises the rendering error if the page can't be rendered.
+        In eager mode every page is already rendered.
+        """
+        assert self.pdf is not None, "No PDF loaded. Please load a PDF file first."
+        assert 0 <= page_index < self.pdf.page_count, f"Page index {page_index} is out of range."
+        if self._render_queue is not None:
+            if wait:
+                self._render_queue.render(page_index)
+            else:
+                self._render_queue.request([page_index], priority=priority)
+        return os.path.abspath(self._page_image_path(page_index))
+
+    def request_viewport(self, first_visible: int, last_visible: int, lookahead: int = RENDER_LOOKAHEAD) -> None:
+        """
+        Re-prioritizes lazy rendering around the viewport: visible pages (0-based, inclusive) first, nearby pages next.
+        """
+        if self._render_queue is not None:
+            self._render_queue.prioritize(first_visible, last_visible, lookahead)
+
+    def get_page_sizes(self, dpi: int = RENDER_DPI) -> List[Tuple[float, float]]:
+        """
+        Returns the (width, height) in pixels that each page renders to at the given dpi, computed from page
+        geometry without rendering anything. The UI uses it to size placeholders so scroll geometry stays correct.
+        """
+        assert self.pdf is not None, "No PDF loaded. Please load a PDF file first."
+        scale = dpi / 72  # PDF user space is 72 points per inch
+        return [(page.rect.width * scale, page.rect.height * scale) for page in self.pdf]
+
+    def _page_image_path(self, page_index: int) -> str:
+        """
+        Returns the path of the image for the given page index of the loaded PDF inside the page cache (~/storage/ui).
+        """
+        return self.page_cache.page_path(self._doc_hash, page_index, RENDER_DPI)
 
     def _get_image_paths(self) -> List[str]:
         """
         Returns a list of image paths, each of which represents a page from the loaded PDF file. The images live in ~/storage/ui/.
+        In lazy mode the images may not exist yet, but their paths are known up front.
         """
-        assert os.path.exists("storage/ui"), "UI storage folder does not exist. Please create it first."
-        assert os.listdir("storage/ui"), "UI storage folder is empty. Please load a PDF file first."
-        paths = sorted([os.path.abspath(os.path.join("storage/ui", fname)) for fname in os.listdir("storage/ui")])
+        assert self.pdf is not None, "No PDF loaded. Please load a PDF file first."
+        paths = [os.path.abspath(self._page_image_path(i)) for i in range(self.pdf.page_count)]
+        assert self._render_queue is not None or all(os.path.exists(path) for path in paths), "Some pages have not been rendered. Please load a PDF file first."
         return paths
 
     def _create_default_agent(self, ui_callbacks=None):
@@ -75,16 +460,6 @@ class PDFService:
         from src.backend.agent import PDFAgent
         return PDFAgent(llm_backend="docker", ui_callbacks=ui_callbacks)
 
-    @staticmethod
-    def _clear_ui_folder() -> None:
-        """
-        Deletes all images (pdf pages) from the UI folder and makes sure we get an empty folder.
-        """
-        if os.path.exists(os.getenv('UI_PATH')):
-            shutil.rmtree(os.getenv('UI_PATH'))
-        os.makedirs(os.getenv('UI_PATH'), exist_ok=True)
-        print(f"--UI folder cleared--")
-
     @staticmethod
     def _clear_data_folder() -> None:
         """
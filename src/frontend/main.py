@@ -1,4 +1,4 @@
-import sys, os, time, threading
+import sys, os, time, bisect
 
 # Add the project root to the Python path
 project_root = os.path.join(os.path.dirname(__file__), '..', '..')
@@ -6,7 +6,7 @@ sys.path.insert(0, project_root)
 
 import flet as ft
 from dotenv import load_dotenv
-from src.backend.service import PDFService
+from src.backend.service import PDFService, LoadProgress
 from styles import ChatStyles, TextStyles, InterfaceStyles, Dimensions
 
 def main(page: ft.Page):
@@ -28,10 +28,25 @@ def main(page: ft.Page):
         print(f"🔧 GOTO PAGE TOOL FINISHED")
         return f"Successfully navigated to page {page_number}"
 
+    def on_page_rendered(page_index: int, image_path: str) -> None:
+        """
+        Callback: swaps a page placeholder for its image once the backend has rendered it (lazy rendering).
+        """
+        if page_index >= len(page_slots) or page_slots[page_index].data != image_path:
+            return # page belongs to a file that has been replaced in the meantime
+        slot = page_slots[page_index]
+        slot.content = ft.Image(src=image_path, width=slot.content.width, height=slot.content.height, fit=ft.ImageFit.CONTAIN)
+        slot.update()
+
     ui_callbacks = {
-        'goto_page' : go_to_page
+        'goto_page' : go_to_page,
+        'page_rendered' : on_page_rendered
     }
 
+    # lazy rendering state: page containers and the scroll offset where each of them starts
+    page_slots = []
+    page_offsets = []
+
     # Initialize backend service, that also initializes the agent (using docker model runner by default)
     service = PDFService(ui_callbacks=ui_callbacks)
 
@@ -190,70 +205,150 @@ def main(page: ft.Page):
             sidebar.width = 0 # collapse
         sidebar.update()
 
+    def describe_progress(progress: LoadProgress) -> str:
+        """
+        Turns a load progress event into a short status text, e.g. 'Indexing pages: 40/600 (~12s left)'.
+        """
+        text = f"{progress.stage.capitalize()} pages: {progress.done}/{progress.total}"
+        if progress.eta is not None and progress.done < progress.total:
+            text += f" (~{round(progress.eta)}s left)"
+        return text
+
     def on_dialog_result(e: ft.FilePickerResultEvent) -> None:
         """
-        Kicks off the PDF loading process when a file is selected.
-        Renders pages as images in the UI.
+        Kicks off the PDF loading process when a file is selected. Loading runs in the background and drives the
+        progress ring with real counts; picking another file cancels the load that is still running.
+        Renders pages as images in the UI once the file is ready.
         """
         if e.files != None:
             # clear old pdf from UI
             file_column.controls.clear()
             # add loading indicator
             progress_ring = loading_file()
+            file_name = e.files[0].name
+            pages_shown = [False] # flag: after the pages are shown, progress goes to the status text instead
 
-            stop_animation = [False] # flag to stop animation early if pdf loading overtook it
-
-            def animate_progress():
-                progress = 0
-                while not stop_animation[0] and progress < 0.95:
-                    progress += 0.005
-                    progress_ring.value = progress
-                    file_column.update()
-                    time.sleep(0.1)
-                # Hold at 95% to wait for pdf to finish loading
-                pulse_values = [0.93, 0.95, 0.97, 0.95]
-                pulse_index = 0
-                while not stop_animation[0]:
-                    progress_ring.badge.text = "It's a large file, hang tight..."
-                    progress_ring.value = pulse_values[pulse_index]
+            def on_progress(progress: LoadProgress) -> None:
+                if not pages_shown[0]:
+                    progress_ring.value = progress.fraction
+                    progress_ring.badge.text = describe_progress(progress)
                     file_column.update()
-                    pulse_index = (pulse_index + 1) % len(pulse_values) # this cycles through values 0-1-2-3-0-...
-                    time.sleep(0.3)
-
-            # start animation in a new thread
-            threading.Thread(target=animate_progress, daemon=True).start()
-
-            # load new pdf (returns a list of image paths to use in the UI)
-            image_paths = service.load_pdf(e.files[0].path)
-
-            # complete animation
-            stop_animation[0] = True
-            progress_ring.value = 1.0
+                else: # the rest of the document is indexed in the background
+                    indexing_status.value = describe_progress(progress) if progress.done < progress.total else ""
+                    indexing_status.update()
+
+            def on_done(image_paths: list) -> None:
+                pages_shown[0] = True
+                show_pages(image_paths)
+                refresh_documents()
+                print(f"--{len(file_column.controls)} pages from {file_name} rendered!--")
+
+            def on_error(error: Exception) -> None:
+                file_column.controls.clear()
+                file_column.controls.append(ft.Text(f"Failed to load {file_name}: {error}", **TextStyles.loading_text()))
+                file_column.update()
+
+            indexing_status.value = ""
+            indexing_status.update()
+            service.load_pdf_in_background(e.files[0].path, on_progress=on_progress, on_done=on_done, on_error=on_error)
+
+    def show_pages(image_paths: list) -> None:
+        """
+        Replaces the content of file_column with the pages of the displayed file.
+        """
+        file_column.controls.clear() # remove loading ring or the previous file
+        if service.lazy_rendering:
+            file_column.controls.extend(create_page_placeholders(image_paths))
             file_column.update()
-            time.sleep(0.1)
-
+            service.request_viewport(0, 1) # first pages, the rest follows the scroll position
+        else:
             image_pages = [ft.Image(src=path, fit=ft.ImageFit.CONTAIN) for path in image_paths]
             # key=page_idx+1 is the page number stored with every container as key
             image_containers = [ft.Container(content=image_page, padding=10, key=page_idx+1) for page_idx, image_page in enumerate(image_pages)]
-            file_column.controls.clear() # remove loading ring
             file_column.controls.extend(image_containers)
             file_column.update()
-            print(f"--{len(file_column.controls)} pages from {e.files[0].name} rendered!--")
+
+    def refresh_documents() -> None:
+        """
+        Corpus mode: lists the open files in the Documents menu and in the search scope dropdown.
+        """
+        if not service.corpus_mode:
+            return
+        documents = service.documents()
+        submenu_documents.controls = [
+            ft.MenuItemButton(content=ft.Text(file_name), close_on_click=True, on_click=lambda e, doc_hash=doc_hash: show_document(doc_hash))
+            for doc_hash, file_name in documents
+        ] + [ft.MenuItemButton(content=ft.Text("Close document"), close_on_click=True, on_click=close_document, disabled=not documents)]
+        scope_dropdown.options = [ft.dropdown.Option(key="all", text="All documents")] + [
+            ft.dropdown.Option(key=doc_hash, text=file_name) for doc_hash, file_name in documents
+        ]
+        if scope_dropdown.value not in {doc_hash for doc_hash, _ in documents}:
+            scope_dropdown.value = "all"
+        menubar.update()
+
+    def show_document(doc_hash: str) -> None:
+        show_pages(service.show_pdf(doc_hash))
+
+    def close_document(e) -> None:
+        """
+        Corpus mode: closes the displayed file and drops it from the search, the other files stay indexed.
+        """
+        image_paths = service.remove_pdf()
+        if image_paths is None:
+            file_column.controls.clear()
+            page_slots.clear()
+            page_offsets.clear()
+            file_column.update()
+        else:
+            show_pages(image_paths)
+        refresh_documents()
+
+    def on_scope_change(e) -> None:
+        service.set_search_scope(None if scope_dropdown.value == "all" else scope_dropdown.value)
+
+    def create_page_placeholders(image_paths: list) -> list:
+        """
+        Creates one container per page holding a placeholder with the page's final display size,
+        so scroll geometry is correct before any image has been rendered. Cached pages get their image right away.
+        """
+        page_slots.clear()
+        page_offsets.clear()
+        available_width = max(200, page.window.width - sidebar.width - 25) # minus sidebar handle and page padding
+        offset = 0
+        for page_idx, (width, height) in enumerate(service.get_page_sizes()):
+            scale = min(1.0, available_width / width)
+            if os.path.exists(image_paths[page_idx]): # already in the page cache
+                placeholder = ft.Image(src=image_paths[page_idx], width=width * scale, height=height * scale, fit=ft.ImageFit.CONTAIN)
+            else:
+                placeholder = ft.Container(width=width * scale, height=height * scale, bgcolor=ft.Colors.GREY_200)
+            # key=page_idx+1 is the page number stored with every container as key
+            page_slots.append(ft.Container(content=placeholder, padding=10, key=page_idx+1, data=image_paths[page_idx]))
+            page_offsets.append(offset)
+            offset += height * scale + 20 # padding on both sides
+        return page_slots
 
     def on_scroll(e: ft.OnScrollEvent) -> None:
         """
         Updates current page indicator based on scroll position.
+        In lazy mode also asks the backend to render the visible pages first and the pages near them next.
         """
         if not file_column.controls or len(file_column.controls) == 0:
             return
             
         total_pages = len(file_column.controls)
-        
-        # Use the built-in scroll event properties
-        scroll_percentage = e.pixels / e.max_scroll_extent if e.max_scroll_extent > 0 else 0
 
-        # Calculate current page based on scroll percentage
-        current_page = min(max(1, int(scroll_percentage * total_pages) + 1), total_pages)
+        if page_offsets and len(page_offsets) == total_pages:
+            # page geometry is known up front, so visible pages can be computed exactly
+            first_visible = max(0, bisect.bisect_right(page_offsets, e.pixels) - 1)
+            last_visible = max(first_visible, bisect.bisect_right(page_offsets, e.pixels + e.viewport_dimension) - 1)
+            service.request_viewport(first_visible, last_visible)
+            current_page = first_visible + 1
+        else:
+            # Use the built-in scroll event properties
+            scroll_percentage = e.pixels / e.max_scroll_extent if e.max_scroll_extent > 0 else 0
+
+            # Calculate current page based on scroll percentage
+            current_page = min(max(1, int(scroll_percentage * total_pages) + 1), total_pages)
         
         # Update the indicator
         page_number_control.content.content.value = f"Page: {current_page}"
@@ -348,18 +443,27 @@ def main(page: ft.Page):
     submenu_file = ft.SubmenuButton(content=ft.Text(value="File", text_align=ft.TextAlign.CENTER), controls=submenu_file_controls)
     submenu_chat = ft.SubmenuButton(content=ft.Text(value="Chat", text_align=ft.TextAlign.CENTER), controls=submenu_chat_controls)
 
-    menu_controls = [submenu_file, submenu_chat]
+    # corpus mode: switch between open files, close one, and pick which of them the agent searches
+    submenu_documents = ft.SubmenuButton(content=ft.Text(value="Documents", text_align=ft.TextAlign.CENTER), controls=[])
+    scope_dropdown = ft.Dropdown(label="Search", value="all", width=220, dense=True, on_change=on_scope_change,
+                                 options=[ft.dropdown.Option(key="all", text="All documents")], visible=service.corpus_mode)
+
+    menu_controls = [submenu_file, submenu_documents, submenu_chat] if service.corpus_mode else [submenu_file, submenu_chat]
     menu = ft.MenuBar(menu_controls, expand=True)
-    menubar = ft.Row([menu])
+    indexing_status = ft.Text("", **TextStyles.loading_text())
+    menubar = ft.Row([menu, scope_dropdown, indexing_status])
 
     app_content = ft.Row([file_column, sidebar_handle, sidebar], spacing=0, expand=True)
 
     ui = ft.Column(controls=[menubar, app_content], spacing=0, expand=True)
 
     page.on_resized = on_window_resize
+    page.on_close = lambda e: service.close()  # release pooled connections and worker processes
 
     # render everything
     page.add(ui)
 
-ft.app(main)
+# guard is required so that worker processes spawned by the backend don't start another app
+if __name__ == "__main__":
+    ft.app(main)
 
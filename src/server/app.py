@@ -0,0 +1,263 @@
+"""
+Headless HTTP server: many users chat with their PDFs at once, each in a session of their own, on one shared
+embedding model, chat model and set of document indexes. Questions are answered as Server-Sent Events.
+
+    python -m src.server.app                 # serves on SERVER_HOST:SERVER_PORT
+
+    POST   /sessions                                      -> {"session_id"}
+    DELETE /sessions/{id}
+    POST   /sessions/{id}/documents?file_name=a.pdf       body: the PDF -> {"doc_id", "file_name", "pages", "indexed_pages"}
+    GET    /sessions/{id}/documents
+    DELETE /sessions/{id}/documents/{doc_id}
+    POST   /sessions/{id}/ask       {"question"}          -> text/event-stream: token, tool_call, tool_result, navigate, done, error
+    POST   /sessions/{id}/navigate  {"page", "doc_id"?}   -> {"doc_id", "page", "image_url"}
+    GET    /sessions/{id}/documents/{doc_id}/pages/{page} -> PNG
+    GET    /health
+"""
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager, suppress
+from concurrent.futures import ProcessPoolExecutor, Future
+from pydantic import BaseModel
+from typing import Any, AsyncGenerator, Dict, Optional
+from dotenv import load_dotenv
+from src.backend.agent import AgentResources, GOTO_PAGE_TOOL_NAME
+from src.backend.cache import PageImageCache
+from src.backend.renderer import render_page_range
+from src.backend.service import RENDER_DPI, RENDER_WORKERS, PAGE_CACHE_MAX_MB
+from src.server.sessions import AdmissionError, AskAdmission, ChatSession, SessionManager
+import asyncio, json, multiprocessing, os, threading, time
+
+load_dotenv(verbose=True)
+
+# Server configuration: admission control caps the open sessions and the questions answered (SERVER_MAX_RUNNING_ASKS)
+# and waiting (SERVER_MAX_QUEUED_ASKS) at once; the chat model's own limit is LLM_MAX_CONCURRENCY
+SERVER_HOST = os.getenv('SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8000'))
+SERVER_MAX_SESSIONS = int(os.getenv('SERVER_MAX_SESSIONS', '32'))
+SERVER_SESSION_TTL_S = float(os.getenv('SERVER_SESSION_TTL_S', '1800'))
+SERVER_MAX_RUNNING_ASKS = int(os.getenv('SERVER_MAX_RUNNING_ASKS', '8'))
+SERVER_MAX_QUEUED_ASKS = int(os.getenv('SERVER_MAX_QUEUED_ASKS', '32'))
+SERVER_MAX_UPLOAD_MB = int(os.getenv('SERVER_MAX_UPLOAD_MB', '100'))
+SERVER_UPLOAD_PATH = os.getenv('SERVER_UPLOAD_PATH', 'storage/uploads')
+
+BUSY = "The session is busy answering a question or loading a document."
+
+class AskRequest(BaseModel):
+    question: str
+
+class NavigateRequest(BaseModel):
+    page: int
+    doc_id: Optional[str] = None
+
+def sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class PageRenderer:
+    """
+    Renders requested pages into the shared page image cache in worker processes (MuPDF is not thread-safe).
+    A page requested by several sessions at once is rendered once.
+    """
+    def __init__(self, workers: int):
+        self.page_cache = PageImageCache(root=os.getenv('UI_PATH', 'storage/ui'), max_bytes=PAGE_CACHE_MAX_MB * 2**20)
+        self._executor = ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context("spawn"))
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    async def render(self, file_path: str, doc_id: str, page_index: int) -> str:
+        image_path = self.page_cache.page_path(doc_id, page_index, RENDER_DPI)
+        if os.path.exists(image_path):
+            self.page_cache.touch([image_path])
+            return image_path
+        with self._lock:
+            future = self._in_flight.get(image_path)
+            if future is None:
+                future = self._executor.submit(render_page_range, file_path, page_index, [image_path], RENDER_DPI)
+                self._in_flight[image_path] = future
+                future.add_done_callback(lambda _: self._forget(image_path))
+        await asyncio.wrap_future(future)
+        return image_path
+
+    def _forget(self, image_path: str) -> None:
+        with self._lock:
+            self._in_flight.pop(image_path, None)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def create_app(resources: Optional[AgentResources] = None) -> FastAPI:
+    """
+    Builds the server app. Without resources, the models are loaded on startup and released on shutdown.
+    """
+    state: Dict[str, Any] = {}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        shared = resources or AgentResources()
+        state["sessions"] = SessionManager(shared, max_sessions=SERVER_MAX_SESSIONS, session_ttl=SERVER_SESSION_TTL_S, upload_path=SERVER_UPLOAD_PATH)
+        state["admission"] = AskAdmission(max_running=SERVER_MAX_RUNNING_ASKS, max_queued=SERVER_MAX_QUEUED_ASKS)
+        state["renderer"] = PageRenderer(workers=min(RENDER_WORKERS, 2))
+        yield
+        state["sessions"].close_all()
+        state["renderer"].close()
+        if resources is None:
+            shared.close()
+
+    app = FastAPI(title="Chat With PDF", lifespan=lifespan)
+
+    @app.exception_handler(AssertionError)
+    async def invalid_request(request: Request, e: AssertionError) -> JSONResponse:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+
+    @app.exception_handler(AdmissionError)
+    async def over_capacity(request: Request, e: AdmissionError) -> JSONResponse:
+        return JSONResponse(status_code=429, content={"detail": str(e)}, headers={"Retry-After": "5"})
+
+    def get_session(session_id: str) -> ChatSession:
+        try:
+            return state["sessions"].get(session_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Session {session_id} does not exist or has expired.")
+
+    def describe(session: ChatSession) -> list:
+        return [{"doc_id": document.doc_id, "file_name": document.file_name, "pages": document.total_pages,
+                 "indexed_pages": document.indexed_pages} for document in session.agent.documents()]
+
+    @app.get("/health")
+    def health() -> Dict[str, Any]:
+        return {"status": "ok", **state["sessions"].stats(), "asks": state["admission"].stats(),
+                "llm_calls": state["sessions"].resources.chat_model.call_stats(), "indexes": state["sessions"].resources.documents.stats()}
+
+    @app.post("/sessions", status_code=201)
+    def create_session() -> Dict[str, str]:
+        return {"session_id": state["sessions"].create().id}
+
+    @app.delete("/sessions/{session_id}", status_code=204)
+    def close_session(session_id: str) -> Response:
+        session = get_session(session_id)
+        if session.busy:
+            raise HTTPException(status_code=409, detail=BUSY)
+        state["sessions"].close(session_id)
+        return Response(status_code=204)
+
+    @app.post("/sessions/{session_id}/documents", status_code=201)
+    async def load_document(session_id: str, request: Request, file_name: str = "document.pdf") -> Dict[str, Any]:
+        """
+        Adds the PDF in the request body to the session's corpus. Returns once its first pages are searchable
+        (right away if another session has it open), the rest is indexed in the background.
+        """
+        session = get_session(session_id)
+        if int(request.headers.get("content-length") or 0) > SERVER_MAX_UPLOAD_MB * 2**20:
+            raise HTTPException(status_code=413, detail=f"Files are limited to {SERVER_MAX_UPLOAD_MB}MB.")
+        data = await request.body()
+        assert data.startswith(b"%PDF"), "The request body is not a PDF file."
+        if session.busy:
+            raise HTTPException(status_code=409, detail=BUSY)
+
+        def add_document() -> str:
+            import pymupdf as pd
+            path = state["sessions"].store_upload(data, file_name)
+            with pd.open(path) as document:
+                return session.agent.add_document(path, document=document)  # indexing keeps a handle of its own
+
+        session.busy = True
+        try:
+            doc_id = await asyncio.to_thread(add_document)
+        finally:
+            session.busy = False
+        session.doc_id, session.page = doc_id, 1
+        return next(document for document in describe(session) if document["doc_id"] == doc_id)
+
+    @app.get("/sessions/{session_id}/documents")
+    def list_documents(session_id: str) -> list:
+        return describe(get_session(session_id))
+
+    @app.delete("/sessions/{session_id}/documents/{doc_id}", status_code=204)
+    def remove_document(session_id: str, doc_id: str) -> Response:
+        session = get_session(session_id)
+        if session.busy:
+            raise HTTPException(status_code=409, detail=BUSY)
+        session.agent.remove_document(doc_id)
+        if session.doc_id == doc_id:
+            documents = session.agent.documents()
+            session.doc_id, session.page = (documents[-1].doc_id, 1) if documents else (None, None)
+        return Response(status_code=204)
+
+    @app.post("/sessions/{session_id}/ask")
+    async def ask(session_id: str, body: AskRequest) -> StreamingResponse:
+        """
+        Answers a question as Server-Sent Events: token (answer deltas), tool_call, tool_result, navigate (the document
+        and page the agent moved to), then done with the whole answer, or error.
+        """
+        session = get_session(session_id)
+        assert body.question.strip(), "The question is empty."
+        assert session.agent.documents(), "Load a PDF file first."
+        if session.busy:
+            raise HTTPException(status_code=409, detail=BUSY)
+        if state["admission"].full():
+            raise AdmissionError(f"The server is answering {state['admission'].running} questions and has {state['admission'].queued} queued.")
+        return StreamingResponse(stream_answer(session, body.question.strip()), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def stream_answer(session: ChatSession, question: str) -> AsyncGenerator[str, None]:
+        if session.busy:  # a second request of the session got past the check in ask
+            yield sse("error", {"detail": BUSY})
+            return
+        session.busy = True
+        session.pop_navigation()  # left over from a run the client went away from
+        handler = None
+        try:
+            async with state["admission"]:
+                start = time.time()
+                handler = session.agent.ask_agent(question)
+                async for event in handler.stream_events():
+                    name = type(event).__name__
+                    if name == "AgentStream" and event.delta:
+                        yield sse("token", {"delta": event.delta})
+                    elif name == "ToolCall":
+                        yield sse("tool_call", {"tool": event.tool_name, "input": event.tool_kwargs})
+                    elif name == "ToolCallResult":
+                        yield sse("tool_result", {"tool": event.tool_name, "output": str(event.tool_output)})
+                        navigation = session.pop_navigation() if event.tool_name == GOTO_PAGE_TOOL_NAME else None
+                        if navigation is not None:
+                            yield sse("navigate", navigation)
+                result = await handler
+                yield sse("done", {"answer": str(result.response.content or ""), "elapsed": round(time.time() - start, 2)})
+        except AdmissionError as e:
+            yield sse("error", {"detail": str(e)})
+        except Exception as e:
+            print(f"--Session {session.id[:8]}: answer failed: {e}--")
+            yield sse("error", {"detail": str(e)})
+        finally:
+            try:
+                if handler is not None and not handler.done():
+                    await handler.cancel_run()  # the client went away: stop the run and let it wind down
+                    with suppress(Exception):
+                        await handler
+            finally:
+                session.busy = False
+                session.touch()
+
+    @app.post("/sessions/{session_id}/navigate")
+    def navigate(session_id: str, body: NavigateRequest) -> Dict[str, Any]:
+        session = get_session(session_id)
+        session.navigate(body.page, body.doc_id)
+        return {"doc_id": session.doc_id, "page": session.page,
+                "image_url": f"/sessions/{session_id}/documents/{session.doc_id}/pages/{session.page}"}
+
+    @app.get("/sessions/{session_id}/documents/{doc_id}/pages/{page_number}")
+    async def page_image(session_id: str, doc_id: str, page_number: int) -> FileResponse:
+        session = get_session(session_id)
+        documents = {document.doc_id: document for document in session.agent.documents()}
+        assert doc_id in documents, f"Document {doc_id} is not open in this session."
+        document = documents[doc_id]
+        assert 1 <= page_number <= document.total_pages, f"Page {page_number} is out of range (1-{document.total_pages})."
+        image_path = await state["renderer"].render(document.file_path, doc_id, page_number - 1)
+        return FileResponse(image_path, media_type="image/png")
+
+    return app
+
+if __name__ == "__main__":
+    import uvicorn
+    # one process: sessions share the models and indexes held in memory
+    uvicorn.run(create_app(), host=SERVER_HOST, port=SERVER_PORT, workers=1)
@@ -0,0 +1,175 @@
+from src.backend.agent import PDFAgent, AgentResources
+from src.backend.cache import file_sha256
+from typing import Any, Dict, Optional
+import asyncio, os, threading, time, uuid
+
+class AdmissionError(Exception):
+    """Raised when the server is at capacity: too many sessions, or too many questions running and queued."""
+
+class ChatSession:
+    """
+    One user's conversation: a PDFAgent of its own (corpus, chat history, search scope, answer cache) on the
+    resources every session shares, so documents another session opened are searched without embedding them again.
+    The agent's goto_page tool moves the session's current page, which the client follows.
+    """
+    def __init__(self, session_id: str, resources: AgentResources):
+        self.id = session_id
+        self.agent = PDFAgent(ui_callbacks={"goto_page": self.goto_page}, resources=resources, save_conversations=False)
+        self.doc_id: Optional[str] = None  # document shown to the user, the one goto_page navigates
+        self.page: Optional[int] = None  # page number shown to the user (1-based)
+        self._navigation: Optional[Dict[str, Any]] = None  # set by goto_page, see pop_navigation
+        self.busy = False  # one question or document load at a time: the agent's context and corpus are not concurrent
+        self.last_used = time.time()
+
+    def goto_page(self, page_number: int, file_name: Optional[str] = None) -> str:
+        """
+        Tool: moves the session to page_number of the document named file_name (as in the sources of an answer),
+        or of the document shown if not given. Streamed to the client as a navigate event, see pop_navigation.
+        """
+        assert isinstance(page_number, int), f"page_number must be an integer. Instead got {type(page_number)}"
+        documents = self.agent.documents()
+        if file_name:
+            matches = [document for document in documents if document.file_name == file_name]
+            if not matches:
+                return f"No open document is named {file_name}. Open documents: {', '.join(document.file_name for document in documents)}"
+            document = matches[0]
+        else:
+            document = next((document for document in documents if document.doc_id == self.doc_id), documents[0] if documents else None)
+            if document is None:
+                return "No document is open."
+        if document.total_pages and not 1 <= page_number <= document.total_pages:
+            return f"Page {page_number} is out of range: {document.file_name} has {document.total_pages} pages."
+        self.doc_id, self.page = document.doc_id, page_number
+        self._navigation = {"doc_id": document.doc_id, "file_name": document.file_name, "page": page_number}
+        return f"Successfully navigated to page {page_number} of {document.file_name}"
+
+    def pop_navigation(self) -> Optional[Dict[str, Any]]:
+        """
+        The page the agent navigated to since the last call ({"doc_id", "file_name", "page"}), or None.
+        """
+        navigation, self._navigation = self._navigation, None
+        return navigation
+
+    def navigate(self, page_number: int, doc_id: Optional[str] = None) -> None:
+        """
+        Shows another page (and document, if given) to the user.
+        """
+        doc_id = doc_id or self.doc_id
+        documents = {document.doc_id: document for document in self.agent.documents()}
+        assert doc_id in documents, f"Document {doc_id} is not open in this session."
+        total_pages = documents[doc_id].total_pages
+        assert 1 <= page_number <= total_pages, f"Page {page_number} is out of range (1-{total_pages})."
+        self.doc_id, self.page = doc_id, page_number
+
+    def touch(self) -> None:
+        self.last_used = time.time()
+
+    def close(self) -> None:
+        self.agent.close()
+
+class SessionManager:
+    """
+    The sessions of the server, created up to max_sessions at a time. Sessions idle for longer than session_ttl
+    (and not answering) are closed to make room, when a session is created and on sweep().
+    Uploaded files are stored once per content hash under upload_path, shared by every session that opens them.
+    """
+    def __init__(self, resources: AgentResources, max_sessions: int, session_ttl: float, upload_path: str):
+        self.resources = resources
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.upload_path = upload_path
+        self._sessions: Dict[str, ChatSession] = {}
+        self._lock = threading.Lock()
+        os.makedirs(upload_path, exist_ok=True)
+
+    def create(self) -> ChatSession:
+        self.sweep()
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                raise AdmissionError(f"The server is at its limit of {self.max_sessions} sessions.")
+            session = ChatSession(uuid.uuid4().hex, self.resources)
+            self._sessions[session.id] = session
+        print(f"--Session {session.id[:8]} created ({len(self._sessions)} open)--")
+        return session
+
+    def get(self, session_id: str) -> ChatSession:
+        """
+        Raises KeyError for unknown (or expired) sessions.
+        """
+        with self._lock:
+            session = self._sessions[session_id]
+        session.touch()
+        return session
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(session_id)
+        session.close()
+        print(f"--Session {session_id[:8]} closed ({len(self._sessions)} open)--")
+
+    def close_all(self) -> None:
+        for session_id in list(self._sessions):
+            self.close(session_id)
+
+    def sweep(self) -> None:
+        """
+        Closes the sessions that have been idle for longer than session_ttl.
+        """
+        now = time.time()
+        with self._lock:
+            expired = [session.id for session in self._sessions.values() if not session.busy and now - session.last_used > self.session_ttl]
+        for session_id in expired:
+            self.close(session_id)
+
+    def store_upload(self, data: bytes, file_name: str) -> str:
+        """
+        Saves an uploaded file under its content hash, keeping its name (answers cite it). Returns the path.
+        """
+        file_name = os.path.basename(file_name) or "document.pdf"
+        partial_path = os.path.join(self.upload_path, f"{uuid.uuid4().hex}.part")
+        with open(partial_path, "wb") as f:
+            f.write(data)
+        directory = os.path.join(self.upload_path, file_sha256(partial_path)[:32])
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, file_name)
+        os.replace(partial_path, path)
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_sessions": self.max_sessions,
+                    "busy": sum(session.busy for session in self._sessions.values())}
+
+class AskAdmission:
+    """
+    Admission control of questions: at most max_running agent runs at once, up to max_queued more waiting for a
+    turn, and beyond that questions are turned away with AdmissionError instead of piling up. Lives on the server's
+    event loop.
+    """
+    def __init__(self, max_running: int, max_queued: int):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self._slots = asyncio.Semaphore(max_running)
+        self.running = 0
+        self.queued = 0
+
+    def full(self) -> bool:
+        return self.running >= self.max_running and self.queued >= self.max_queued
+
+    async def __aenter__(self) -> "AskAdmission":
+        if self.full():
+            raise AdmissionError(f"The server is answering {self.running} questions and has {self.queued} queued.")
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.running -= 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"running": self.running, "queued": self.queued, "max_running": self.max_running, "max_queued": self.max_queued}
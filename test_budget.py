@@ -0,0 +1,53 @@
+"""
+Tests of the prompt token budget: retrieved chunks are packed into the RAG budget in rank order, the chat history
+gets what the rest of the prompt leaves, and counts follow the ratio calibrated against the model's own counts.
+"""
+
+import sys
+from typing import List
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+from llama_index.core.schema import NodeWithScore, TextNode
+from src.backend.budget import MIN_HISTORY_TOKENS, REASONING_RESERVE_TOKENS, TokenBudget
+
+def words(text: str) -> List[str]:
+    return text.split()
+
+def chunks(*sizes: int) -> List[NodeWithScore]:
+    """Chunks of the given sizes in words, best ranked first."""
+    return [NodeWithScore(node=TextNode(id_=f"chunk-{rank}", text=" ".join(["word"] * size)), score=1.0 / rank)
+            for rank, size in enumerate(sizes, start=1)]
+
+def ids(nodes: List[NodeWithScore]) -> List[str]:
+    return [node.node.node_id for node in nodes]
+
+def test_pack_chunks_respects_the_budget_in_rank_order():
+    budget = TokenBudget(context_window=4096, max_output_tokens=512, rag_tokens=10, tokenizer=words)
+    # 6 fits; 5 would exceed 10; 3 fits (9); 4 would exceed; 1 fits (10)
+    assert ids(budget.pack_chunks(chunks(6, 5, 3, 4, 1))) == ["chunk-1", "chunk-3", "chunk-5"]
+    assert ids(budget.pack_chunks(chunks(2, 3))) == ["chunk-1", "chunk-2"], "Chunks within the budget are all kept"
+    assert budget.pack_chunks([]) == []
+
+def test_pack_chunks_always_keeps_the_best_chunk():
+    budget = TokenBudget(context_window=4096, max_output_tokens=512, rag_tokens=10, tokenizer=words)
+    assert ids(budget.pack_chunks(chunks(25, 4, 2))) == ["chunk-1"]
+
+def test_pack_chunks_counts_calibrated_tokens():
+    budget = TokenBudget(context_window=4096, max_output_tokens=512, rag_tokens=10, tokenizer=words)
+    budget.calibrate(local_tokens=100, model_tokens=600)  # the model counts 6 times as many: the ratio moves to 2
+    assert budget.ratio == 2.0
+    assert budget.count("word " * 3) == 6
+    assert ids(budget.pack_chunks(chunks(3, 3, 1))) == ["chunk-1", "chunk-3"], "6 + 6 calibrated tokens exceed the budget, 6 + 2 fit"
+
+def test_history_limit():
+    budget = TokenBudget(context_window=4096, max_output_tokens=512, rag_tokens=1000, tokenizer=words)
+    assert budget.history_limit(fixed_tokens=800) == 3584 - 800 - 1000 - REASONING_RESERVE_TOKENS
+    assert budget.history_limit(fixed_tokens=3000) == MIN_HISTORY_TOKENS, "A too large fixed prompt leaves the minimum"
+    fixed = TokenBudget(context_window=4096, max_output_tokens=512, rag_tokens=1000, history_tokens=600, tokenizer=words)
+    assert fixed.history_limit(fixed_tokens=800) == 600, "An explicit history budget is used as it is"
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,188 @@
+"""
+Tests of the RAG answer cache: exact and near-duplicate hits, LRU eviction and expiry, and invalidation, so an answer
+computed before a document was added to the corpus is never served afterwards. Index cache eviction, which leaves the
+indexes being written alone.
+"""
+
+import sys
+import math
+import threading
+from dotenv import load_dotenv
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+load_dotenv(verbose=True)
+
+import src.backend.cache as cache
+from src.backend.cache import QueryCache
+
+def rotated(cosine: float) -> list:
+    """A unit vector at the given cosine similarity to [1, 0]."""
+    return [cosine, math.sqrt(1 - cosine ** 2)]
+
+def test_exact_hit_ignores_case_punctuation_and_spacing():
+    query_cache = QueryCache()
+    query_cache.put("What does error E012 mean?", "A clogged filter.")
+    assert query_cache.get_exact("  what does  error e012 mean ") == "A clogged filter."
+    assert query_cache.get_exact("What does error E013 mean?") is None
+    assert query_cache.stats() == {"entries": 1, "hits": 1, "near_hits": 0, "misses": 0}, "get_exact doesn't count misses"
+    assert query_cache.get("What does error E013 mean?") is None
+    assert query_cache.stats()["misses"] == 1
+
+def test_near_duplicate_hits_from_the_similarity_threshold():
+    query_cache = QueryCache(similarity_threshold=0.95)
+    query_cache.put("How do I reset the device?", "Hold the power button.", embedding=[2.0, 0.0])  # compared at unit length
+    assert query_cache.get("How can the device be reset?", rotated(0.951)) == "Hold the power button."
+    assert query_cache.get("How do I reset the router?", rotated(0.949)) is None
+    assert query_cache.get("How do I reset it?", [1.0, 0.0, 0.0]) is None, "Embeddings of another size never match"
+    assert query_cache.stats() == {"entries": 1, "hits": 1, "near_hits": 1, "misses": 2}
+
+def test_near_duplicate_returns_the_most_similar_answer():
+    query_cache = QueryCache(similarity_threshold=0.9)
+    query_cache.put("first", "far", embedding=rotated(0.92))
+    query_cache.put("second", "close", embedding=rotated(0.99))
+    assert query_cache.get("query", [1.0, 0.0]) == "close"
+
+def test_least_recently_used_answer_is_evicted():
+    query_cache = QueryCache(max_entries=2)
+    query_cache.put("a", "answer a")
+    query_cache.put("b", "answer b")
+    assert query_cache.get_exact("a") == "answer a"  # b is now the least recently used
+    query_cache.put("c", "answer c")
+    assert query_cache.get_exact("b") is None
+    assert query_cache.get_exact("a") == "answer a"
+    assert query_cache.get_exact("c") == "answer c"
+
+def test_answers_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    query_cache = QueryCache(ttl=60)
+    query_cache.put("a", "answer a")
+    now[0] += 59
+    assert query_cache.get_exact("a") == "answer a"
+    now[0] += 2
+    assert query_cache.get_exact("a") is None
+    assert query_cache.stats()["entries"] == 0
+
+def test_clear_invalidates_answers_and_answers_computed_before_it():
+    query_cache = QueryCache()
+    query_cache.put("a", "answer a", embedding=[1.0, 0.0])
+    generation = query_cache.generation  # an answer to "b" is being computed
+    query_cache.clear()  # meanwhile, a document is added to the corpus
+    query_cache.put("b", "answer b", generation=generation)
+    assert query_cache.get("a", [1.0, 0.0]) is None
+    assert query_cache.get_exact("b") is None, "An answer computed before the cache was cleared must not be stored"
+    query_cache.put("b", "answer b", generation=query_cache.generation)
+    assert query_cache.get_exact("b") == "answer b"
+
+def test_index_cache_eviction_skips_indexes_being_written(tmp_path):
+    import os
+    from src.backend.cache import IndexCache
+
+    index_cache = IndexCache(str(tmp_path), max_bytes=250)
+    for age, name in enumerate(["new", "old", "old.part"]):
+        os.makedirs(tmp_path / name)
+        (tmp_path / name / "vectors.npy").write_bytes(b"\0" * 200)
+        os.utime(tmp_path / name, (1000 - age, 1000 - age))
+    # the in-progress directory of store is the oldest entry, yet neither counts towards the budget nor gets deleted
+    assert index_cache.evict() == 200
+    assert sorted(os.listdir(tmp_path)) == ["new", "old.part"]
+    assert index_cache.evict() == 0
+
+def test_agent_drops_answers_when_a_document_is_indexed(tmp_path, monkeypatch):
+    import pymupdf as pd
+    import src.backend.agent as agent_module
+    from src.backend.agent import PDFAgent
+
+    monkeypatch.setattr(agent_module, "QUERY_CACHE_SIZE", 128)  # test_server turns the cache off for the whole process
+
+    def make_pdf(name: str, topics: list) -> "pd.Document":
+        document = pd.open()
+        for topic in topics:
+            document.new_page().insert_text((72, 72), topic)
+        document.save(str(tmp_path / name))
+        document.close()
+        return pd.open(str(tmp_path / name))
+
+    def wait_until_indexed(agent: PDFAgent) -> None:
+        for entry in agent.documents():
+            if entry.shared.indexing_thread is not None:
+                entry.shared.indexing_thread.join(30)
+            assert entry.fully_indexed
+
+    agent = PDFAgent(ui_callbacks={"goto_page": lambda page_number: f"Showing page {page_number}"}, save_conversations=False)
+    try:
+        agent.set_rag_mode("extractive")  # no chat model needed
+        agent.create_index(str(tmp_path / "cats.pdf"), document=make_pdf("cats.pdf", ["Cats like to sleep all day.", "Cats purr."]))
+        wait_until_indexed(agent)
+        first = agent._rag_query("Where do animals sleep?")
+        assert agent._rag_query("Where do animals sleep?") == first
+        assert agent.query_cache_stats()["hits"] == 1
+
+        # the answer computed while the next document was being added must not be cached either
+        started, release = threading.Event(), threading.Event()
+        retrieve = agent._retrieve
+
+        def slow_retrieve(query_bundle):
+            started.set()
+            release.wait(10)
+            return retrieve(query_bundle)
+
+        agent._retrieve = slow_retrieve
+        thread = threading.Thread(target=agent._rag_query, args=("Which animals purr?",))
+        thread.start()
+        started.wait(10)
+        agent.add_document(str(tmp_path / "dogs.pdf"), document=make_pdf("dogs.pdf", ["Dogs sleep in their baskets.", "Dogs bark."]))
+        release.set()
+        thread.join(10)
+        agent._retrieve = retrieve
+        wait_until_indexed(agent)
+        assert agent.query_cache_stats()["entries"] == 0
+
+        misses = agent.query_cache_stats()["misses"]
+        agent._rag_query("Where do animals sleep?")
+        stats = agent.query_cache_stats()
+        assert (stats["hits"], stats["misses"]) == (1, misses + 1), "Answers from before the document was indexed must not be served"
+    finally:
+        agent.close()
+
+def test_agent_searches_while_an_index_is_persisted(tmp_path):
+    import pymupdf as pd
+    from src.backend.agent import PDFAgent
+
+    document = pd.open()
+    for topic in ["Parrots repeat what they hear.", "Parrots live for decades."]:
+        document.new_page().insert_text((72, 72), topic)
+    document.save(str(tmp_path / "parrots.pdf"))
+    document.close()
+
+    agent = PDFAgent(ui_callbacks={"goto_page": lambda page_number: f"Showing page {page_number}"}, save_conversations=False)
+    index_cache = agent._index_cache
+    store = index_cache.store
+    lock_free_during_store = []
+
+    def store_and_check_lock(key, index):
+        # other sessions' retrieval takes the index lock: writing the index must not hold it
+        acquired = agent._index_lock.acquire(timeout=1)
+        if acquired:
+            agent._index_lock.release()
+        lock_free_during_store.append(acquired)
+        store(key, index)
+
+    index_cache.store = store_and_check_lock
+    try:
+        with pd.open(str(tmp_path / "parrots.pdf")) as document:
+            agent.create_index(str(tmp_path / "parrots.pdf"), document=document)
+            entry = agent.documents()[0]
+            entry.shared.indexing_thread.join(30)
+        assert entry.fully_indexed and entry.shared.error is None
+        assert lock_free_during_store == [True]
+        assert entry.index.vector_store.is_memory_mapped
+    finally:
+        index_cache.store = store
+        agent.close()
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,74 @@
+"""
+Tests of the generation slots of DockerLLM (max_concurrency), shared by sync calls from threads and async calls:
+an async call waiting for a slot leaves the event loop free, and a cancelled wait doesn't keep a slot.
+"""
+
+import sys
+import asyncio
+import threading
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+from llamaindex_utils.integrations import DockerLLM
+
+def test_async_call_waits_for_a_slot_without_blocking_the_loop():
+    llm = DockerLLM(model="test", max_concurrency=1)
+    release = threading.Event()
+
+    def hold_slot() -> None:
+        with llm._call_slot():
+            release.wait(10)
+
+    holder = threading.Thread(target=hold_slot)
+    holder.start()
+
+    async def main() -> int:
+        ticks = 0
+
+        async def wait_for_slot() -> None:
+            async with llm._acall_slot():
+                assert llm.call_stats() == {"running": 1, "waiting": 0, "max_concurrency": 1}
+
+        waiter = asyncio.ensure_future(wait_for_slot())
+        while not waiter.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+            if ticks == 20:
+                assert llm.call_stats()["waiting"] == 1
+                release.set()  # the sync call finishes and hands its slot over
+        await waiter
+        return ticks
+
+    assert asyncio.run(main()) >= 20, "The event loop must keep running while the call waits"
+    holder.join(10)
+    assert llm.call_stats() == {"running": 0, "waiting": 0, "max_concurrency": 1}
+
+def test_cancelled_wait_gives_its_slot_back():
+    llm = DockerLLM(model="test", max_concurrency=1)
+
+    async def main() -> None:
+        release = asyncio.Event()
+
+        async def hold_slot() -> None:
+            async with llm._acall_slot():
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold_slot())
+        await asyncio.sleep(0.05)
+        waiter = asyncio.ensure_future(hold_slot())
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        release.set()
+        await holder
+        await asyncio.sleep(0.1)  # the cancelled wait takes the freed slot in its thread, then releases it
+        async with llm._acall_slot():
+            pass
+
+    asyncio.run(asyncio.wait_for(main(), 10))
+    assert llm._call_slots.acquire(blocking=False), "No slot may be left taken"
+    assert llm.call_stats()["waiting"] == 0
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
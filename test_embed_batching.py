@@ -0,0 +1,69 @@
+"""
+Tests of batched llama.cpp embedding against a stub model: how texts are packed into decodes, truncated to n_ctx
+tokens, and only tokenized when they can be longer than that.
+"""
+
+import sys
+from typing import List
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+from llamaindex_utils.integrations import _embed_batched, _pack_by_tokens
+
+class StubModel:
+    """Tokenizes by whitespace after a BOS token, embeds a text as [its word count]; records every call."""
+    def __init__(self):
+        self.tokenized: List[str] = []
+        self.batches: List[List[str]] = []
+
+    def tokenize(self, text: bytes, add_bos: bool = True) -> List[bytes]:
+        self.tokenized.append(text.decode("utf-8"))
+        return ([b"<s>"] if add_bos else []) + text.split()
+
+    def detokenize(self, tokens: List[bytes]) -> bytes:
+        return b" ".join(token for token in tokens if token != b"<s>")
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(texts)
+        return [[float(len(text.split()))] for text in texts]
+
+def test_pack_by_tokens_empty_input():
+    assert _pack_by_tokens([], n_batch=100, max_seqs=4) == []
+
+def test_pack_by_tokens_input_longer_than_n_batch_gets_a_batch_of_its_own():
+    assert _pack_by_tokens([10, 250, 10], n_batch=100, max_seqs=4) == [[0], [1], [2]]
+    assert _pack_by_tokens([250], n_batch=100, max_seqs=4) == [[0]]
+
+def test_pack_by_tokens_exactly_max_seqs_inputs_fit_one_batch():
+    assert _pack_by_tokens([1] * 4, n_batch=100, max_seqs=4) == [[0, 1, 2, 3]]
+    assert _pack_by_tokens([1] * 5, n_batch=100, max_seqs=4) == [[0, 1, 2, 3], [4]]
+
+def test_pack_by_tokens_fills_the_token_budget_in_order():
+    assert _pack_by_tokens([40, 60, 1, 99, 100], n_batch=100, max_seqs=8) == [[0, 1], [2, 3], [4]]
+
+def test_short_texts_are_not_tokenized():
+    model = StubModel()
+    texts = ["one two", "three", "four five six"]
+    assert _embed_batched(model, texts, n_ctx=64, n_batch=64, max_seqs=8) == [[2.0], [1.0], [3.0]]
+    assert model.tokenized == [], "Texts shorter than n_ctx bytes can't exceed n_ctx tokens"
+    assert model.batches == [texts]
+
+def test_long_texts_are_truncated_to_n_ctx_tokens():
+    model = StubModel()
+    long_text = " ".join(f"w{i}" for i in range(100))
+    embeddings = _embed_batched(model, ["short", long_text], n_ctx=16, n_batch=64, max_seqs=8)
+    assert model.tokenized == [long_text]
+    assert embeddings == [[1.0], [15.0]], "n_ctx tokens, BOS included"
+
+def test_batches_respect_max_seqs_and_keep_input_order():
+    model = StubModel()
+    texts = [f"text {i}" for i in range(10)]
+    embeddings = _embed_batched(model, texts, n_ctx=64, n_batch=1000, max_seqs=4)
+    assert [len(batch) for batch in model.batches] == [4, 4, 2]
+    assert [text for batch in model.batches for text in batch] == texts
+    assert embeddings == [[2.0]] * 10
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,90 @@
+"""
+Tests of the embedding cache: vectors are computed once, survive a restart in the SQLite file, are never served to
+a model with other settings, and the file stays within max_disk_entries by deleting the least recently used vectors.
+"""
+
+import sys
+import sqlite3
+from typing import List
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+from llama_index.core import MockEmbedding
+from llamaindex_utils.integrations import CachedEmbedding, embedding_model_key
+
+class CountingEmbedding(MockEmbedding):
+    """Embeds every text as a constant vector, and counts the texts it embedded."""
+    embedded: List[str] = []
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [self._get_vector() for _ in texts]
+
+def disk_keys(cache_path: str) -> int:
+    with sqlite3.connect(cache_path) as db:
+        return db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+def test_vectors_survive_a_restart(tmp_path):
+    cache_path = str(tmp_path / "embeddings.sqlite")
+    model = CountingEmbedding(embed_dim=4)
+    cached = CachedEmbedding(model, model_key="model", cache_path=cache_path)
+    cached.get_text_embedding_batch(["a", "b", "a"])
+    assert model.embedded == ["a", "b"]
+    cached.close()
+
+    model = CountingEmbedding(embed_dim=4)
+    cached = CachedEmbedding(model, model_key="model", cache_path=cache_path)
+    assert cached.get_text_embedding_batch(["a", "b"]) == [[0.5] * 4] * 2
+    assert model.embedded == []
+    assert cached.stats() == {"entries": 2, "disk_entries": 2, "hits": 2, "misses": 0}
+    cached.close()
+
+def test_vectors_of_another_context_length_are_not_served(tmp_path):
+    # n_ctx truncates long texts, so it changes their vectors as much as another model would
+    cache_path = str(tmp_path / "embeddings.sqlite")
+    assert embedding_model_key("model.gguf", 512) != embedding_model_key("model.gguf", 256)
+    model = CountingEmbedding(embed_dim=4)
+    cached = CachedEmbedding(model, model_key=embedding_model_key("model.gguf", 512), cache_path=cache_path)
+    cached.get_text_embedding("a long text")
+    cached.close()
+    cached = CachedEmbedding(model, model_key=embedding_model_key("model.gguf", 256), cache_path=cache_path)
+    cached.get_text_embedding("a long text")
+    assert model.embedded == ["a long text", "a long text"]
+    cached.close()
+
+def test_disk_keeps_the_most_recently_used_vectors(tmp_path):
+    cache_path = str(tmp_path / "embeddings.sqlite")
+    model = CountingEmbedding(embed_dim=4)
+    cached = CachedEmbedding(model, model_key="model", max_entries=1, cache_path=cache_path, max_disk_entries=10)
+    cached.get_text_embedding_batch([f"old {i}" for i in range(5)])
+    cached.get_text_embedding_batch([f"used {i}" for i in range(5)])
+    cached.get_text_embedding_batch([f"old {i}" for i in range(5)])  # read back from disk: now more recent than "used"
+    assert cached.stats()["misses"] == 10
+    cached.get_text_embedding_batch([f"new {i}" for i in range(3)])  # 13 vectors: pruned down to 9
+    assert cached.stats()["disk_entries"] == disk_keys(cache_path) == 9
+    cached.close()
+
+    model = CountingEmbedding(embed_dim=4)
+    cached = CachedEmbedding(model, model_key="model", cache_path=cache_path, max_disk_entries=10)
+    cached.get_text_embedding_batch([f"old {i}" for i in range(5)] + [f"new {i}" for i in range(3)])
+    assert model.embedded == [], "The most recently used vectors are kept"
+    cached.get_text_embedding_batch([f"used {i}" for i in range(5)])
+    assert len(model.embedded) == 4, "The least recently used vectors are deleted first"
+    cached.close()
+
+def test_existing_file_is_migrated_and_pruned(tmp_path):
+    # a file written before the store was bounded has no last_used column
+    cache_path = str(tmp_path / "embeddings.sqlite")
+    with sqlite3.connect(cache_path) as db:
+        db.execute("CREATE TABLE embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        db.executemany("INSERT INTO embeddings VALUES (?, ?)", [(str(i), b"\0" * 16) for i in range(50)])
+    cached = CachedEmbedding(CountingEmbedding(embed_dim=4), model_key="model", cache_path=cache_path, max_disk_entries=20)
+    assert cached.stats()["disk_entries"] == disk_keys(cache_path) == 18
+    cached.get_text_embedding("a")
+    assert disk_keys(cache_path) == 19
+    cached.close()
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
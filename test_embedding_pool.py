@@ -0,0 +1,112 @@
+"""
+Tests of the embedding worker pool against a stub worker (no model is loaded): results come back in input order
+whichever worker embedded them, worker errors reach the caller, and a dead worker or a closed pool fails the pending
+tasks instead of leaving their callers waiting forever.
+"""
+
+import sys
+import os
+import time
+import threading
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+import pytest
+from llamaindex_utils.integrations import LlamaCppEmbeddingPool
+
+def stub_worker(model_path, n_ctx, n_batch, max_batch_seqs, n_threads, tasks, results) -> None:
+    """
+    Stands in for _embedding_worker: embeds a text as [its length, worker pid]. The text "fail" raises in the worker,
+    "die" kills it, and texts starting with "slow" take a second.
+    """
+    results.put(("ready", None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, texts = task
+        if "die" in texts:
+            os._exit(3)
+        if "fail" in texts:
+            results.put((task_id, RuntimeError("Embedding worker failed: stub failure")))
+            continue
+        if any(text.startswith("slow") for text in texts):
+            time.sleep(1)
+        time.sleep(0.05)  # lets the other worker pick up the next task
+        results.put((task_id, [[float(len(text)), float(os.getpid())] for text in texts]))
+
+class StubEmbeddingPool(LlamaCppEmbeddingPool):
+    worker_target = staticmethod(stub_worker)
+
+def start_pool() -> StubEmbeddingPool:
+    return StubEmbeddingPool(model_path="stub.gguf", n_workers=2, max_batch_seqs=2)
+
+@pytest.fixture(scope="module")
+def shared_pool():
+    # workers take seconds to start (they import this module), so tests that leave the pool intact share one
+    pool = start_pool()
+    yield pool
+    pool.close()
+
+@pytest.fixture
+def pool():
+    pool = start_pool()
+    yield pool
+    pool.close()
+
+def test_results_are_in_input_order_across_workers(shared_pool):
+    pool = shared_pool
+    texts = ["a" * length for length in range(1, 21)]
+    embeddings = pool.get_text_embedding_batch(texts)
+    assert [embedding[0] for embedding in embeddings] == [float(length) for length in range(1, 21)]
+    assert len({embedding[1] for embedding in embeddings}) == 2, "Batches should be spread over both workers"
+    assert pool.get_query_embedding("abc")[0] == 3.0
+
+def test_worker_error_reaches_the_caller(shared_pool):
+    pool = shared_pool
+    with pytest.raises(RuntimeError, match="stub failure"):
+        pool.get_text_embedding_batch(["ok", "fail"])
+    assert pool.get_text_embedding("still ok")[0] == 8.0, "The pool keeps working after a failed task"
+
+def test_dead_worker_fails_pending_tasks(pool):
+    result = {}
+
+    def embed_slowly() -> None:
+        try:
+            result["embedding"] = pool.get_text_embedding("slow")
+        except RuntimeError as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=embed_slowly)
+    thread.start()
+    time.sleep(0.3)  # one worker is busy with "slow", the other one takes "die"
+    with pytest.raises(RuntimeError, match="died"):
+        pool.get_text_embedding("die")
+    thread.join(10)
+    assert not thread.is_alive(), "A pending task must not wait forever"
+    # the task of the surviving worker may have finished or failed with the dead one, but it never hangs
+    assert "embedding" in result or "died" in str(result["error"])
+    assert pool.get_text_embedding("abcd")[0] == 4.0, "The remaining worker keeps serving"
+
+def test_close_fails_pending_tasks(pool):
+    result = {}
+
+    def embed_slowly() -> None:
+        try:
+            result["embedding"] = pool.get_text_embedding("slow")
+        except RuntimeError as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=embed_slowly)
+    thread.start()
+    time.sleep(0.3)
+    pool.close()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert "closed" in str(result["error"])
+    with pytest.raises(RuntimeError, match="closed"):
+        pool.get_text_embedding("abc")
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,241 @@
+"""
+Tests of the ingestion pipeline: a full run indexes every page, cancelling mid-ingest stops every stage
+instead of leaving run() (and PDFAgent.cancel_indexing joining it) blocked on a queue, and a new version of a file
+only embeds the pages whose text changed, and page fingerprints tell which pages render the same.
+"""
+
+import hashlib
+import sys
+import threading
+from typing import List
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+import pymupdf as pd
+from llama_index.core import MockEmbedding, StorageContext, VectorStoreIndex
+from llama_index.core.node_parser import SentenceSplitter
+from llamaindex_utils.vector_stores import NumpyVectorStore
+from src.backend.cache import IndexCache, PageDiff, PageManifestCache, file_sha256, page_fingerprints
+from src.backend.ingest import IngestionPipeline, reusable_nodes
+
+def make_pdf(path, page_count: int, texts: List[str] = None) -> str:
+    document = pd.open()
+    texts = texts or [f"Page {page_number}: error code E{page_number:03d} is explained here." for page_number in range(1, page_count + 1)]
+    for text in texts:
+        document.new_page().insert_text((72, 72), text)
+    document.save(str(path))
+    document.close()
+    return str(path)
+
+def make_index(embed_model: MockEmbedding) -> VectorStoreIndex:
+    return VectorStoreIndex(nodes=[], embed_model=embed_model,
+                            storage_context=StorageContext.from_defaults(vector_store=NumpyVectorStore()))
+
+def run_in_thread(pipeline: IngestionPipeline, timeout: float = 10.0) -> dict:
+    """Runs the pipeline, failing the test if run() hasn't returned within timeout seconds."""
+    result = {}
+
+    def run() -> None:
+        try:
+            result["nodes"] = pipeline.run()
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "IngestionPipeline.run() hung"
+    if "error" in result:
+        raise result["error"]
+    return result
+
+def test_full_run_indexes_every_page(tmp_path):
+    embed_model = MockEmbedding(embed_dim=8)
+    index = make_index(embed_model)
+    progress = []
+    result = run_in_thread(IngestionPipeline(make_pdf(tmp_path / "doc.pdf", 30), 30, index, embed_model=embed_model, embed_batch_size=4,
+                                             on_progress=lambda *args: progress.append(args)))
+    assert result["nodes"] == index.vector_store.size == 30
+    assert progress[-1] == (30, 30, 30)
+
+def test_cancel_mid_ingest_returns(tmp_path):
+    embed_model = MockEmbedding(embed_dim=8)
+    index = make_index(embed_model)
+    cancel_event = threading.Event()
+    progress = []
+
+    def cancel_after_first_batch(pages_done: int, total_pages: int, nodes_done: int) -> None:
+        progress.append((pages_done, total_pages, nodes_done))
+        cancel_event.set()
+
+    pipeline = IngestionPipeline(make_pdf(tmp_path / "doc.pdf", 300), 300, index, embed_model=embed_model, embed_batch_size=4, queue_size=2,
+                                 on_progress=cancel_after_first_batch, cancel_event=cancel_event, first_batch_pages=2)
+    result = run_in_thread(pipeline)
+    assert result["nodes"] == index.vector_store.size < 300
+    assert progress == [(2, 300, 2)], "A cancelled run must not report further progress"
+
+class CancellingSplitter:
+    """Chunks like the default splitter, and cancels the pipeline when it reaches a given page."""
+    def __init__(self, cancel_event: threading.Event, cancel_page: int):
+        self.splitter = SentenceSplitter()
+        self.cancel_event = cancel_event
+        self.cancel_page = cancel_page
+
+    def get_nodes_from_documents(self, documents):
+        if int(documents[0].metadata["page_label"]) == self.cancel_page:
+            self.cancel_event.set()
+        return self.splitter.get_nodes_from_documents(documents)
+
+def test_cancel_while_embedder_waits_returns(tmp_path):
+    # the producer and chunker stop on cancel while the embedder is waiting for their next node
+    embed_model = MockEmbedding(embed_dim=8)
+    index = make_index(embed_model)
+    cancel_event = threading.Event()
+    pipeline = IngestionPipeline(make_pdf(tmp_path / "doc.pdf", 300), 300, index, embed_model=embed_model, embed_batch_size=4,
+                                 node_parser=CancellingSplitter(cancel_event, cancel_page=5), cancel_event=cancel_event)
+    result = run_in_thread(pipeline)
+    assert result["nodes"] == index.vector_store.size < 300
+
+def test_cancel_before_start_returns(tmp_path):
+    embed_model = MockEmbedding(embed_dim=8)
+    index = make_index(embed_model)
+    cancel_event = threading.Event()
+    cancel_event.set()
+    result = run_in_thread(IngestionPipeline(make_pdf(tmp_path / "doc.pdf", 50), 50, index, embed_model=embed_model, cancel_event=cancel_event))
+    assert result["nodes"] == 0
+
+class RecordingEmbedding(MockEmbedding):
+    """Embeds every text as a vector derived from its hash, and records the texts it embedded."""
+    embedded: List[str] = []
+
+    def _embed(self, text: str) -> List[float]:
+        self.embedded.append(text)
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255 for b in digest[:self.embed_dim]]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+def test_new_version_reuses_unchanged_pages(tmp_path):
+    path = tmp_path / "manual.pdf"
+    v1_texts = [f"Page {n}: error code E{n:03d} is explained here." for n in range(1, 7)]
+    manifests = PageManifestCache(str(tmp_path / "pages"))
+    index_cache = IndexCache(str(tmp_path / "indexes"), max_bytes=2**30)
+
+    make_pdf(path, 6, v1_texts)
+    v1_hash = file_sha256(str(path))
+    with pd.open(str(path)) as v1:
+        manifests.store(v1_hash, str(path), page_fingerprints(v1))
+    embed_model = RecordingEmbedding(embed_dim=8)
+    v1_index = make_index(embed_model)
+    run_in_thread(IngestionPipeline(str(path), 6, v1_index, embed_model=embed_model))
+    v1_embeddings = {node.get_content(): v1_index.vector_store.get(node.node_id) for node in v1_index.docstore.docs.values()}
+    index_cache.store("v1", v1_index)
+
+    # v2 rewrites page 3 and inserts a page after page 4: old pages 5 and 6 move to 6 and 7
+    v2_texts = v1_texts[:2] + ["Page 3: error code E003 now means the filter is clogged."] + v1_texts[3:4] \
+        + ["A new troubleshooting page."] + v1_texts[4:]
+    make_pdf(path, 7, v2_texts)
+    v2_hash = file_sha256(str(path))
+    previous = manifests.previous_version(v2_hash, str(path))
+    assert previous is not None and previous["doc_hash"] == v1_hash
+    with pd.open(str(path)) as v2:
+        diff = PageDiff.compare(previous, page_fingerprints(v2), "manual.pdf")
+    assert diff.text_changed == [2, 4]
+    assert diff.text_matches == {0: 0, 1: 1, 3: 3, 5: 4, 6: 5}
+    assert diff.removed == 1
+    assert "Text changed (re-embedded): p. 3, 5" in diff.report()
+
+    reused = reusable_nodes(diff, str(path), index_cache.path("v1"))
+    assert sorted(reused) == [0, 1, 3, 5, 6]
+    for page_index, nodes in reused.items():
+        assert nodes
+        for node in nodes:
+            assert node.metadata["page_label"] == str(page_index + 1)
+            assert node.get_content() == v2_texts[page_index].strip()
+            assert node.embedding == v1_embeddings[node.get_content()], "Reused nodes must keep the previous version's embedding"
+
+    embed_model.embedded.clear()
+    v2_index = make_index(embed_model)
+    result = run_in_thread(IngestionPipeline(str(path), 7, v2_index, embed_model=embed_model, reused_nodes=reused))
+    # embedded texts are prefixed with the node's metadata
+    assert sorted(text.rsplit("\n", 1)[-1] for text in embed_model.embedded) == sorted(v2_texts[i] for i in diff.text_changed), \
+        "Only changed pages may be embedded"
+    assert result["nodes"] == v2_index.vector_store.size
+    assert sorted(int(node.metadata["page_label"]) for node in v2_index.docstore.docs.values()) == list(range(1, 8))
+
+def test_image_hash_covers_page_resources(tmp_path):
+    # the same content stream drawing with another font under the same resource name renders differently
+    make_pdf(tmp_path / "v1.pdf", 2)
+    with pd.open(str(tmp_path / "v1.pdf")) as document:
+        font_xref = document.get_new_xref()
+        document.update_object(font_xref, "<</Type/Font/Subtype/Type1/BaseFont/Times-Roman/Encoding/WinAnsiEncoding>>")
+        document.xref_set_key(document[1].xref, "Resources", f"<</Font<</helv {font_xref} 0 R>>>>")
+        document.save(str(tmp_path / "v2.pdf"), garbage=4)  # also renumbers the objects
+    with pd.open(str(tmp_path / "v1.pdf")) as v1, pd.open(str(tmp_path / "v2.pdf")) as v2:
+        (v1_page1, v1_page2), (v2_page1, v2_page2) = page_fingerprints(v1), page_fingerprints(v2)
+        assert v2[1].read_contents() == v1[1].read_contents()
+    assert v2_page1 == v1_page1, "Renumbered but unchanged objects must not change the hashes"
+    assert v2_page2[0] == v1_page2[0] and v2_page2[1] != v1_page2[1]
+
+class RevisionRecordingAgent:
+    """Stands in for PDFAgent in PDFService: records the revision every file is indexed with."""
+    def __init__(self):
+        self.revisions: List[PageDiff] = []
+
+    def create_index(self, file_path, document=None, on_progress=None, cancel_event=None, revision=None):
+        self.revisions.append(revision)
+
+    def cancel_indexing(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+def test_service_fingerprints_a_first_version_in_the_background(tmp_path, monkeypatch):
+    import src.backend.service as service_module
+    from src.backend.service import PDFService
+
+    for name, folder in (("UI_PATH", "ui"), ("PAGE_HASH_PATH", "pages"), ("DATA_PATH", "data")):
+        monkeypatch.setenv(name, str(tmp_path / folder))
+    fingerprinted = []
+    monkeypatch.setattr(service_module, "page_fingerprints", lambda document: fingerprinted.append(document.name) or page_fingerprints(document))
+    agent = RevisionRecordingAgent()
+    service = PDFService(agent=agent, lazy_rendering=False, render_workers=1)
+    try:
+        path = str(tmp_path / "manual.pdf")
+        make_pdf(path, 3)
+        service.load_pdf(path)
+        assert fingerprinted == [], "A file without a previous version must not be fingerprinted before its first page"
+        assert agent.revisions == [None]
+        service._manifest_writer.join(30)  # a version overwritten before the worker read it is not recorded
+        assert PageManifestCache(str(tmp_path / "pages")).contains(file_sha256(path), path)
+
+        make_pdf(path, 3, ["Page 1: new text.", "Page 2: error code E002 is explained here.", "Page 3: error code E003 is explained here."])
+        service.load_pdf(path)  # compared with the manifest the worker wrote for the first version
+        assert fingerprinted == [path]
+        assert agent.revisions[-1].text_changed == [0]
+    finally:
+        service.close()
+
+def test_extraction_failure_is_raised(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf")
+    embed_model = MockEmbedding(embed_dim=8)
+    try:
+        run_in_thread(IngestionPipeline(str(path), 3, make_index(embed_model), embed_model=embed_model))
+    except RuntimeError as e:
+        assert "Text extraction of" in str(e)
+    else:
+        raise AssertionError("A file whose text can't be extracted must fail the run")
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,89 @@
+"""
+Tests of the agent's chat history against a stub chat model: turns out of the window are summarized in the
+background (and sent verbatim until their summary is ready), reads keep to the token limit, and the summary and
+recent turns are saved per session and resumed from disk.
+"""
+
+import sys
+import threading
+from typing import List
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
+from src.backend.memory import RollingSummaryMemory, SessionStore
+
+class StubLLM:
+    """Summarizes by counting its calls, once released; records the prompt of every call."""
+    def __init__(self):
+        self.prompts: List[str] = []
+        self.release = threading.Event()
+
+    def chat(self, messages: List[ChatMessage], **kwargs) -> ChatResponse:
+        self.release.wait(10)
+        self.prompts.append(messages[-1].content)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=f"summary {len(self.prompts)}"))
+
+def ask(memory: RollingSummaryMemory, number: int) -> None:
+    memory.begin_turn()
+    memory.put(ChatMessage(role=MessageRole.USER, content=f"question {number}"))
+    memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=f"answer {number}"))
+    memory.end_turn()
+
+def wait_until_summarized(memory: RollingSummaryMemory, timeout: float = 10.0) -> None:
+    summarizer = memory._summarizer
+    if summarizer is not None:
+        summarizer.join(timeout)  # it saves the session once more before it exits
+        assert not summarizer.is_alive(), "The summarizer didn't finish"
+    assert memory.stats()["pending_turns"] == 0
+
+def contents(messages: List[ChatMessage]) -> List[str]:
+    return [message.content for message in messages]
+
+def test_turns_out_of_the_window_are_summarized_in_the_background(tmp_path):
+    llm = StubLLM()
+    store = SessionStore(str(tmp_path))
+    memory = RollingSummaryMemory(tokenizer_fn=str.split, llm=llm, max_turns=2, store=store, session_key="doc")
+    for number in range(1, 4):
+        ask(memory, number)
+    # turn 1 left the window, but its summary isn't written yet: it is sent verbatim meanwhile
+    assert memory.stats()["pending_turns"] == 1
+    assert contents(memory.get()) == [f"{kind} {number}" for number in range(1, 4) for kind in ("question", "answer")]
+
+    llm.release.set()
+    wait_until_summarized(memory)
+    ask(memory, 4)
+    wait_until_summarized(memory)
+    assert len(llm.prompts) == 2
+    assert "question 1" in llm.prompts[0] and "question 2" not in llm.prompts[0]
+    assert "summary 1" in llm.prompts[1] and "question 2" in llm.prompts[1], "The summary rolls: the previous one is merged"
+    history = memory.get()
+    assert history[0].role == MessageRole.SYSTEM and history[0].content.endswith("summary 2")
+    assert contents(history[1:]) == ["question 3", "answer 3", "question 4", "answer 4"]
+
+    # the session is saved after every change and resumed from disk, without calling the chat model
+    resumed = RollingSummaryMemory(tokenizer_fn=str.split, llm=StubLLM(), max_turns=2, store=SessionStore(str(tmp_path)), session_key="doc")
+    assert contents(resumed.get()) == contents(history)
+    assert RollingSummaryMemory(tokenizer_fn=str.split, store=store, session_key="other").get() == []
+
+def test_reads_keep_to_the_token_limit_and_the_current_turn():
+    # every turn is 4 tokens: with a limit of 9, the two most recent ones fit
+    memory = RollingSummaryMemory(tokenizer_fn=str.split, token_limit=9, max_turns=0)
+    for number in range(1, 5):
+        ask(memory, number)
+    assert contents(memory.get()) == ["question 3", "answer 3", "question 4", "answer 4"]
+    memory.begin_turn()
+    memory.put(ChatMessage(role=MessageRole.USER, content=" ".join(["long"] * 20)))
+    assert len(memory.get()) == 1, "The current turn is kept even past the limit"
+
+def test_without_a_chat_model_turns_out_of_the_window_are_dropped():
+    memory = RollingSummaryMemory(tokenizer_fn=str.split, max_turns=1)
+    ask(memory, 1)
+    ask(memory, 2)
+    assert contents(memory.get()) == ["question 2", "answer 2"]
+    assert memory.stats() == {"turns": 1, "pending_turns": 0, "summary_tokens": 0}
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
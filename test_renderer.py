@@ -0,0 +1,71 @@
+"""
+Tests of lazy page rendering: pages render on demand, and a page that fails to render (or a closed queue) makes
+render() raise instead of blocking forever.
+"""
+
+import sys
+import os
+import threading
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+import pymupdf as pd
+import pytest
+from src.backend.renderer import PageRenderQueue
+
+def make_pdf(path, page_count: int) -> str:
+    document = pd.open()
+    for page_number in range(1, page_count + 1):
+        document.new_page().insert_text((72, 72), f"Page {page_number}")
+    document.save(str(path))
+    document.close()
+    return str(path)
+
+def render_in_thread(render_queue: PageRenderQueue, page_index: int, timeout: float = 60.0) -> dict:
+    """Calls render without a timeout, failing the test if it hasn't returned within timeout seconds."""
+    result = {}
+
+    def render() -> None:
+        try:
+            result["path"] = render_queue.render(page_index)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=render, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"render({page_index}) hung"
+    return result
+
+def test_failed_page_raises_instead_of_blocking(tmp_path):
+    file_path = make_pdf(tmp_path / "doc.pdf", 3)
+    # the second page's image can't be written: its folder doesn't exist
+    image_paths = [str(tmp_path / "p0.png"), str(tmp_path / "missing" / "p1.png"), str(tmp_path / "p2.png")]
+    rendered = []
+    render_queue = PageRenderQueue(file_path, image_paths, dpi=36, on_rendered=lambda i, path: rendered.append(i))
+    try:
+        assert render_in_thread(render_queue, 0) == {"path": image_paths[0]}
+        assert os.path.exists(image_paths[0]) and render_queue.is_rendered(0)
+
+        result = render_in_thread(render_queue, 1)
+        assert "error" in result and "path" not in result
+        assert not render_queue.is_rendered(1)
+        assert "error" in render_in_thread(render_queue, 1), "A failed page keeps failing without being rendered again"
+
+        assert render_in_thread(render_queue, 2) == {"path": image_paths[2]}, "A failed page doesn't stop the others"
+        assert 1 not in rendered
+    finally:
+        render_queue.close()
+
+def test_closed_queue_raises_instead_of_blocking(tmp_path):
+    file_path = make_pdf(tmp_path / "doc.pdf", 2)
+    render_queue = PageRenderQueue(file_path, [str(tmp_path / "p0.png"), str(tmp_path / "p1.png")], dpi=36)
+    render_queue.close()
+    result = render_in_thread(render_queue, 0)
+    assert isinstance(result.get("error"), RuntimeError)
+    with pytest.raises(RuntimeError):
+        render_queue.render(1, timeout=5)
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
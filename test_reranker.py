@@ -0,0 +1,66 @@
+"""
+Tests of the MMR reranking stage: near-duplicate chunks give way to diverse ones, and a rerank over its latency
+budget (or missing a stored embedding) falls back to retrieval order.
+"""
+
+import sys
+import time
+from typing import List
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+import numpy as np
+from llama_index.core.schema import NodeWithScore, TextNode
+from llamaindex_utils.postprocessors import MMRReranker
+
+VECTORS = {"a": [1.0, 0.0], "a-overlap": [1.0, 0.0], "b": [0.0, 1.0]}
+
+def candidates() -> List[NodeWithScore]:
+    # retrieval order: a chunk, the chunk overlapping it, then a chunk about something else
+    return [NodeWithScore(node=TextNode(id_=node_id, text=f"text of {node_id}"), score=score)
+            for node_id, score in (("a", 0.9), ("a-overlap", 0.85), ("b", 0.8))]
+
+def stored_embeddings(nodes: List[NodeWithScore]) -> np.ndarray:
+    return np.asarray([VECTORS[node.node.node_id] for node in nodes], dtype=np.float32)
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+def ids(nodes: List[NodeWithScore]) -> List[str]:
+    return [node.node.node_id for node in nodes]
+
+def test_near_duplicates_give_way_to_diverse_chunks():
+    reranker = MMRReranker(stored_embeddings, count_words, top_n=2, mmr_lambda=0.5)
+    assert ids(reranker.postprocess_nodes(candidates())) == ["a", "b"]
+    assert ids(MMRReranker(stored_embeddings, count_words, top_n=2, mmr_lambda=1.0).postprocess_nodes(candidates())) == ["a", "a-overlap"], \
+        "With mmr_lambda 1, relevance alone ranks"
+    stats = reranker.stats()
+    assert (stats["queries"], stats["fallbacks"]) == (1, 0)
+    assert stats["prompt_tokens_saved"] == 3, "The dropped chunk's tokens never reach the prompt"
+
+def test_deadline_falls_back_to_retrieval_order():
+    def slow_embeddings(nodes: List[NodeWithScore]) -> np.ndarray:
+        time.sleep(0.05)
+        return stored_embeddings(nodes)
+
+    reranker = MMRReranker(slow_embeddings, count_words, top_n=2, budget_ms=10)
+    assert ids(reranker.postprocess_nodes(candidates())) == ["a", "a-overlap"]
+    assert reranker.stats()["fallbacks"] == 1
+
+def test_missing_embedding_falls_back_to_retrieval_order():
+    def no_embeddings(nodes: List[NodeWithScore]) -> np.ndarray:
+        raise KeyError(nodes[0].node.node_id)
+
+    reranker = MMRReranker(no_embeddings, count_words, top_n=2)
+    assert ids(reranker.postprocess_nodes(candidates())) == ["a", "a-overlap"]
+    assert reranker.stats()["fallbacks"] == 1
+
+def test_few_candidates_are_kept_as_they_are():
+    reranker = MMRReranker(stored_embeddings, count_words, top_n=3)
+    assert ids(reranker.postprocess_nodes(candidates())) == ["a", "a-overlap", "b"]
+    assert reranker.stats()["fallbacks"] == 0
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Test script for the headless server: several sessions load the same PDF and ask questions at once, against the mock
+Docker Model Runner on the port the agent talks to (12434, stop Docker Model Runner first).
+Checks that sessions share one index (memory-mapped once indexed, cited under each session's own file name),
+that answers stream as SSE, that navigation works and that admission control turns away sessions and questions over
+the limits.
+"""
+
+import sys
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+load_dotenv(verbose=True)
+
+# small limits, so a handful of clients reaches them; the mock model is slow enough for questions to overlap
+os.environ.update(SERVER_MAX_SESSIONS="4", SERVER_MAX_RUNNING_ASKS="2", SERVER_MAX_QUEUED_ASKS="1", LLM_MAX_CONCURRENCY="2",
+                  QUERY_CACHE_SIZE="0", SERVER_UPLOAD_PATH="storage/test_uploads")
+
+import httpx
+import uvicorn
+from benchmarks.mock_model_runner import MockModelRunner
+from benchmarks.bench_rag_mode import react_reply
+
+PORT = 8765
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+def make_test_pdf(path: str, topics: list) -> None:
+    import pymupdf as pd
+    document = pd.open()
+    for topic in topics:
+        document.new_page().insert_text((72, 72), topic)
+    document.save(path)
+    document.close()
+
+def navigating_reply(payload: dict) -> str:
+    """Mock model: asked to show a page of a file, calls goto_page for it; otherwise searches and answers."""
+    from src.backend.agent import GOTO_PAGE_TOOL_NAME
+    messages = payload.get("messages") or [{"content": payload.get("prompt", "")}]
+    last = str(messages[-1]["content"])
+    if last.startswith("Show page 2 of test_doc.pdf"):
+        return f"Thought: I should open the page.\nAction: {GOTO_PAGE_TOOL_NAME}\nAction Input: {json.dumps({'page_number': 2, 'file_name': 'test_doc.pdf'})}"
+    return react_reply(payload)
+
+def ask(client: httpx.Client, session_id: str, question: str) -> dict:
+    """Reads one SSE answer; returns the events by name."""
+    events = {}
+    with client.stream("POST", f"/sessions/{session_id}/ask", json={"question": question}) as response:
+        if response.status_code != 200:
+            response.read()
+            return {"status": response.status_code}
+        name = None
+        for line in response.iter_lines():
+            if line.startswith("event: "):
+                name = line[7:]
+            elif line.startswith("data: "):
+                events.setdefault(name, []).append(json.loads(line[6:]))
+    return events
+
+def test_server() -> None:
+    from src.server.app import create_app
+
+    print("1. Starting mock model runner and server...")
+    mock = MockModelRunner(port=12434, ttft=0.3, token_delay=0.01, reply_fn=navigating_reply).start()
+    server = uvicorn.Server(uvicorn.Config(create_app(), host="127.0.0.1", port=PORT, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            assert thread.is_alive(), "The server failed to start"
+            time.sleep(0.1)
+        make_test_pdf("test_doc.pdf", ["Cats are amazing animals that like to sleep and play.", "Dogs are loyal and like long walks.", "Birds sing in the morning."])
+        make_test_pdf("other_doc.pdf", ["Fish swim in the sea.", "Horses run in the fields."])
+
+        with httpx.Client(base_url=BASE_URL, timeout=120) as client:
+            print("2. Creating sessions up to the limit...")
+            sessions = [client.post("/sessions").json()["session_id"] for _ in range(4)]
+            over_limit = client.post("/sessions")
+            assert over_limit.status_code == 429, f"Expected 429 past the session limit, got {over_limit.status_code}"
+
+            print("3. Loading the same PDF in every session, under another name in the last one...")
+            with open("test_doc.pdf", "rb") as f:
+                data = f.read()
+            file_names = ["test_doc.pdf"] * 3 + ["renamed_doc.pdf"]
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                loaded = list(executor.map(lambda session_id, file_name: client.post(f"/sessions/{session_id}/documents?file_name={file_name}", content=data).json(),
+                                           sessions, file_names))
+            assert len({document["doc_id"] for document in loaded}) == 1, f"Sessions got different documents: {loaded}"
+            assert [document["file_name"] for document in loaded] == file_names, f"Sessions don't keep their file names: {loaded}"
+            for _ in range(100):  # indexing finishes in the background, then the vectors are mapped from the index cache
+                indexes = client.get("/health").json()["indexes"]
+                if indexes["memory_mapped"]:
+                    break
+                time.sleep(0.1)
+            assert indexes == {"documents": 1, "document_users": 4, "memory_mapped": 1}, f"The index is not shared: {indexes}"
+
+            print("4. Asking in every session at once...")
+            peak_llm_calls = 0
+            asking = True
+
+            def watch_llm_calls() -> None:
+                nonlocal peak_llm_calls
+                while asking:
+                    peak_llm_calls = max(peak_llm_calls, client.get("/health").json()["llm_calls"]["running"])
+                    time.sleep(0.05)
+
+            watcher = threading.Thread(target=watch_llm_calls, daemon=True)
+            watcher.start()
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                answers = list(executor.map(lambda session_id: ask(client, session_id, "What are cats like?"), sessions))
+            asking = False
+            watcher.join()
+            done = [answer for answer in answers if "done" in answer]
+            rejected = [answer for answer in answers if answer.get("status") == 429 or "error" in answer]
+            print(f"   {len(done)} answered, {len(rejected)} turned away, peak {peak_llm_calls} concurrent LLM calls")
+            assert len(done) >= 2 and len(done) + len(rejected) == 4, f"Unexpected answers: {answers}"
+            assert all(answer["done"][0]["answer"] and "token" in answer and "tool_call" in answer for answer in done)
+            assert peak_llm_calls <= 2, f"LLM_MAX_CONCURRENCY exceeded: {peak_llm_calls}"
+            for answer, file_name in zip(answers, file_names):
+                if "done" not in answer:
+                    continue
+                cited = " ".join(result["output"] for result in answer.get("tool_result", []))
+                other_name = ({"test_doc.pdf", "renamed_doc.pdf"} - {file_name}).pop()
+                assert file_name in cited and other_name not in cited, f"Sources not cited as {file_name}: {cited}"
+
+            print("5. Navigating...")
+            page = client.post(f"/sessions/{sessions[0]}/navigate", json={"page": 2}).json()
+            image = client.get(page["image_url"])
+            assert image.status_code == 200 and image.content.startswith(b"\x89PNG"), "Page image missing"
+            assert client.post(f"/sessions/{sessions[0]}/navigate", json={"page": 9}).status_code == 400
+
+            print("   ...to a page of another document of the corpus, by the agent...")
+            with open("other_doc.pdf", "rb") as f:
+                other = client.post(f"/sessions/{sessions[0]}/documents?file_name=other_doc.pdf", content=f.read()).json()
+            assert other["doc_id"] != loaded[0]["doc_id"]
+            answer = ask(client, sessions[0], "Show page 2 of test_doc.pdf")
+            assert answer.get("navigate") == [{"doc_id": loaded[0]["doc_id"], "file_name": "test_doc.pdf", "page": 2}], f"Wrong navigation: {answer}"
+
+            print("6. Closing sessions...")
+            for session_id in sessions:
+                assert client.delete(f"/sessions/{session_id}").status_code == 204
+            indexes = client.get("/health").json()["indexes"]
+            assert indexes["documents"] == 0, f"Index still held after the last session closed: {indexes}"
+
+        print("SUCCESS: Server test completed!")
+
+    finally:
+        server.should_exit = True
+        thread.join()
+        mock.stop()
+        for path in ["test_doc.pdf", "other_doc.pdf"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+if __name__ == "__main__":
+    import traceback
+    try:
+        test_server()
+        success = True
+    except Exception:
+        traceback.print_exc()
+        success = False
+    print(f"\nTest result: {'PASSED' if success else 'FAILED'}")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,351 @@
+"""
+Tests of NumpyVectorStore, the vector store behind every index: results match llama_index's SimpleVectorStore,
+deletes and replacements keep the store consistent, and persisted stores are memory-mapped and copied on write.
+Keyword search (BM25Index) and its reciprocal rank fusion with vector search in HYBRID mode, within a store and
+across the documents of a corpus (CorpusRetriever).
+Approximate search (IVFIndex): exact below the training threshold and for selective filters, and the recall its
+default settings reach on clustered embeddings, the shape real text embeddings have.
+"""
+
+import sys
+
+# Add project root to path
+sys.path.insert(0, '.')
+
+import numpy as np
+import pytest
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode
+)
+from llamaindex_utils.vector_stores import BM25Index, BM25Stats, IVFIndex, NumpyVectorStore, tokenize
+
+DIM = 16
+
+def make_nodes(count: int, seed: int = 0, ref_docs: int = 3):
+    rng = np.random.default_rng(seed)
+    return [
+        TextNode(
+            id_=f"node-{i}",
+            text=f"chunk {i} of document {i % ref_docs}",
+            embedding=rng.normal(size=DIM).tolist(),
+            metadata={"page_label": str(i % 5 + 1), "file_name": f"doc{i % ref_docs}.pdf"},
+            relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=f"doc-{i % ref_docs}")}
+        )
+        for i in range(count)
+    ]
+
+def query_vector(seed: int = 42):
+    return np.random.default_rng(seed).normal(size=DIM).tolist()
+
+@pytest.mark.parametrize("filters", [
+    None,
+    MetadataFilters(filters=[MetadataFilter(key="page_label", value="2")]),
+    MetadataFilters(filters=[MetadataFilter(key="file_name", value=["doc0.pdf", "doc2.pdf"], operator=FilterOperator.IN)])
+])
+def test_query_matches_simple_vector_store(filters):
+    nodes = make_nodes(200)
+    store, reference = NumpyVectorStore(), SimpleVectorStore()
+    store.add(nodes)
+    reference.add(nodes)
+    for seed in range(5):
+        query = VectorStoreQuery(query_embedding=query_vector(seed), similarity_top_k=10, filters=filters)
+        result, expected = store.query(query), reference.query(query)
+        assert result.ids == expected.ids
+        np.testing.assert_allclose(result.similarities, expected.similarities, rtol=1e-5, atol=1e-6)
+
+def test_query_node_ids_restricts_candidates():
+    nodes = make_nodes(50)
+    store = NumpyVectorStore()
+    store.add(nodes)
+    allowed = [f"node-{i}" for i in range(0, 50, 7)]
+    result = store.query(VectorStoreQuery(query_embedding=query_vector(), similarity_top_k=20, node_ids=allowed))
+    assert sorted(result.ids) == sorted(allowed)
+
+def test_delete_by_ref_doc_and_node_ids():
+    nodes = make_nodes(30)
+    store = NumpyVectorStore()
+    store.add(nodes)
+    store.delete("doc-1")
+    assert store.size == 20
+    assert not any(store.contains(f"node-{i}") for i in range(1, 30, 3))
+    store.delete_nodes(["node-0", "node-3"])
+    assert store.size == 18 and not store.contains("node-0")
+    # rows are renumbered: every remaining node still returns its own embedding
+    for node in nodes:
+        if store.contains(node.node_id):
+            expected = np.asarray(node.embedding) / np.linalg.norm(node.embedding)
+            np.testing.assert_allclose(store.get(node.node_id), expected, rtol=1e-5)
+    result = store.query(VectorStoreQuery(query_embedding=query_vector(), similarity_top_k=30))
+    assert len(result.ids) == 18 and "node-0" not in result.ids
+
+def test_add_replaces_existing_node():
+    nodes = make_nodes(10)
+    store = NumpyVectorStore()
+    store.add(nodes)
+    target = query_vector()
+    replacement = TextNode(id_="node-4", text="replaced", embedding=target, metadata={"page_label": "9"})
+    store.add([replacement])
+    assert store.size == 10
+    result = store.query(VectorStoreQuery(query_embedding=target, similarity_top_k=1))
+    assert result.ids == ["node-4"] and result.similarities[0] == pytest.approx(1.0, abs=1e-5)
+    filtered = store.query(VectorStoreQuery(query_embedding=target, similarity_top_k=5,
+                                            filters=MetadataFilters(filters=[MetadataFilter(key="page_label", value="9")])))
+    assert filtered.ids == ["node-4"]
+
+def test_persist_map_and_add_after_load(tmp_path):
+    nodes = make_nodes(40)
+    store = NumpyVectorStore()
+    store.add(nodes[:30])
+    persist_path = NumpyVectorStore.persist_path(str(tmp_path))
+    store.persist(persist_path)
+    query = VectorStoreQuery(query_embedding=query_vector(), similarity_top_k=5)
+    before = store.query(query)
+
+    # the persisted store is memory-mapped on load, and so is the in-memory one after map_persisted
+    loaded = NumpyVectorStore.from_persist_path(persist_path)
+    assert loaded.is_memory_mapped and not store.is_memory_mapped
+    store.map_persisted(persist_path)
+    assert store.is_memory_mapped
+    for searched in (loaded, store):
+        result = searched.query(query)
+        assert result.ids == before.ids
+        np.testing.assert_allclose(result.similarities, before.similarities, rtol=1e-6)
+        assert not searched.matrix.flags.writeable
+
+    # writes copy the matrix back into memory and leave the file untouched
+    loaded.add(nodes[30:])
+    assert not loaded.is_memory_mapped and loaded.size == 40
+    assert loaded.query(VectorStoreQuery(query_embedding=nodes[35].embedding, similarity_top_k=1)).ids == ["node-35"]
+    store.delete_nodes(["node-0"])
+    assert not store.is_memory_mapped and store.size == 29
+    assert NumpyVectorStore.from_persist_path(persist_path).size == 30
+
+def test_map_persisted_rejects_a_different_store(tmp_path):
+    store = NumpyVectorStore()
+    store.add(make_nodes(10))
+    persist_path = NumpyVectorStore.persist_path(str(tmp_path))
+    store.persist(persist_path)
+    store.add(make_nodes(12, seed=1)[10:])
+    with pytest.raises(AssertionError):
+        store.map_persisted(persist_path)
+
+def keyword_nodes():
+    texts = [
+        "Error E012 means the pump is blocked. Replace part PN-140.",
+        "The pump runs quietly at night.",
+        "Firmware 2.4.1 fixes the display flicker.",
+        "Clean the filter every month.",
+        "Part PN-200 is the spare filter."
+    ]
+    rng = np.random.default_rng(7)
+    return [TextNode(id_=f"kw-{i}", text=text, embedding=rng.normal(size=DIM).tolist()) for i, text in enumerate(texts)]
+
+def text_query(query_str: str, k: int = 5, mode=VectorStoreQueryMode.TEXT_SEARCH, embedding=None):
+    return VectorStoreQuery(query_str=query_str, query_embedding=embedding, similarity_top_k=k, mode=mode)
+
+def test_tokenize_keeps_compound_identifiers_whole_and_split():
+    assert tokenize("Replace PN-140 (see 2.4.1)") == ["replace", "pn-140", "pn", "140", "see", "2.4.1", "2", "4", "1"]
+    assert tokenize("What is the page of it?") == []
+
+def test_keyword_search_returns_only_matching_rows():
+    store = NumpyVectorStore()
+    store.add(keyword_nodes())
+    assert store.query(text_query("140")).ids == ["kw-0"]
+    # the whole code outranks rows sharing only a part of it ('pn' of PN-200)
+    assert store.query(text_query("PN-140")).ids == ["kw-0", "kw-4"]
+    assert store.query(text_query("firmware 2.4.1")).ids == ["kw-2"]
+    assert set(store.query(text_query("filter")).ids) == {"kw-3", "kw-4"}
+    assert store.query(text_query("unrelated words")).ids == []
+    # rarer terms weigh more: 'blocked' only occurs in kw-0, 'pump' in two rows
+    assert store.query(text_query("pump blocked")).ids[0] == "kw-0"
+
+def test_keyword_search_without_keyword_index_raises():
+    store = NumpyVectorStore(keyword_index=False)
+    store.add(keyword_nodes())
+    with pytest.raises(ValueError):
+        store.query(text_query("pump"))
+
+def test_rrf_ranks_rows_found_by_both_searches_first():
+    store = NumpyVectorStore(rrf_k=60)
+    rows, scores = store._fuse([np.array([0, 1, 2]), np.array([1, 3])], k=4)
+    assert rows.tolist() == [1, 0, 3, 2]  # row 1 is in both rankings, the others in one each, ordered by rank
+    np.testing.assert_allclose(scores[0], 1 / 62 + 1 / 61)
+    assert scores[1] == pytest.approx(1 / 61) and scores[2] == pytest.approx(1 / 62)
+
+def test_hybrid_query_fuses_keyword_and_vector_rankings():
+    nodes = keyword_nodes()
+    store = NumpyVectorStore()
+    store.add(nodes)
+    # the query vector is kw-3's, so vector search ranks kw-3 first; keyword search only finds kw-0 (E012).
+    # kw-0 is also somewhere in the vector ranking, so the fusion puts it ahead of kw-3
+    hybrid = store.query(text_query("E012", k=5, mode=VectorStoreQueryMode.HYBRID, embedding=nodes[3].embedding))
+    assert hybrid.ids[:2] == ["kw-0", "kw-3"]
+    assert hybrid.similarities == sorted(hybrid.similarities, reverse=True)
+    # without a query embedding, HYBRID is the keyword ranking alone
+    assert store.query(text_query("E012", k=5, mode=VectorStoreQueryMode.HYBRID)).ids == ["kw-0"]
+
+def test_deleting_nodes_updates_keyword_postings(tmp_path):
+    store = NumpyVectorStore()
+    store.add(keyword_nodes())
+    store.delete_nodes(["kw-0", "kw-2"])
+    assert store.query(text_query("140")).ids == []
+    assert store.query(text_query("firmware")).ids == []
+    # the remaining rows are renumbered: their terms still lead to them
+    assert store.query(text_query("PN-200")).ids == ["kw-4"]
+    assert store.query(text_query("pump")).ids == ["kw-1"]
+    assert set(store.query(text_query("filter")).ids) == {"kw-3", "kw-4"}
+    # replacing a node's text replaces its postings
+    store.add([TextNode(id_="kw-1", text="The fan hums.", embedding=query_vector())])
+    assert store.query(text_query("pump")).ids == [] and store.query(text_query("fan")).ids == ["kw-1"]
+    # and the postings survive persistence
+    persist_path = NumpyVectorStore.persist_path(str(tmp_path))
+    store.persist(persist_path)
+    loaded = NumpyVectorStore.from_persist_path(persist_path)
+    assert loaded.has_keyword_index
+    for query_str in ("PN-200", "fan", "filter", "pump"):
+        assert loaded.query(text_query(query_str)).ids == store.query(text_query(query_str)).ids
+
+def test_bm25_index_candidates_restrict_rows():
+    index = BM25Index()
+    index.add(["pump pump valve", "pump", "valve"])
+    rows, _ = index.search("pump", k=5)
+    assert sorted(rows.tolist()) == [0, 1]
+    rows, _ = index.search("pump", k=5, candidates=np.array([1, 2]))
+    assert rows.tolist() == [1]
+
+def test_bm25_collection_stats_score_several_indexes_as_one():
+    texts = ["pump pump valve", "pump", "valve seal", "the pump is blocked", "seal kit", "valve"]
+    whole = BM25Index()
+    whole.add(texts)
+    first, second = BM25Index(), BM25Index()
+    first.add(texts[:2])
+    second.add(texts[2:])
+    stats = BM25Stats.combine([first.term_stats("pump valve"), second.term_stats("pump valve")])
+    assert stats == whole.term_stats("pump valve")
+    rows, scores = whole.search("pump valve", k=6)
+    expected = dict(zip(rows.tolist(), scores.tolist()))
+    for offset, index in ((0, first), (2, second)):
+        rows, scores = index.search("pump valve", k=6, collection_stats=stats)
+        assert {offset + row: score for row, score in zip(rows.tolist(), scores.tolist())} == pytest.approx(
+            {row: score for row, score in expected.items() if offset <= row < offset + index.size})
+
+def corpus_documents(nodes_per_document):
+    from llama_index.core import MockEmbedding, StorageContext, VectorStoreIndex
+    from src.backend.corpus import IndexedDocument, SharedIndex
+
+    documents = {}
+    for number, nodes in enumerate(nodes_per_document):
+        storage_context = StorageContext.from_defaults(vector_store=NumpyVectorStore())
+        index = VectorStoreIndex(nodes, storage_context=storage_context, embed_model=MockEmbedding(embed_dim=DIM))
+        documents[f"doc-{number}"] = IndexedDocument(f"doc-{number}.pdf", f"doc-{number}.pdf", SharedIndex(f"doc-{number}", index))
+    return documents
+
+@pytest.mark.parametrize("mode", [VectorStoreQueryMode.TEXT_SEARCH, VectorStoreQueryMode.HYBRID])
+def test_corpus_ranks_keyword_hits_as_one_store_of_all_documents_would(mode):
+    from llama_index.core.schema import QueryBundle
+    from src.backend.corpus import CorpusRetriever
+
+    # "pump" is in every row of the first document but rare in the second: per-document IDF would rank the
+    # second document's pump rows first whatever else the query matches, and per-document RRF ties both best hits
+    rng = np.random.default_rng(3)
+    first = [f"pump {word}" for word in ("blocked", "noise", "blocked seal", "valve", "filter", "manual")]
+    second = ["pump"] + [f"filter part {i}" for i in range(9)]
+    nodes = [[TextNode(id_=f"{number}-{i}", text=text, embedding=rng.normal(size=DIM).tolist()) for i, text in enumerate(texts)]
+             for number, texts in enumerate((first, second))]
+    retriever = CorpusRetriever(corpus_documents(nodes), similarity_top_k=4, vector_store_query_mode=mode)
+    query_embedding = rng.normal(size=DIM).tolist()
+    hits = retriever.retrieve(QueryBundle("pump blocked", embedding=query_embedding))
+
+    store = NumpyVectorStore()
+    store.add([node for document_nodes in nodes for node in document_nodes])
+    expected = store.query(text_query("pump blocked", k=4, mode=mode, embedding=query_embedding))
+    assert [hit.node.node_id for hit in hits] == expected.ids
+    assert [hit.score for hit in hits] == pytest.approx(expected.similarities)
+    assert len(set(hit.score for hit in hits)) == len(hits), "Every document's best hit must not tie"
+
+def clustered_vectors(count: int, dim: int = 32, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return centers[rng.integers(0, clusters, count)] + rng.normal(scale=0.35, size=(count, dim))
+
+def vector_nodes(vectors: np.ndarray, pages: int = 10):
+    return [TextNode(id_=str(i), text="x", embedding=vector.tolist(), metadata={"page_label": str(i % pages + 1)})
+            for i, vector in enumerate(vectors)]
+
+def recall_at_10(store: NumpyVectorStore, exact: NumpyVectorStore, queries: np.ndarray) -> float:
+    hits = 0
+    for query in queries:
+        query = VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=10)
+        hits += len(set(store.query(query).ids) & set(exact.query(query).ids))
+    return hits / (10 * len(queries))
+
+def test_ivf_defaults():
+    store = NumpyVectorStore()
+    assert (store.ann, store.ivf_nlist, store.ivf_nprobe, store.ann_min_rows) == ("flat", 0, 16, 20000)
+
+def test_ivf_is_exact_below_training_threshold():
+    nodes = vector_nodes(clustered_vectors(2000))
+    exact, store = NumpyVectorStore(keyword_index=False), NumpyVectorStore(ann="ivf", ann_min_rows=5000, keyword_index=False)
+    exact.add(nodes)
+    store.add(nodes)
+    assert store._ivf is None
+    assert recall_at_10(store, exact, clustered_vectors(20, seed=1)) == 1.0
+
+def test_ivf_recall_at_default_nprobe_on_clustered_data():
+    vectors = clustered_vectors(5000)
+    nodes = vector_nodes(vectors)
+    exact = NumpyVectorStore(keyword_index=False)
+    exact.add(nodes)
+    queries = clustered_vectors(100, seed=1)
+    recalls = {}
+    for nprobe in (4, 16):
+        store = NumpyVectorStore(ann="ivf", ann_min_rows=1000, ivf_nprobe=nprobe, keyword_index=False)
+        store.add(nodes)
+        assert store._ivf.is_trained and store._ivf.nlist == int(4 * np.sqrt(5000))
+        recalls[nprobe] = recall_at_10(store, exact, queries)
+    assert recalls[16] >= 0.9, f"recall@10 at the default nprobe: {recalls[16]}"
+    assert recalls[4] <= recalls[16]
+
+def test_ivf_probing_every_list_is_exact():
+    vectors = clustered_vectors(3000)
+    index = IVFIndex(nlist=32)
+    matrix = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    index.train(matrix)
+    query = matrix[0]
+    assert index.search_rows(query, nprobe=32).tolist() == list(range(3000))
+    assert len(index.search_rows(query, nprobe=1)) < 3000
+
+def test_ivf_falls_back_to_exact_search_for_selective_filters():
+    nodes = vector_nodes(clustered_vectors(3000), pages=500)
+    exact = NumpyVectorStore(keyword_index=False)
+    store = NumpyVectorStore(ann="ivf", ann_min_rows=1000, ivf_nprobe=1, keyword_index=False)
+    exact.add(nodes)
+    store.add(nodes)
+    # 6 rows on page 7: too few of them in the one probed list, so all of them are searched exactly
+    query = VectorStoreQuery(query_embedding=clustered_vectors(1, seed=3)[0].tolist(), similarity_top_k=5,
+                             filters=MetadataFilters(filters=[MetadataFilter(key="page_label", value="7")]))
+    assert store.query(query).ids == exact.query(query).ids
+
+def test_ivf_survives_persistence_and_deletes(tmp_path):
+    nodes = vector_nodes(clustered_vectors(3000))
+    store = NumpyVectorStore(ann="ivf", ann_min_rows=1000, keyword_index=False)
+    store.add(nodes)
+    persist_path = NumpyVectorStore.persist_path(str(tmp_path))
+    store.persist(persist_path)
+    loaded = NumpyVectorStore.from_persist_path(persist_path, ann="ivf", ann_min_rows=1000, keyword_index=False)
+    np.testing.assert_array_equal(loaded._ivf.centroids, store._ivf.centroids)
+    query = VectorStoreQuery(query_embedding=clustered_vectors(1, seed=2)[0].tolist(), similarity_top_k=10)
+    assert loaded.query(query).ids == store.query(query).ids
+    removed = store.query(query).ids[0]
+    loaded.delete_nodes([removed])
+    assert len(loaded._ivf.assignments) == loaded.size == 2999
+    assert removed not in loaded.query(query).ids
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))